@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2021 Cisco Systems, Inc. and/or its affiliates
+#
+'''
+Throughput of `BulkAncEngine` applying a policy to the MAC addresses in one
+of the `sample_macs` files, against a local stand-in for the ANC service
+that answers each request after `--latency` seconds.
+
+    python benchmarks/anc_bulk.py sample_macs/sample_mac_addrs_10000.txt
+'''
+import argparse
+import asyncio
+import json
+from types import SimpleNamespace
+
+from aiohttp import web
+
+from pxgrid_util.anc import AncJob
+from pxgrid_util.anc import BulkAncEngine
+from pxgrid_util.macs import MacFileReader
+
+
+async def main(args):
+    async def handle(request):
+        await request.read()
+        await asyncio.sleep(args.latency)
+        return web.json_response({'status': 'SUCCESS'})
+
+    app = web.Application()
+    app.router.add_post('/anc/{operation}', handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    base_url = 'http://127.0.0.1:%d/anc' % site._server.sockets[0].getsockname()[1]
+
+    def jobs():
+        for mac in MacFileReader(args.macs):
+            yield AncJob('applyEndpointByMacAddress', mac, 'Quarantine')
+
+    config = SimpleNamespace(node_name='bench', ssl_context=None, timeout=10.0)
+    try:
+        for concurrency in args.concurrency:
+            async with BulkAncEngine(config, 'secret', base_url, concurrency=concurrency,
+                                     rate=args.rate) as engine:
+                stats = await engine.run(jobs())
+            print('concurrency %3d: %s' % (concurrency, json.dumps(stats, sort_keys=True)))
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('macs', help='file of MAC addresses, one per line')
+    parser.add_argument('--latency', type=float, default=0.005,
+                        help='simulated ANC service latency in seconds')
+    parser.add_argument('--rate', type=float, help='requests per second limit')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 20, 100])
+    asyncio.run(main(parser.parse_args()))
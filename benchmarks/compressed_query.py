@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2021 Cisco Systems, Inc. and/or its affiliates
+#
+'''
+Time to stream a large getSessions response through `query_stream` over a
+link limited to `--mbps` megabits per second, with and without asking for a
+gzip-compressed response.
+
+    python benchmarks/compressed_query.py --sessions 20000 --mbps 50
+'''
+import argparse
+import gzip
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from types import SimpleNamespace
+
+from pxgrid_util import query_stream
+from pxgrid_util.pool import ConnectionPool
+
+sys.path.insert(0, os.path.dirname(__file__))
+from session_hash import make_batch  # noqa: E402
+
+
+def make_handler(body, gzipped, bytes_per_second):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers['Content-Length']))
+            data = body
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            if 'gzip' in self.headers.get('Accept-Encoding', ''):
+                data = gzipped
+                self.send_header('Content-Encoding', 'gzip')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            chunk = 64 * 1024
+            for i in range(0, len(data), chunk):
+                self.wfile.write(data[i:i + chunk])
+                time.sleep(len(data[i:i + chunk]) / bytes_per_second)
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+def main(args):
+    body = json.dumps({'sessions': make_batch(args.sessions)}).encode()
+    gzipped = gzip.compress(body, compresslevel=6)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), make_handler(body, gzipped, args.mbps * 1e6 / 8))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = 'http://127.0.0.1:%d/getSessions' % server.server_address[1]
+    config = SimpleNamespace(
+        node_name='bench', ssl_context=None, timeout=60.0, hedge_after=None, compress_requests=None)
+    print('%d sessions, %d bytes, %d gzipped' % (args.sessions, len(body), len(gzipped)))
+
+    for name, accept_encoding in (('identity', None), ('gzip', 'gzip')):
+        pool = ConnectionPool(None, accept_encoding=accept_encoding)
+        start = time.monotonic()
+        count = sum(1 for _ in query_stream(config, 'secret', url, '{}', pool=pool))
+        elapsed = time.monotonic() - start
+        print('%-10s %8.2fs %9.0f sessions/s' % (name, elapsed, count / elapsed))
+        pool.close()
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sessions', type=int, default=20000)
+    parser.add_argument('--mbps', type=float, default=50.0)
+    main(parser.parse_args())
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2021 Cisco Systems, Inc. and/or its affiliates
+#
+'''
+Benchmark of writing session records: the original per-record indented
+`json.dumps` + `print` + flush, against `OutputWriter` in each format.
+Output goes to /dev/null, so this measures encoding and write overhead.
+
+    python benchmarks/output_formats.py
+'''
+import argparse
+import json
+import os
+import sys
+import timeit
+
+from pxgrid_util.output import OutputWriter
+from pxgrid_util.output import msgpack
+
+sys.path.insert(0, os.path.dirname(__file__))
+from session_hash import make_batch  # noqa: E402
+
+
+def original(batch, devnull):
+    for s in batch:
+        print(json.dumps(s, indent=2, sort_keys=True), file=devnull)
+        devnull.flush()
+
+
+def writer(batch, devnull, format):
+    output = OutputWriter(stream=devnull.buffer, format=format)
+    for s in batch:
+        output.write(s)
+    output.close()
+    return output.bytes_written
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sessions', type=int, default=10000,
+                        help='records per batch')
+    parser.add_argument('--number', type=int, default=5,
+                        help='batches per measurement')
+    args = parser.parse_args()
+
+    batch = make_batch(args.sessions)
+    formats = ['json', 'ndjson'] + (['msgpack'] if msgpack is not None else [])
+    with open(os.devnull, 'w') as devnull:
+        cases = [('original (print + flush per record)', lambda: original(batch, devnull))]
+        cases += [('OutputWriter %s' % f, lambda f=f: writer(batch, devnull, f)) for f in formats]
+        sizes = {f: writer(batch, devnull, f) for f in formats}
+        baseline = None
+        for name, fn in cases:
+            t = min(timeit.repeat(fn, number=args.number, repeat=3)) / args.number
+            baseline = baseline or t
+            size = sizes.get(name.rsplit(' ', 1)[-1])
+            print('%-40s %8.2f ms/batch %10.0f records/s %6.1fx %s' % (
+                name, t * 1000.0, args.sessions / t, baseline / t,
+                '%8.1f KiB' % (size / 1024.0) if size else ''))
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2021 Cisco Systems, Inc. and/or its affiliates
+#
+'''
+Publishing throughput over a local WebSocket server that parses the SEND
+frames it receives and answers receipts: the original one `stomp_send` per
+message, against `Publisher` with and without coalescing and receipts.
+The server runs in the same process, so each rate is measured until it has
+caught up with everything sent.
+
+    python benchmarks/publish_rate.py --messages 20000
+'''
+import argparse
+import asyncio
+import json
+import time
+
+import websockets
+
+from pxgrid_util.stomp import StompFrameReader
+from pxgrid_util.ws_stomp import Publisher
+from pxgrid_util.ws_stomp import WebSocketStomp
+
+
+async def handler(connection):
+    reader = StompFrameReader()
+    async for message in connection:
+        for frame in reader.feed(message):
+            receipt = frame.headers.get('receipt')
+            if receipt is not None:
+                await connection.send(b'RECEIPT\nreceipt-id:%s\n\n\0' % receipt.encode())
+
+
+async def payloads(count):
+    for n in range(count):
+        yield {'count': n, 'data': 'cool and froody'}
+
+
+async def settle(ws):
+    '''
+    Wait for the server to get through everything sent so far, so one run
+    does not slow down the next.
+    '''
+    await Publisher(ws, '/topic/bench', receipts=True).run(payloads(1))
+
+
+async def main(args):
+    async with websockets.serve(handler, '127.0.0.1', 0) as server:
+        port = server.sockets[0].getsockname()[1]
+        ws = WebSocketStomp('ws://127.0.0.1:%d' % port, 'bench', 'secret', None)
+        await ws.connect()
+
+        start = time.monotonic()
+        for n in range(args.messages):
+            await ws.stomp_send('/topic/bench', json.dumps({'count': n, 'data': 'cool and froody'}))
+        await settle(ws)
+        elapsed = time.monotonic() - start
+        print('%-30s %9.0f messages/s' % ('stomp_send', args.messages / elapsed))
+
+        for name, kwargs in (
+                ('publisher', {}),
+                ('publisher coalesce=50', {'coalesce': 50}),
+                ('publisher receipts', {'receipts': True}),
+                ('publisher coalesce=50 receipts', {'coalesce': 50, 'receipts': True})):
+            start = time.monotonic()
+            stats = await Publisher(ws, '/topic/bench', **kwargs).run(payloads(args.messages))
+            await settle(ws)
+            elapsed = time.monotonic() - start
+            print('%-30s %9.0f messages/s %12.0f bytes/s' % (
+                name, args.messages / elapsed, stats['bytes'] / elapsed))
+        await ws.disconnect()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=20000)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2021 Cisco Systems, Inc. and/or its affiliates
+#
+'''
+Benchmark of per-session de-duplication hashing: the original indented
+`json.dumps` + MD5 + second `json.dumps` for output, against
+`canonical_hash`, which serializes compactly once, hashes with BLAKE2b and
+reuses the serialized bytes for output.
+
+    python benchmarks/session_hash.py
+'''
+import argparse
+import hashlib
+import json
+import random
+import timeit
+
+from pxgrid_util.dedup import canonical_hash
+
+
+def make_batch(sessions, seed=1):
+    rng = random.Random(seed)
+    batch = []
+    for i in range(sessions):
+        mac = '00:50:56:%02X:%02X:%02X' % (rng.randrange(256), rng.randrange(256), rng.randrange(256))
+        batch.append({
+            'adNormalizedUser': 'user%d' % i,
+            'auditSessionId': '%032x' % rng.getrandbits(128),
+            'authenticationMethod': 'dot1x',
+            'authenticationProtocol': 'PEAP (EAP-MSCHAPv2)',
+            'callingStationId': mac,
+            'endpointOperatingSystem': rng.choice(['Windows 10', 'macOS', 'Linux']),
+            'endpointProfile': 'Workstation',
+            'ipAddresses': ['10.%d.%d.%d' % (rng.randrange(256), rng.randrange(256), rng.randrange(256))],
+            'macAddress': mac,
+            'nasIpAddress': '10.0.0.1',
+            'nasPortId': 'GigabitEthernet1/0/%d' % rng.randrange(48),
+            'selectedAuthzProfiles': ['PermitAccess'],
+            'state': 'STARTED',
+            'timestamp': '2026-05-01T00:00:%02d.%03d+00:00' % (i % 60, i % 1000),
+            'userName': 'user%d' % i,
+            'vlan': {'name': 'corp', 'id': 100},
+        })
+    return batch
+
+
+def original(batch):
+    out = []
+    for s in batch:
+        event_text = json.dumps(s, indent=2, sort_keys=True)
+        event_hash = hashlib.md5(event_text.encode()).hexdigest()
+        event_key = '{}:{}:{}'.format(s['callingStationId'], s['timestamp'], event_hash)
+        out.append((event_key, json.dumps(s, indent=2, sort_keys=True)))
+    return out
+
+
+def canonical(batch, fields=None):
+    return [canonical_hash(s, fields) for s in batch]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sessions', type=int, default=1000,
+                        help='sessions per synthetic batch')
+    parser.add_argument('--number', type=int, default=20,
+                        help='batches per measurement')
+    args = parser.parse_args()
+
+    batch = make_batch(args.sessions)
+    fields = ['callingStationId', 'state', 'ipAddresses', 'endpointOperatingSystem']
+    cases = [
+        ('original (indent + md5, dumped twice)', lambda: original(batch)),
+        ('canonical_hash', lambda: canonical(batch)),
+        ('canonical_hash, 4 fields', lambda: canonical(batch, fields)),
+    ]
+    baseline = None
+    for name, fn in cases:
+        t = min(timeit.repeat(fn, number=args.number, repeat=3)) / args.number
+        baseline = baseline or t
+        print('%-40s %8.2f ms/batch %10.0f sessions/s %6.1fx' % (
+            name, t * 1000.0, args.sessions / t, baseline / t))
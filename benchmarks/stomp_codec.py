@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2021 Cisco Systems, Inc. and/or its affiliates
+#
+'''
+Micro-benchmark comparing the text-based `StompFrame.parse`/`write` path with
+the bytes-based `StompFrame.decode`/`encode` codec on synthetic sessionTopic
+MESSAGE frames of increasing size.
+
+    python benchmarks/stomp_codec.py
+'''
+import argparse
+import io
+import json
+import timeit
+
+from pxgrid_util.stomp import StompFrame
+
+
+def make_session(i):
+    return {
+        'callingStationId': '00:50:56:%02X:%02X:%02X' % (i >> 16 & 0xff, i >> 8 & 0xff, i & 0xff),
+        'macAddress': '00:50:56:%02X:%02X:%02X' % (i >> 16 & 0xff, i >> 8 & 0xff, i & 0xff),
+        'ipAddresses': ['10.%d.%d.%d' % (i >> 16 & 0xff, i >> 8 & 0xff, i & 0xff)],
+        'nasIpAddress': '10.0.0.1',
+        'state': 'STARTED',
+        'timestamp': '2026-05-01T00:00:00.%03d+00:00' % (i % 1000),
+        'userName': 'user%d' % i,
+        'endpointProfile': 'Windows10-Workstation',
+    }
+
+
+def make_message(sessions):
+    body = json.dumps({'sessions': [make_session(i) for i in range(sessions)]})
+    frame = StompFrame()
+    frame.set_command('MESSAGE')
+    frame.set_header('destination', '/topic/com.cisco.ise.session')
+    frame.set_header('message-id', '1')
+    frame.set_header('subscription', 'sub-0')
+    frame.set_content(body)
+    out = io.StringIO()
+    frame.write(out)
+    return frame, out.getvalue().encode('utf-8')
+
+
+def legacy_parse(message):
+    return StompFrame.parse(io.StringIO(message.decode('utf-8'))).get_content()
+
+
+def codec_decode(message):
+    return bytes(StompFrame.decode(message).get_content())
+
+
+def legacy_write(frame):
+    out = io.StringIO()
+    frame.write(out)
+    return out.getvalue().encode('utf-8')
+
+
+def codec_encode(frame):
+    return frame.encode()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 1000, 20000],
+                        help='number of sessions per MESSAGE frame')
+    parser.add_argument('--number', type=int, default=20,
+                        help='iterations per measurement')
+    args = parser.parse_args()
+
+    print('%-8s %10s %12s %12s %8s %12s %12s %8s' % (
+        'sessions', 'bytes', 'parse ms', 'decode ms', 'speedup',
+        'write ms', 'encode ms', 'speedup'))
+    for sessions in args.sizes:
+        frame, message = make_message(sessions)
+        assert legacy_parse(message).encode('utf-8') == codec_decode(message)
+        results = []
+        for fn, arg in ((legacy_parse, message), (codec_decode, message),
+                        (legacy_write, frame), (codec_encode, frame)):
+            t = min(timeit.repeat(lambda: fn(arg), number=args.number, repeat=3))
+            results.append(t / args.number * 1000.0)
+        print('%-8d %10d %12.3f %12.3f %7.1fx %12.3f %12.3f %7.1fx' % (
+            sessions, len(message),
+            results[0], results[1], results[0] / results[1],
+            results[2], results[3], results[2] / results[3]))
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2021 Cisco Systems, Inc. and/or its affiliates
+#
+'''
+Peak memory and time of turning a large getSessions response into NDJSON:
+the original read + decode + `json.loads` of the whole body, against
+`iter_json_items` parsing the response as it is read.
+
+    python benchmarks/streaming_query.py --sessions 50000
+'''
+import argparse
+import io
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+from pxgrid_util.output import OutputWriter
+from pxgrid_util.streaming import iter_json_items
+
+sys.path.insert(0, os.path.dirname(__file__))
+from session_hash import make_batch  # noqa: E402
+
+
+class Body(io.RawIOBase):
+    '''
+    Serves a JSON document in chunks, as a socket would, without holding the
+    encoded document in memory.
+    '''
+
+    def __init__(self, sessions):
+        self.chunks = self.generate(sessions)
+        self.pending = bytearray()
+
+    @staticmethod
+    def generate(sessions):
+        yield b'{"sessions": ['
+        for i in range(sessions):
+            yield (b', ' if i else b'') + json.dumps(make_batch(1, seed=i)[0]).encode()
+        yield b']}'
+
+    def read(self, size=-1):
+        if size < 0:
+            data = bytes(self.pending) + b''.join(self.chunks)
+            self.pending.clear()
+            return data
+        while len(self.pending) < size:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                break
+            self.pending += chunk
+        data = bytes(self.pending[:size])
+        del self.pending[:size]
+        return data
+
+
+def original(body, output):
+    for s in json.loads(body.read().decode())['sessions']:
+        output.write(s)
+
+
+def streaming(body, output):
+    for s in iter_json_items(body):
+        output.write(s)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sessions', type=int, default=20000)
+    args = parser.parse_args()
+
+    with open(os.devnull, 'wb') as devnull:
+        for name, fn in [('original (read all + json.loads)', original), ('iter_json_items', streaming)]:
+            body = Body(args.sessions)
+            output = OutputWriter(stream=devnull, format='ndjson')
+            tracemalloc.start()
+            start = time.perf_counter()
+            fn(body, output)
+            output.close()
+            elapsed = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print('%-36s %8.2f s %10.1f MiB peak' % (name, elapsed, peak / 1024.0 / 1024.0))
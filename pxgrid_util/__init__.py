@@ -11,14 +11,44 @@ except ImportError:
 else:
     __version__ = _version.version
 
-import urllib
 import base64
+import contextlib
+import json
 from urllib.parse import urlparse
+from .anc import AncBatchReader
+from .anc import AncJob
+from .anc import BulkAncEngine
+from .backoff import ExponentialBackoff
+from .compression import compress_body
 from .config import Config
 from .create_account_config import CreateAccountConfig
+from .dedup import SessionDeduplicator
+from .dedup import SessionMerger
+from .dedup import canonical_hash
+from .dedup import canonical_json
 from .filtering import build_query_payload
 from .filtering import validate_filter_syntax
+from .macs import MacFileReader
+from .nodes import NodeSelector
+from .output import OutputWriter
+from .output import open_output
+from .pagination import PageCheckpoint
+from .pagination import Paginator
+from .pipeline import EventPipeline
+from .pool import ConnectionPool
+from .pool import shared_pool
+from .pxgrid import AsyncPXGridControl
 from .pxgrid import PXGridControl
+from .registration import ServiceRegistration
+from .snapshot import Snapshot
+from .store import SessionStore
+from .store import newest_session
+from .streaming import JSONArrayStream
+from .sync import SyncState
+from .streaming import iter_json_items
+from .ws_stomp import Publisher
+from .ws_stomp import StompError
+from .ws_stomp import Subscription
 from .ws_stomp import WebSocketStomp
 
 
@@ -38,13 +68,147 @@ def create_override_url(config: Config, discovered_url: str) -> str:
     return new_url
 
 
-def query(config, secret, url, payload):
-    handler = urllib.request.HTTPSHandler(context=config.ssl_context)
-    opener = urllib.request.build_opener(handler)
-    rest_request = urllib.request.Request(url=url, data=str.encode(payload))
-    rest_request.add_header('Content-Type', 'application/json')
-    rest_request.add_header('Accept', 'application/json')
+def query_headers(config, secret):
     b64 = base64.b64encode((config.node_name + ':' + secret).encode()).decode()
-    rest_request.add_header('Authorization', 'Basic ' + b64)
-    rest_response = opener.open(rest_request, timeout=config.timeout)
-    return rest_response.read().decode()
+    return {
+        'Content-Type': 'application/json',
+        'Accept': 'application/json',
+        'Authorization': 'Basic ' + b64,
+    }
+
+
+def service_nodes(pxgrid, config, service_lookup_response, path, secrets=None):
+    '''
+    `(url, secret, guard)` for `path` on each node providing a looked-up
+    service, for the `nodes` argument of the query functions. Secrets not
+    already known from `secrets` (by node name) are callables, so they are
+    only fetched if that node is used. `guard()` is
+    `pxgrid.invalidate_on_error` for the node, so a 401 or 404 drops the
+    cached secret of the node that actually answered.
+    '''
+    secrets = secrets or {}
+    nodes = []
+    for service in service_lookup_response['services']:
+        url = service['properties']['restBaseUrl'] + path
+        if config.discovery_override:
+            url = create_override_url(config, url)
+        if any(url == other[0] for other in nodes):
+            continue
+        node_name = service['nodeName']
+        secret = secrets.get(node_name)
+        if secret is None:
+            secret = lambda node_name=node_name: pxgrid.get_access_secret(node_name)['secret']
+        guard = lambda node_name=node_name: pxgrid.invalidate_on_error(peer_node_name=node_name)
+        nodes.append((url, secret, guard))
+    return nodes
+
+
+def open_query(config, secret, url, payload, pool=None, nodes=None):
+    '''
+    Send a query and return the response once its headers have arrived.
+    Given `nodes` (see `service_nodes`), the query goes to the healthiest
+    of them instead, failing over to the others and hedged after
+    `--hedge-after` seconds; see `NodeSelector`. Payloads of at least
+    `--compress-requests` bytes are sent gzipped, and a compressed response
+    is decoded as it is read.
+    '''
+    if pool is None:
+        pool = shared_pool(config.ssl_context)
+    body, content_encoding = str.encode(payload), None
+    if config.compress_requests is not None:
+        body, content_encoding = compress_body(body, min_bytes=config.compress_requests)
+
+    def send(node):
+        node_url, node_secret = node[:2]
+        guard = node[2]() if len(node) > 2 else contextlib.nullcontext()
+        with guard:
+            if callable(node_secret):
+                node_secret = node_secret()
+            headers = query_headers(config, node_secret)
+            if content_encoding is not None:
+                headers['Content-Encoding'] = content_encoding
+            return pool.urlopen('POST', node_url, body=body, headers=headers, timeout=config.timeout)
+
+    selector = NodeSelector(nodes or [(url, secret)], key=lambda node: urlparse(node[0]).netloc)
+    return selector.call(send, hedge_after=config.hedge_after, discard=lambda response: response.close())
+
+
+def query(config, secret, url, payload, pool=None, nodes=None):
+    with open_query(config, secret, url, payload, pool=pool, nodes=nodes) as response:
+        return response.read().decode()
+
+
+def query_stream(config, secret, url, payload, pool=None, nodes=None):
+    '''
+    Like `query`, but yields `(key, element)` for each element of the
+    top-level arrays of the response as it is read, rather than returning
+    the whole response body. The request is sent on the first `next()`.
+    '''
+    with open_query(config, secret, url, payload, pool=pool, nodes=nodes) as response:
+        yield from JSONArrayStream(response)
+
+
+def write_query(output, config, secret, url, payload, pool=None, sync_service=None, nodes=None):
+    '''
+    Query and write the response to `output`. For `json` output the
+    response is written as one document. Otherwise each element of its
+    top-level arrays is written as a record while the response is still
+    being read, so memory use does not grow with the size of the result.
+
+    If `sync_service` names the service being queried and `--sync-state`
+    was given, the query is made incremental; see `write_synced_query`.
+    `nodes` spreads the query over the nodes of the service; see
+    `open_query`.
+    '''
+    if sync_service is not None and config.sync_state:
+        with SyncState(config.sync_state) as state:
+            return write_synced_query(
+                output, state, sync_service, config, secret, url, payload, pool=pool, nodes=nodes)
+    if output.format == 'json':
+        resp = query(config, secret, url, payload, pool=pool, nodes=nodes)
+        output.write(json.loads(resp) if len(resp) != 0 else {})
+        return
+    for key, item in query_stream(config, secret, url, payload, pool=pool, nodes=nodes):
+        output.write(item)
+
+
+def write_synced_query(output, state, service_name, config, secret, url, payload, pool=None, batch_size=1000,
+                       nodes=None):
+    '''
+    As `write_query`, but unless the payload already has a startTimestamp,
+    only asks for changes since the watermark saved in `state` by the last
+    sync of the same service, query and filter. The records received are
+    written to `output` and merged into the snapshot in `state`, and the
+    watermark is moved forward once the whole response has been merged.
+    '''
+    endpoint = url.rsplit('/', 1)[-1]
+    request = json.loads(payload) if payload else {}
+    scope = request.get('filter') or ''
+    if 'startTimestamp' not in request:
+        watermark = state.watermark(service_name, endpoint, scope)
+        if watermark is not None:
+            logger.info('syncing %s/%s from %s', service_name, endpoint, watermark)
+            request['startTimestamp'] = watermark
+    next_watermark = state.begin()
+    payload = json.dumps(request)
+    try:
+        if output.format == 'json':
+            resp = query(config, secret, url, payload, pool=pool, nodes=nodes)
+            resp = json.loads(resp) if len(resp) != 0 else {}
+            for value in (resp.values() if isinstance(resp, dict) else [resp]):
+                if isinstance(value, list):
+                    state.merge(service_name, endpoint, value, scope=scope)
+            output.write(resp)
+        else:
+            batch = []
+            for key, item in query_stream(config, secret, url, payload, pool=pool, nodes=nodes):
+                output.write(item)
+                batch.append(item)
+                if len(batch) >= batch_size:
+                    state.merge(service_name, endpoint, batch, scope=scope)
+                    batch = []
+            state.merge(service_name, endpoint, batch, scope=scope)
+    except BaseException:
+        state.rollback()
+        raise
+    state.commit(service_name, endpoint, next_watermark, scope=scope)
@@ -0,0 +1,398 @@
+import asyncio
+import base64
+import collections
+import csv
+import ipaddress
+import json
+import logging
+import time
+
+import aiohttp
+
+from .backoff import ExponentialBackoff
+from .macs import format_mac
+from .macs import parse_mac
+from .ratelimit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ANC_CONCURRENCY = 20
+DEFAULT_ANC_RETRIES = 3
+
+# statuses worth retrying: throttled, or the server having a bad moment
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+# ANC operations, with the payload field holding the endpoint and whether a
+# policy name is needed
+OPERATIONS = {
+    'applyEndpointByMacAddress': ('macAddress', True),
+    'applyEndpointByIpAddress': ('ipAddress', True),
+    'clearEndpointByMacAddress': ('macAddress', False),
+    'clearEndpointByIpAddress': ('ipAddress', False),
+}
+
+
+# short operation names accepted in batch files, by whether the endpoint is
+# given as an IP address
+OPERATION_ALIASES = {
+    ('apply', False): 'applyEndpointByMacAddress',
+    ('apply', True): 'applyEndpointByIpAddress',
+    ('clear', False): 'clearEndpointByMacAddress',
+    ('clear', True): 'clearEndpointByIpAddress',
+}
+
+
+class AncJob:
+    '''
+    One ANC operation on one endpoint (a MAC or IP address). `seq` is the
+    job's position in a batch file, if it came from one.
+    '''
+
+    def __init__(self, operation, key, policy=None, seq=None):
+        if operation not in OPERATIONS:
+            raise ValueError('unknown ANC operation %r' % operation)
+        needs_policy = OPERATIONS[operation][1]
+        if needs_policy and not policy:
+            raise ValueError('%s needs a policy name' % operation)
+        self.operation = operation
+        self.key = key
+        self.policy = policy if needs_policy else None
+        self.seq = seq
+
+    def done_key(self):
+        '''
+        Identifies the job in a result log, for resuming.
+        '''
+        return (self.operation, self.key, self.seq)
+
+    def payload(self):
+        field, needs_policy = OPERATIONS[self.operation]
+        payload = {field: self.key}
+        if needs_policy:
+            payload['policyName'] = self.policy
+        return payload
+
+    def __repr__(self):
+        return 'AncJob(%r, %r, %r, seq=%r)' % (self.operation, self.key, self.policy, self.seq)
+
+
+def is_ip_address(key):
+    try:
+        ipaddress.ip_address(key)
+        return True
+    except ValueError:
+        return False
+
+
+class AncBatchReader:
+    '''
+    Lazily reads ANC jobs from a batch file with an operation, an endpoint
+    and (for applies) a policy name per row, either as CSV (with an
+    optional `operation,key,policy` header) or as NDJSON objects with those
+    keys. The operation is an ANC API name such as
+    `clearEndpointByIpAddress`, or `apply`/`clear` to choose by whether the
+    endpoint is a MAC or an IP address; a missing policy defaults to
+    `default_policy`. MAC addresses are normalized to ISE's notation.
+
+    A row repeating the previous row for the same endpoint is skipped as a
+    duplicate, and unusable rows are skipped with a warning; both are
+    counted.
+    '''
+
+    def __init__(self, path, default_policy=None):
+        self.path = path
+        self.default_policy = default_policy
+        self.rows = 0
+        self.jobs = 0
+        self.duplicates = 0
+        self.invalid = 0
+
+    def _rows(self, f):
+        first = f.readline()
+        f.seek(0)
+        if first.lstrip().startswith('{'):
+            for line in f:
+                if line.strip():
+                    # decoded by job(), so a malformed line is skipped like any other bad row
+                    yield line
+            return
+        for row in csv.reader(f):
+            if not row or not ''.join(row).strip() or row[0].strip().startswith('#'):
+                continue
+            if [c.strip().lower() for c in row[:2]] == ['operation', 'key']:
+                continue
+            yield dict(zip(('operation', 'key', 'policy'), (c.strip() for c in row)))
+
+    def job(self, row, seq):
+        if isinstance(row, str):
+            row = json.loads(row)
+        operation = (row.get('operation') or '').strip()
+        key = (row.get('key') or '').strip()
+        policy = (row.get('policy') or '').strip() or self.default_policy
+        if not key:
+            raise ValueError('no endpoint')
+        by_ip = is_ip_address(key)
+        operation = OPERATION_ALIASES.get((operation.lower(), by_ip), operation)
+        if operation in OPERATIONS and OPERATIONS[operation][0] == 'macAddress':
+            key = format_mac(parse_mac(key))
+        return AncJob(operation, key, policy, seq=seq)
+
+    def __iter__(self):
+        last = {}
+        with open(self.path, 'r', newline='') as f:
+            for seq, row in enumerate(self._rows(f), 1):
+                self.rows += 1
+                try:
+                    job = self.job(row, seq)
+                except (ValueError, AttributeError) as e:
+                    self.invalid += 1
+                    logger.warning('%s row %d skipped: %s', self.path, seq, e)
+                    continue
+                signature = (job.operation, job.policy)
+                if last.get(job.key) == signature:
+                    self.duplicates += 1
+                    continue
+                last[job.key] = signature
+                self.jobs += 1
+                yield job
+
+    def stats(self):
+        return {
+            'rows': self.rows,
+            'jobs': self.jobs,
+            'duplicates': self.duplicates,
+            'invalid': self.invalid,
+        }
+
+
+def completed_jobs(result_log):
+    '''
+    The `AncJob.done_key()` of the jobs recorded as successful in a result log
+    written by `BulkAncEngine`.
+    '''
+    done = set()
+    try:
+        with open(result_log, 'r') as f:
+            for line in f:
+                try:
+                    result = json.loads(line)
+                except ValueError:
+                    continue
+                if result.get('ok'):
+                    done.add((result['operation'], result['key'], result.get('seq')))
+    except FileNotFoundError:
+        pass
+    return done
+
+
+class BulkAncEngine:
+    '''
+    Runs ANC operations against `base_url` (the ANC service restBaseUrl)
+    with at most `concurrency` requests in flight, all over one shared
+    aiohttp connection pool, and at most `rate` requests per second. Jobs
+    that fail with a connection error, a timeout or one of
+    `RETRY_STATUS_CODES` are retried up to `retries` times with jittered
+    exponential backoff, honouring Retry-After. Each job's outcome is
+    appended as a JSON line to `result_log`, so a later run with `resume`
+    can skip the jobs that already succeeded. Once an endpoint has a job
+    to run again, its later jobs are run again too, even if they
+    succeeded, so its operations still end up applied in order.
+
+    Jobs for the same endpoint run one after another in the order given,
+    while jobs for different endpoints run in parallel.
+    '''
+
+    def __init__(self, config, secret, base_url, concurrency=DEFAULT_ANC_CONCURRENCY, rate=None,
+                 retries=DEFAULT_ANC_RETRIES, result_log=None, resume=False,
+                 backoff_initial=0.5, backoff_max=30.0, session=None):
+        self.config = config
+        self.secret = secret
+        self.base_url = base_url.rstrip('/')
+        self.concurrency = concurrency
+        self.bucket = TokenBucket(rate)
+        self.retries = retries
+        self.result_log = result_log
+        self.skip = completed_jobs(result_log) if (resume and result_log) else set()
+        self.backoff_initial = backoff_initial
+        self.backoff_max = backoff_max
+        self._session = session
+        self._log = None
+        self._waiting = {}
+        self._rerun = set()
+        self.submitted = 0
+        self.skipped = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.requests = 0
+        self.retried = 0
+        self.elapsed = 0.0
+
+    def _get_session(self):
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(ssl=self.config.ssl_context, limit=self.concurrency),
+                timeout=aiohttp.ClientTimeout(total=self.config.timeout))
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def _post(self, job):
+        '''
+        Return `(status, retry_after, error)`; `status` is None and `error`
+        set for a connection error or timeout.
+        '''
+        await self.bucket.acquire()
+        self.requests += 1
+        b64 = base64.b64encode((self.config.node_name + ':' + self.secret).encode()).decode()
+        try:
+            async with self._get_session().post(
+                    self.base_url + '/' + job.operation,
+                    data=json.dumps(job.payload()),
+                    headers={
+                        'Accept': 'application/json',
+                        'Content-Type': 'application/json',
+                        'Authorization': 'Basic ' + b64,
+                    }) as response:
+                await response.read()
+                return response.status, response.headers.get('Retry-After'), None
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            return None, None, str(e) or e.__class__.__name__
+
+    async def execute(self, job):
+        '''
+        Run one job, with retries, and return its result record.
+        '''
+        backoff = ExponentialBackoff(initial=self.backoff_initial, maximum=self.backoff_max)
+        attempts = 0
+        while True:
+            attempts += 1
+            status, retry_after, error = await self._post(job)
+            ok = status is not None and 200 <= status < 300
+            transient = status is None or status in RETRY_STATUS_CODES
+            if ok or not transient or attempts > self.retries:
+                break
+            self.retried += 1
+            delay = backoff.next_delay()
+            if retry_after:
+                try:
+                    delay = max(delay, float(retry_after))
+                except ValueError:
+                    pass
+            logger.debug('%s %s: %s, retrying in %.1fs', job.operation, job.key, status or error, delay)
+            await asyncio.sleep(delay)
+        return self.record(job, ok, status, attempts, error)
+
+    def record(self, job, ok, status, attempts, error=None):
+        '''
+        Count a job's outcome and append it to the result log.
+        '''
+        if ok:
+            self.succeeded += 1
+        else:
+            self.failed += 1
+            logger.warning('%s %s failed: %s', job.operation, job.key, status or error)
+        result = {
+            'operation': job.operation,
+            'key': job.key,
+            'policy': job.policy,
+            'ok': ok,
+            'status': status,
+            'attempts': attempts,
+        }
+        if job.seq is not None:
+            result['seq'] = job.seq
+        if error:
+            result['error'] = error
+        if self._log is not None:
+            self._log.write(json.dumps(result) + '\n')
+        return result
+
+    async def _worker(self, queue):
+        while True:
+            job = await queue.get()
+            try:
+                # then any jobs for the same endpoint that arrived meanwhile
+                while job is not None:
+                    try:
+                        await self.execute(job)
+                    except Exception as e:
+                        # keep going, or the jobs waiting on this endpoint never run
+                        logger.exception('%s %s failed unexpectedly', job.operation, job.key)
+                        self.record(job, False, None, 0, str(e) or e.__class__.__name__)
+                    waiting = self._waiting.get(job.key)
+                    if waiting:
+                        job = waiting.popleft()
+                    else:
+                        self._waiting.pop(job.key, None)
+                        job = None
+            finally:
+                queue.task_done()
+
+    async def run(self, jobs):
+        '''
+        Run every job from `jobs`, an iterable or async iterable of
+        `AncJob`. Jobs are read lazily into a queue bounded by the
+        concurrency, so requests start as soon as the first job is read.
+        Returns `stats()`.
+        '''
+        queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        # endpoint -> jobs waiting for an earlier job on it to finish; an
+        # endpoint is present while any job for it is queued or running
+        self._waiting = {}
+        self._rerun = set()
+        start = time.monotonic()
+        if self.result_log is not None:
+            self._log = open(self.result_log, 'a', buffering=1)
+        workers = [asyncio.create_task(self._worker(queue)) for _ in range(self.concurrency)]
+        try:
+            if hasattr(jobs, '__aiter__'):
+                async for job in jobs:
+                    await self._submit(queue, job)
+            else:
+                for job in jobs:
+                    await self._submit(queue, job)
+            await queue.join()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            if self._log is not None:
+                self._log.close()
+                self._log = None
+            self.elapsed = time.monotonic() - start
+        return self.stats()
+
+    async def _submit(self, queue, job):
+        if job.done_key() in self.skip and job.key not in self._rerun:
+            self.skipped += 1
+            return
+        if self.skip:
+            self._rerun.add(job.key)
+        self.submitted += 1
+        waiting = self._waiting.get(job.key)
+        if waiting is not None:
+            waiting.append(job)
+            return
+        self._waiting[job.key] = collections.deque()
+        await queue.put(job)
+
+    def stats(self):
+        return {
+            'submitted': self.submitted,
+            'skipped': self.skipped,
+            'succeeded': self.succeeded,
+            'failed': self.failed,
+            'requests': self.requests,
+            'retried': self.retried,
+            'elapsed': self.elapsed,
+            'jobs_per_second': (self.succeeded + self.failed) / self.elapsed if self.elapsed else 0.0,
+        }
@@ -0,0 +1,26 @@
+import random
+
+
+class ExponentialBackoff:
+    '''
+    Jittered exponential backoff. Each call to `next_delay()` returns a delay
+    drawn uniformly from the upper `jitter` fraction of
+    `min(maximum, initial * factor ** attempt)`, then bumps `attempt`;
+    `reset()` starts again from `initial`.
+    '''
+
+    def __init__(self, initial=1.0, maximum=60.0, factor=2.0, jitter=0.5, rng=random.random):
+        self.initial = initial
+        self.maximum = maximum
+        self.factor = factor
+        self.jitter = jitter
+        self.rng = rng
+        self.attempt = 0
+
+    def next_delay(self):
+        delay = min(self.maximum, self.initial * self.factor ** self.attempt)
+        self.attempt += 1
+        return delay * (1.0 - self.jitter * self.rng())
+
+    def reset(self):
+        self.attempt = 0
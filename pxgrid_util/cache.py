@@ -0,0 +1,203 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DISCOVERY_TTL = 300.0
+DEFAULT_CACHE_SIZE = 256
+
+
+class TTLCache:
+    '''
+    Size-bounded LRU mapping whose entries expire `ttl` seconds after they
+    were stored. Expiry uses wall-clock time so entries restored from a
+    snapshot keep their original deadline.
+    '''
+
+    def __init__(self, maxsize=DEFAULT_CACHE_SIZE, ttl=DEFAULT_DISCOVERY_TTL, clock=time.time):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires, value = entry
+            if expires <= self.clock():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value, expires=None):
+        if expires is None:
+            expires = self.clock() + self.ttl
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key):
+        with self._lock:
+            entry = self._data.pop(key, None)
+        return entry[1] if entry is not None else None
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def items(self):
+        '''
+        Unexpired `(key, expires, value)` tuples, least recently used first.
+        '''
+        now = self.clock()
+        with self._lock:
+            return [(k, e, v) for k, (e, v) in self._data.items() if e > now]
+
+    def stats(self):
+        return {
+            'size': len(self._data),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+        }
+
+
+def cache_owner(config):
+    '''
+    The client node name and controllers a discovery cache is written for.
+    '''
+    return {'node_name': config.node_name, 'hostnames': sorted(config.hostname or [])}
+
+
+class DiscoveryCache:
+    '''
+    Caches account activation, ServiceLookup responses and AccessSecret
+    values for `PXGridControl`. If `path` is given the cache is restored
+    from, and written back to, a JSON snapshot file so a restarted process
+    can skip discovery entirely while the entries are still fresh.
+
+    `owner` identifies the client the entries belong to (see
+    `cache_owner`); it is stored in the snapshot, and a snapshot written
+    for another owner is ignored, so clients sharing a file never reuse
+    each other's secrets or account state.
+    '''
+
+    def __init__(self, ttl=DEFAULT_DISCOVERY_TTL, secret_ttl=None, maxsize=DEFAULT_CACHE_SIZE, path=None,
+                 owner=None):
+        self.services = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.secrets = TTLCache(maxsize=maxsize, ttl=ttl if secret_ttl is None else secret_ttl)
+        self.account = TTLCache(maxsize=1, ttl=ttl)
+        self.path = path
+        self.owner = owner
+        # lookups run on worker threads, and share the one snapshot file
+        self._save_lock = threading.Lock()
+        if path is not None:
+            self.load()
+
+    @classmethod
+    def from_config(cls, config):
+        if not config.discovery_ttl:
+            return None
+        return cls(ttl=config.discovery_ttl, path=config.discovery_cache, owner=cache_owner(config))
+
+    def get_account(self):
+        return self.account.get('account')
+
+    def put_account(self, response):
+        self.account.put('account', response)
+        self.save()
+
+    def get_service(self, service_name):
+        return self.services.get(service_name)
+
+    def put_service(self, service_name, response):
+        self.services.put(service_name, response)
+        self.save()
+
+    def get_secret(self, peer_node_name):
+        return self.secrets.get(peer_node_name)
+
+    def put_secret(self, peer_node_name, response):
+        self.secrets.put(peer_node_name, response)
+        self.save()
+
+    def invalidate_service(self, service_name):
+        logger.debug('invalidate service %s', service_name)
+        self.services.pop(service_name)
+        self.save()
+
+    def invalidate_secret(self, peer_node_name):
+        logger.debug('invalidate secret %s', peer_node_name)
+        self.secrets.pop(peer_node_name)
+        self.save()
+
+    def clear(self):
+        logger.debug('invalidate all')
+        self.services.clear()
+        self.secrets.clear()
+        self.account.clear()
+        self.save()
+
+    def stats(self):
+        return {
+            'services': self.services.stats(),
+            'secrets': self.secrets.stats(),
+        }
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as f:
+                snapshot = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logger.warning('ignoring unreadable discovery cache %s: %s', self.path, e)
+            return
+        if snapshot.get('owner') != self.owner:
+            logger.info('ignoring discovery cache %s written for %s', self.path, snapshot.get('owner'))
+            return
+        for name in ('account', 'services', 'secrets'):
+            cache = getattr(self, name)
+            for key, expires, value in snapshot.get(name, []):
+                if expires > cache.clock():
+                    cache.put(key, value, expires=expires)
+        logger.debug('loaded discovery cache from %s', self.path)
+
+    def save(self):
+        if self.path is None:
+            return
+        with self._save_lock:
+            snapshot = {
+                name: getattr(self, name).items()
+                for name in ('account', 'services', 'secrets')
+            }
+            snapshot['owner'] = self.owner
+            # secrets are stored, so keep the snapshot private to the user
+            tmp_path = self.path + '.tmp'
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'w') as f:
+                json.dump(snapshot, f)
+            os.replace(tmp_path, self.path)
@@ -0,0 +1,149 @@
+import gzip
+import logging
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+# request bodies are only worth compressing once they are this big
+DEFAULT_COMPRESS_MIN_BYTES = 1024
+
+
+def supported_encodings():
+    '''
+    Content codings that responses can be decoded from, best first;
+    `br` and `zstd` only when `brotli` or `zstandard` is installed.
+    '''
+    encodings = []
+    if zstandard is not None:
+        encodings.append('zstd')
+    if brotli is not None:
+        encodings.append('br')
+    return encodings + ['gzip', 'deflate']
+
+
+ACCEPT_ENCODING = ', '.join(supported_encodings())
+
+
+class ZlibDecoder:
+    '''
+    Incremental gzip or deflate decoder. `deflate` should be a zlib stream,
+    but some servers send raw deflate data; that is detected from the first
+    bytes.
+    '''
+
+    def __init__(self, encoding):
+        self.encoding = encoding
+        # 32 + 15: zlib or gzip, by header
+        self.decoder = zlib.decompressobj(15 + 32 if encoding == 'gzip' else 15)
+        self.started = False
+
+    def decompress(self, data):
+        if not self.started and data:
+            self.started = True
+            if self.encoding == 'deflate':
+                try:
+                    return self.decoder.decompress(data)
+                except zlib.error:
+                    logger.debug('deflate response without zlib header, decoding raw deflate')
+                    self.decoder = zlib.decompressobj(-15)
+        return self.decoder.decompress(data)
+
+    def flush(self):
+        return self.decoder.flush()
+
+
+class BrotliDecoder:
+    def __init__(self):
+        self.decoder = brotli.Decompressor()
+
+    def decompress(self, data):
+        return self.decoder.process(data)
+
+    def flush(self):
+        return b''
+
+
+class ZstdDecoder:
+    def __init__(self):
+        self.decoder = zstandard.ZstdDecompressor().decompressobj()
+
+    def decompress(self, data):
+        return self.decoder.decompress(data)
+
+    def flush(self):
+        return b''
+
+
+def content_decoder(encoding):
+    '''
+    A decoder for a Content-Encoding header value, or None if there is
+    nothing to decode.
+    '''
+    encoding = (encoding or '').strip().lower()
+    if encoding in ('', 'identity'):
+        return None
+    if encoding in ('gzip', 'x-gzip', 'deflate'):
+        return ZlibDecoder('deflate' if encoding == 'deflate' else 'gzip')
+    if encoding == 'br' and brotli is not None:
+        return BrotliDecoder()
+    if encoding == 'zstd' and zstandard is not None:
+        return ZstdDecoder()
+    raise ValueError('unsupported Content-Encoding %r' % encoding)
+
+
+class DecodingReader:
+    '''
+    Reads the body of `raw` (anything with `read(size)`) decoded from
+    `encoding` as it arrives, so a compressed response can be parsed
+    incrementally, e.g. by `JSONArrayStream`.
+    '''
+
+    def __init__(self, raw, encoding, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.raw = raw
+        self.decoder = content_decoder(encoding)
+        self.chunk_size = chunk_size
+        self.buffer = b''
+        self.eof = False
+        self.raw_bytes = 0
+
+    def _fill(self):
+        data = self.raw.read(self.chunk_size)
+        if data:
+            self.raw_bytes += len(data)
+            self.buffer += self.decoder.decompress(data)
+        else:
+            self.eof = True
+            self.buffer += self.decoder.flush()
+
+    def read(self, amt=None):
+        if amt is None or amt < 0:
+            while not self.eof:
+                self._fill()
+            data, self.buffer = self.buffer, b''
+            return data
+        while not self.buffer and not self.eof:
+            self._fill()
+        data, self.buffer = self.buffer[:amt], self.buffer[amt:]
+        return data
+
+
+def compress_body(body, min_bytes=DEFAULT_COMPRESS_MIN_BYTES):
+    '''
+    gzip a request body of at least `min_bytes`. Returns the body to send
+    and its Content-Encoding, None if it was left as it was.
+    '''
+    if body is None or len(body) < min_bytes:
+        return body, None
+    return gzip.compress(body, compresslevel=6), 'gzip'
@@ -1,7 +1,20 @@
 import argparse
 import ssl
 import enum
+from .anc import DEFAULT_ANC_CONCURRENCY
+from .anc import DEFAULT_ANC_RETRIES
+from .cache import DEFAULT_DISCOVERY_TTL
+from .dedup import DEFAULT_DEDUP_MAX_ENTRIES
+from .dedup import DEFAULT_DEDUP_TTL
 from .filtering import argparse_filter
+from .output import DEFAULT_OUTPUT_FORMAT
+from .output import OUTPUT_FORMATS
+from .pipeline import DEFAULT_PIPELINE_SIZE
+from .pipeline import OVERFLOW_POLICIES
+from .snapshot import DEFAULT_SNAPSHOT_QUERIES
+from .snapshot import SNAPSHOT_QUERIES
+from .snapshot import argparse_snapshot_query
+from .snapshot import parse_snapshot_query
 
 
 class AncPolicyType(enum.Enum):
@@ -34,8 +47,11 @@ class Config:
         self.parser = argparse.ArgumentParser()
         self.parser.add_argument(
             '-a', '--hostname',
-            help='pxGrid controller host name (multiple ok)',
+            help='pxGrid controller host name (multiple ok, the healthiest is used)',
             action='append')
+        self.parser.add_argument(
+            '--hedge-after', type=float,
+            help='also send a query to the next node if the first has not answered within this many seconds')
         self.parser.add_argument(
             '--port',
             help='pxGrid port (default 8910)',
@@ -70,6 +86,19 @@ class Config:
         self.parser.add_argument(
             '--timeout', default=10.0, type=float,
             help='Timeout for REST requests in seconds (float)')
+        self.parser.add_argument(
+            '--compress-requests', type=int, metavar='BYTES',
+            help='gzip query payloads of at least this many bytes (default off; the server must accept gzip)')
+        self.parser.add_argument(
+            '--discovery-ttl', default=DEFAULT_DISCOVERY_TTL, type=float,
+            help='Seconds to cache service lookups and access secrets, 0 disables (default 300)')
+        self.parser.add_argument(
+            '--discovery-cache', type=str,
+            help='File to persist cached service lookups and access secrets across runs (optional)')
+        self.parser.add_argument(
+            '--output-format', choices=OUTPUT_FORMATS,
+            default=DEFAULT_OUTPUT_FORMAT,
+            help='Output as pretty-printed json, compact ndjson (one record per line) or msgpack (default json)')
         self.parser.add_argument(
             '-v', '--verbose', action='store_true',
             help='Verbose output')
@@ -81,12 +110,20 @@ class Config:
             '--ws-ping-interval', type=float,
             default=20.0,
             help='WebSocket ping interval in seconds (float)')
+        self.parser.add_argument(
+            '--reconnect-initial-delay', type=float,
+            default=1.0,
+            help='Delay before the first reconnect attempt in seconds, doubled on each failure (float)')
+        self.parser.add_argument(
+            '--reconnect-max-delay', type=float,
+            default=60.0,
+            help='Upper bound on the delay between reconnect attempts in seconds (float)')
         self.parser.add_argument(
             '--service', type=str,
             help='Service name')
         self.parser.add_argument(
-            '--topic', type=str,
-            help='Topic to subscribe to')
+            '--topic', type=str, action='append',
+            help='Topic to subscribe to (multiple ok, as TOPIC or SERVICE:TOPIC)')
         self.parser.add_argument(
             '--subscribe', action='store_true',
             help='set up a subscription')
@@ -103,6 +140,29 @@ class Config:
             '--session-dedup', action='store_true',
             help='run the sessionTopic de-duplicating subscriber')
 
+        self.parser.add_argument(
+            '--dedup-max-entries', type=int,
+            default=DEFAULT_DEDUP_MAX_ENTRIES,
+            help='maximum session events remembered by --session-dedup (default 100000)')
+        self.parser.add_argument(
+            '--dedup-ttl', type=float,
+            default=DEFAULT_DEDUP_TTL,
+            help='seconds a session event is remembered by --session-dedup (default 3600)')
+        self.parser.add_argument(
+            '--dedup-fields', type=lambda v: [f for f in v.split(',') if f],
+            help='comma-separated session fields compared by --session-dedup (default all)')
+        self.parser.add_argument(
+            '--queue-size', type=int,
+            default=DEFAULT_PIPELINE_SIZE,
+            help='received events waiting to be output before --overflow applies (default %d)' % DEFAULT_PIPELINE_SIZE)
+        self.parser.add_argument(
+            '--overflow', choices=OVERFLOW_POLICIES,
+            default='block',
+            help='when the event queue is full, block reads, drop the oldest event, or spill to disk (default block)')
+        self.parser.add_argument(
+            '--spill-dir', type=str,
+            help='directory for events spilled by --overflow spill (default system temp dir)')
+
         self.parser.add_argument(
             '--services', action='store_true',
             help='List out supported services')
@@ -119,9 +179,26 @@ class Config:
         self.parser.add_argument(
             '--start-timestamp', type=str,
             help='Optional startTimestamp for queries')
+        self.parser.add_argument(
+            '--sync-state', type=str,
+            help='SQLite file to keep a synced copy of query results in, so each run only asks for changes since the last (optional)')
+        self.parser.add_argument(
+            '--session-store', type=str,
+            help='Session snapshot file kept current by px-subscribe on sessionTopic and used by session-query-by-ip (optional)')
+        self.parser.add_argument(
+            '--session-store-interval', type=float,
+            default=60.0,
+            help='Seconds between px-subscribe writes of the --session-store snapshot (default 60)')
         self.parser.add_argument(
             '--filter', type=argparse_filter,
             help='Optional JMESPath filter expression')
+        self.parser.add_argument(
+            '--snapshot-query', type=argparse_snapshot_query, action='append',
+            help='query for px-snapshot (multiple ok): one of %s, or NAME=SERVICE/PATH (default %s)' % (
+                ', '.join(SNAPSHOT_QUERIES), ', '.join(DEFAULT_SNAPSHOT_QUERIES)))
+        self.parser.add_argument(
+            '--snapshot-dir', type=str,
+            help='directory px-snapshot writes each query to, as NAME.FORMAT (default stdout)')
 
         #
         # Options for getting, applying and clearing ANC policies via
@@ -143,6 +220,9 @@ class Config:
         g.add_argument(
             '--apply-anc-policy-by-mac-bulk', type=str,
             help='Bulk-apply named ANC policy by endpoint MAC addresses in flat file')
+        g.add_argument(
+            '--anc-batch', type=str,
+            help='Run the ANC operations in a CSV or NDJSON batch file (operation,key,policy per row)')
         g.add_argument(
             '--apply-anc-policy-by-ip', action='store_true',
             help='Apply named ANC policy by endpoint IP address')
@@ -178,14 +258,50 @@ class Config:
         self.parser.add_argument(
             '--anc-policy-action', type=AncPolicyType,
             choices=list(AncPolicyType))
+        self.parser.add_argument(
+            '--anc-concurrency', type=int,
+            default=DEFAULT_ANC_CONCURRENCY,
+            help='bulk ANC requests in flight at once (default %d)' % DEFAULT_ANC_CONCURRENCY)
+        self.parser.add_argument(
+            '--anc-rate', type=float,
+            help='maximum bulk ANC requests per second (default unlimited)')
+        self.parser.add_argument(
+            '--anc-retries', type=int,
+            default=DEFAULT_ANC_RETRIES,
+            help='retries of a bulk ANC request after a 429, 5xx or connection error (default %d)' % DEFAULT_ANC_RETRIES)
+        self.parser.add_argument(
+            '--anc-result-log', type=str,
+            help='file to append the result of each bulk ANC request to, as JSON lines (optional)')
+        self.parser.add_argument(
+            '--anc-resume', action='store_true',
+            help='skip bulk ANC requests that already succeeded according to --anc-result-log')
+        self.parser.add_argument(
+            '--anc-no-dedup', action='store_true',
+            help='only skip MAC addresses repeating the line before in --apply-anc-policy-by-mac-bulk files, '
+                 'instead of remembering every address seen')
 
         # publishing parameters
         self.parser.add_argument(
             '--publish-delay', type=float, default=1.0,
-            help='delay between custom event publishes')
+            help='delay between custom event publishes, unless --publish-rate is given')
+        self.parser.add_argument(
+            '--publish-rate', type=float,
+            help='target custom events published per second (0 for as fast as possible)')
+        self.parser.add_argument(
+            '--publish-input', type=str,
+            help='publish each line of this file (- for stdin) instead of canned events')
+        self.parser.add_argument(
+            '--publish-count', type=int,
+            help='stop after publishing this many canned events (default unlimited)')
+        self.parser.add_argument(
+            '--publish-coalesce', type=int, default=1,
+            help='send up to this many waiting events per frame, as a JSON array (default 1)')
+        self.parser.add_argument(
+            '--publish-receipts', action='store_true',
+            help='request a STOMP receipt for every frame published')
         self.parser.add_argument(
-            '--reregister-delay', type=float, default=1.0,
-            help='delay between custom service reregistrations')
+            '--reregister-delay', type=float,
+            help='delay between custom service reregistrations (default from the server\'s reregisterTimeMillis)')
 
     def parse_args(self):
         '''
@@ -215,11 +331,56 @@ class Config:
     def session_dedup(self):
         return self.config.session_dedup
 
+    @property
+    @ensure_parsed
+    def dedup_max_entries(self):
+        return self.config.dedup_max_entries
+
+    @property
+    @ensure_parsed
+    def dedup_ttl(self):
+        return self.config.dedup_ttl
+
+    @property
+    @ensure_parsed
+    def dedup_fields(self):
+        return self.config.dedup_fields
+
+    @property
+    @ensure_parsed
+    def queue_size(self):
+        return self.config.queue_size
+
+    @property
+    @ensure_parsed
+    def overflow(self):
+        return self.config.overflow
+
+    @property
+    @ensure_parsed
+    def spill_dir(self):
+        return self.config.spill_dir
+
+    @property
+    @ensure_parsed
+    def output_format(self):
+        return self.config.output_format
+
     @property
     @ensure_parsed
     def ws_ping_interval(self):
         return self.config.ws_ping_interval
 
+    @property
+    @ensure_parsed
+    def reconnect_initial_delay(self):
+        return self.config.reconnect_initial_delay
+
+    @property
+    @ensure_parsed
+    def reconnect_max_delay(self):
+        return self.config.reconnect_max_delay
+
     @property
     @ensure_parsed
     def services(self):
@@ -235,6 +396,21 @@ class Config:
     def timeout(self):
         return self.config.timeout
 
+    @property
+    @ensure_parsed
+    def compress_requests(self):
+        return self.config.compress_requests
+
+    @property
+    @ensure_parsed
+    def discovery_ttl(self):
+        return self.config.discovery_ttl
+
+    @property
+    @ensure_parsed
+    def discovery_cache(self):
+        return self.config.discovery_cache
+
     @property
     @ensure_parsed
     def verbose(self):
@@ -245,6 +421,11 @@ class Config:
     def hostname(self):
         return self.config.hostname
 
+    @property
+    @ensure_parsed
+    def hedge_after(self):
+        return self.config.hedge_after
+
     @property
     @ensure_parsed
     def port(self):
@@ -276,7 +457,14 @@ class Config:
     @property
     @ensure_parsed
     def topic(self):
-        return self.config.topic
+        if self.config.topic:
+            return self.config.topic[0]
+        return None
+
+    @property
+    @ensure_parsed
+    def topics(self):
+        return self.config.topic or []
 
     @property
     @ensure_parsed
@@ -288,11 +476,38 @@ class Config:
     def start_timestamp(self):
         return self.config.start_timestamp
 
+    @property
+    @ensure_parsed
+    def sync_state(self):
+        return self.config.sync_state
+
+    @property
+    @ensure_parsed
+    def session_store(self):
+        return self.config.session_store
+
+    @property
+    @ensure_parsed
+    def session_store_interval(self):
+        return self.config.session_store_interval
+
     @property
     @ensure_parsed
     def filter(self):
         return self.config.filter
 
+    @property
+    @ensure_parsed
+    def snapshot_queries(self):
+        if self.config.snapshot_query:
+            return self.config.snapshot_query
+        return [parse_snapshot_query(name) for name in DEFAULT_SNAPSHOT_QUERIES]
+
+    @property
+    @ensure_parsed
+    def snapshot_dir(self):
+        return self.config.snapshot_dir
+
     @property
     @ensure_parsed
     def get_anc_endpoints(self):
@@ -323,6 +538,11 @@ class Config:
     def apply_anc_policy_by_mac_bulk(self):
         return self.config.apply_anc_policy_by_mac_bulk
         
+    @property
+    @ensure_parsed
+    def anc_batch(self):
+        return self.config.anc_batch
+
     @property
     @ensure_parsed
     def apply_anc_policy_by_ip(self):
@@ -373,11 +593,66 @@ class Config:
     def anc_policy_action(self):
         return self.config.anc_policy_action
 
+    @property
+    @ensure_parsed
+    def anc_concurrency(self):
+        return self.config.anc_concurrency
+
+    @property
+    @ensure_parsed
+    def anc_rate(self):
+        return self.config.anc_rate
+
+    @property
+    @ensure_parsed
+    def anc_retries(self):
+        return self.config.anc_retries
+
+    @property
+    @ensure_parsed
+    def anc_result_log(self):
+        return self.config.anc_result_log
+
+    @property
+    @ensure_parsed
+    def anc_resume(self):
+        return self.config.anc_resume
+
+    @property
+    @ensure_parsed
+    def anc_no_dedup(self):
+        return self.config.anc_no_dedup
+
     @property
     @ensure_parsed
     def publish_delay(self):
         return self.config.publish_delay
 
+    @property
+    @ensure_parsed
+    def publish_rate(self):
+        return self.config.publish_rate
+
+    @property
+    @ensure_parsed
+    def publish_input(self):
+        return self.config.publish_input
+
+    @property
+    @ensure_parsed
+    def publish_count(self):
+        return self.config.publish_count
+
+    @property
+    @ensure_parsed
+    def publish_coalesce(self):
+        return self.config.publish_coalesce
+
+    @property
+    @ensure_parsed
+    def publish_receipts(self):
+        return self.config.publish_receipts
+
     @property
     @ensure_parsed
     def reregister_delay(self):
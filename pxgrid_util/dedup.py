@@ -0,0 +1,196 @@
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DEDUP_MAX_ENTRIES = 100000
+DEFAULT_DEDUP_TTL = 3600.0
+DIGEST_SIZE = 16
+
+
+def canonical_json(obj):
+    '''
+    Compact, key-sorted UTF-8 JSON encoding of `obj`; equal objects always
+    encode to the same bytes.
+    '''
+    return json.dumps(
+        obj, sort_keys=True, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+def canonical_hash(session, fields=None):
+    '''
+    Return `(digest, payload)` for a session event, where `payload` is the
+    canonical JSON of the whole event (serialized once, so it can be reused
+    for output) and `digest` is a 16-byte BLAKE2b of its callingStationId,
+    timestamp and either the full payload or, if `fields` is given, just
+    those fields.
+    '''
+    payload = canonical_json(session)
+    h = hashlib.blake2b(digest_size=DIGEST_SIZE)
+    h.update(str(session.get('callingStationId')).encode())
+    h.update(b'\0')
+    h.update(str(session.get('timestamp')).encode())
+    h.update(b'\0')
+    if fields is None:
+        h.update(payload)
+    else:
+        h.update(canonical_json({f: session[f] for f in fields if f in session}))
+    return h.digest(), payload
+
+
+class SessionDeduplicator:
+    '''
+    Remembers sessionTopic events by a 16-byte digest of their
+    callingStationId, timestamp and content (or only the named `fields` of
+    it), so memory per event is fixed no matter how large the event is. At
+    most `max_entries` digests are kept (least recently seen dropped first),
+    and a digest not seen for `ttl` seconds is forgotten.
+
+    Intended for use from a single event loop, so there is no locking.
+    '''
+
+    def __init__(self, max_entries=DEFAULT_DEDUP_MAX_ENTRIES, ttl=DEFAULT_DEDUP_TTL, fields=None, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.fields = fields
+        self.clock = clock
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _expire(self, now):
+        entries = self._entries
+        deadline = now - self.ttl
+        while entries:
+            key, (count, last_seen, first_seen) = next(iter(entries.items()))
+            if last_seen > deadline:
+                break
+            del entries[key]
+            self.expirations += 1
+
+    def check(self, session):
+        '''
+        Record `session` and return how many times it has now been seen, so
+        1 means this is the first copy.
+        '''
+        return self.check_event(session)[0]
+
+    def check_event(self, session):
+        '''
+        As `check`, but return `(count, payload)` where `payload` is the
+        canonical JSON bytes of the event, ready to be written out.
+        '''
+        key, payload = canonical_hash(session, self.fields)
+        return self.check_key(key), payload
+
+    def check_key(self, key):
+        return self.record(key)[0]
+
+    def record(self, key):
+        '''
+        Record an event digest and return `(count, first_seen)`, the number
+        of times it has now been seen and the clock time of the first copy.
+        '''
+        now = self.clock()
+        self._expire(now)
+        entry = self._entries.get(key)
+        if entry is not None:
+            self.hits += 1
+            count = entry[0] + 1
+            first_seen = entry[2]
+            self._entries[key] = (count, now, first_seen)
+            self._entries.move_to_end(key)
+            return count, first_seen
+        self.misses += 1
+        self._entries[key] = (1, now, now)
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+        return 1, now
+
+    def stats(self):
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+        }
+
+
+class NodeArrivalStats:
+    def __init__(self):
+        self.received = 0
+        self.first = 0
+        self.duplicates = 0
+        self.lag_total = 0.0
+        self.lag_max = 0.0
+
+    def as_dict(self):
+        return {
+            'received': self.received,
+            'first': self.first,
+            'duplicates': self.duplicates,
+            'mean_lag': self.lag_total / self.duplicates if self.duplicates else 0.0,
+            'max_lag': self.lag_max,
+        }
+
+
+class SessionMerger:
+    '''
+    Fan-in stage for the same sessionTopic stream delivered by several broker
+    nodes. Each subscriber calls `put(node, session)`; only the first copy
+    of an event is passed on (read them with `get()`), and for each node the
+    merger tracks how many events it delivered first, how many were
+    duplicates, and how far (in seconds) its duplicates lagged behind the
+    first copy.
+    '''
+
+    def __init__(self, deduplicator):
+        self.deduplicator = deduplicator
+        self.queue = asyncio.Queue()
+        self.nodes = {}
+
+    def put(self, node, session):
+        key, payload = canonical_hash(session, self.deduplicator.fields)
+        count, first_seen = self.deduplicator.record(key)
+        stats = self.nodes.get(node)
+        if stats is None:
+            stats = self.nodes[node] = NodeArrivalStats()
+        stats.received += 1
+        if count == 1:
+            stats.first += 1
+            self.queue.put_nowait((node, payload))
+            return True
+        lag = self.deduplicator.clock() - first_seen
+        stats.duplicates += 1
+        stats.lag_total += lag
+        stats.lag_max = max(stats.lag_max, lag)
+        return False
+
+    async def get(self):
+        '''
+        Return the next `(node, payload)` first copy, where `payload` is the
+        canonical JSON bytes of the event.
+        '''
+        return await self.queue.get()
+
+    def stats(self):
+        received = sum(n.received for n in self.nodes.values())
+        duplicates = sum(n.duplicates for n in self.nodes.values())
+        return {
+            'received': received,
+            'unique': received - duplicates,
+            'duplicates': duplicates,
+            'duplicate_ratio': duplicates / received if received else 0.0,
+            'nodes': {node: n.as_dict() for node, n in self.nodes.items()},
+        }
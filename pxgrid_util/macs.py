@@ -0,0 +1,95 @@
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+# 02:42:0A:14:04:23, 02-42-0a-14-04-23, 0242.0a14.0423 or 02420A140423
+MAC_PATTERN = re.compile(
+    r'^(?:[0-9A-Fa-f]{2}([:-])(?:[0-9A-Fa-f]{2}\1){4}[0-9A-Fa-f]{2}'
+    r'|[0-9A-Fa-f]{4}\.[0-9A-Fa-f]{4}\.[0-9A-Fa-f]{4}'
+    r'|[0-9A-Fa-f]{12})$')
+SEPARATORS = str.maketrans('', '', ':.-')
+
+
+def parse_mac(text):
+    '''
+    The 48-bit value of a MAC address in any of the usual notations; raises
+    ValueError for anything else.
+    '''
+    text = text.strip()
+    if not MAC_PATTERN.match(text):
+        raise ValueError('not a MAC address: %r' % text)
+    return int(text.translate(SEPARATORS), 16)
+
+
+def format_mac(value):
+    '''
+    Format a 48-bit MAC address the way ISE does, e.g. 02:42:0A:14:04:23.
+    '''
+    d = '%012X' % value
+    return '%s:%s:%s:%s:%s:%s' % (d[0:2], d[2:4], d[4:6], d[6:8], d[8:10], d[10:12])
+
+
+def normalize_mac(mac):
+    '''
+    `mac` in ISE's notation, or just upper-cased if it is not a MAC address
+    at all.
+    '''
+    try:
+        return format_mac(parse_mac(mac))
+    except ValueError:
+        return mac.strip().upper()
+
+
+class MacFileReader:
+    '''
+    Lazily reads MAC addresses, one per line, from `path`, yielding each in
+    ISE's notation the first time it appears. Blank lines and `#` comments
+    are ignored; lines that are not MAC addresses are skipped with a
+    warning. Both duplicates and invalid lines are counted.
+
+    The set of addresses seen so far is kept, as integers, so memory grows
+    with the number of distinct addresses (about 70 bytes each) though not
+    with the file. With `dedup` off only an address repeating the one just
+    before it is skipped, and memory use stays constant.
+    '''
+
+    def __init__(self, path, dedup=True):
+        self.path = path
+        self.dedup = dedup
+        self.lines = 0
+        self.macs = 0
+        self.duplicates = 0
+        self.invalid = 0
+
+    def __iter__(self):
+        seen = set()
+        last = None
+        with open(self.path, 'r') as f:
+            for lineno, line in enumerate(f, 1):
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                self.lines += 1
+                try:
+                    value = parse_mac(line)
+                except ValueError as e:
+                    self.invalid += 1
+                    logger.warning('%s line %d skipped: %s', self.path, lineno, e)
+                    continue
+                if value == last or value in seen:
+                    self.duplicates += 1
+                    continue
+                last = value
+                if self.dedup:
+                    seen.add(value)
+                self.macs += 1
+                yield format_mac(value)
+
+    def stats(self):
+        return {
+            'lines': self.lines,
+            'macs': self.macs,
+            'duplicates': self.duplicates,
+            'invalid': self.invalid,
+        }
@@ -0,0 +1,282 @@
+import asyncio
+import http.client
+import logging
+import threading
+import time
+import urllib.error
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+# weight of the newest sample in the latency and error rate averages
+DEFAULT_EWMA_ALPHA = 0.3
+
+# seconds a node that failed is passed over while other nodes are healthy
+DEFAULT_COOLDOWN = 30.0
+
+# how much a node's error rate inflates its latency when ranking
+ERROR_PENALTY = 10.0
+
+
+def is_failover_error(exc):
+    '''
+    True if another node might succeed where this one failed: the node
+    could not be reached, timed out or answered with a 5xx.
+    '''
+    if isinstance(exc, urllib.error.HTTPError):
+        return exc.code >= 500
+    if isinstance(exc, aiohttp.ClientResponseError):
+        return exc.status >= 500
+    return isinstance(exc, (OSError, http.client.HTTPException, asyncio.TimeoutError, aiohttp.ClientError))
+
+
+class NodeHealth:
+    '''
+    Exponentially weighted moving averages of a node's response time and
+    error rate, plus when it may next be tried after failing.
+    '''
+
+    def __init__(self, name):
+        self.name = name
+        self.latency = None
+        self.error_rate = 0.0
+        self.requests = 0
+        self.failures = 0
+        self.down_until = 0.0
+
+    def stats(self):
+        return {
+            'node': self.name,
+            'latency': self.latency,
+            'error_rate': self.error_rate,
+            'requests': self.requests,
+            'failures': self.failures,
+        }
+
+
+# health by node name, shared by every selector in the process
+_health = {}
+_health_lock = threading.Lock()
+
+
+def node_health(name):
+    with _health_lock:
+        health = _health.get(name)
+        if health is None:
+            health = _health[name] = NodeHealth(name)
+        return health
+
+
+class NodeSelector:
+    '''
+    Routes calls to the healthiest of several nodes providing the same
+    thing, such as the `--hostname` controllers or the nodes of a service.
+    `key(node)` names a node; health is tracked per name across the process.
+
+    Nodes are ranked by latency inflated by error rate, with nodes that
+    failed in the last `cooldown` seconds last. `call()` tries them in that
+    order, failing over on connection errors, timeouts and 5xx responses.
+    With `hedge_after`, the same request is also sent to the next node if
+    no answer has come within that many seconds, and whichever answers
+    first wins.
+    '''
+
+    def __init__(self, nodes, key=str, alpha=DEFAULT_EWMA_ALPHA, cooldown=DEFAULT_COOLDOWN,
+                 clock=time.monotonic):
+        if not nodes:
+            raise ValueError('no nodes to select from')
+        self.nodes = list(nodes)
+        self.key = key
+        self.alpha = alpha
+        self.cooldown = cooldown
+        self.clock = clock
+        self.failovers = 0
+        self.hedges = 0
+
+    def health(self, node):
+        return node_health(self.key(node))
+
+    def ranked(self):
+        now = self.clock()
+        healths = [(node, self.health(node)) for node in self.nodes]
+        known = [h.latency for _, h in healths if h.latency is not None]
+        # untried nodes rank alongside the fastest, keeping configured order
+        default = min(known) if known else 0.0
+
+        def score(item):
+            health = item[1]
+            latency = health.latency if health.latency is not None else default
+            return latency * (1.0 + ERROR_PENALTY * health.error_rate)
+
+        up = [item for item in healths if item[1].down_until <= now]
+        down = [item for item in healths if item[1].down_until > now]
+        up.sort(key=score)
+        down.sort(key=lambda item: item[1].down_until)
+        return [node for node, _ in up + down]
+
+    def record_success(self, node, latency):
+        health = self.health(node)
+        with _health_lock:
+            health.requests += 1
+            if health.latency is None:
+                health.latency = latency
+            else:
+                health.latency += self.alpha * (latency - health.latency)
+            health.error_rate *= 1.0 - self.alpha
+            health.down_until = 0.0
+
+    def record_failure(self, node, exc=None):
+        health = self.health(node)
+        with _health_lock:
+            health.requests += 1
+            health.failures += 1
+            health.error_rate += self.alpha * (1.0 - health.error_rate)
+            health.down_until = self.clock() + self.cooldown
+        logger.warning('node %s failed: %s', health.name, exc)
+
+    def _attempt(self, fn, node):
+        start = self.clock()
+        try:
+            result = fn(node)
+        except Exception as e:
+            if is_failover_error(e):
+                self.record_failure(node, e)
+            raise
+        self.record_success(node, self.clock() - start)
+        return result
+
+    async def _async_attempt(self, fn, node):
+        start = self.clock()
+        try:
+            result = await fn(node)
+        except Exception as e:
+            if is_failover_error(e):
+                self.record_failure(node, e)
+            raise
+        self.record_success(node, self.clock() - start)
+        return result
+
+    def call(self, fn, hedge_after=None, discard=None):
+        '''
+        Return `fn(node)` from the first node to answer. If a hedged request
+        is beaten, `discard` is called with its result when it arrives,
+        e.g. to close a response.
+        '''
+        candidates = self.ranked()
+        if hedge_after and len(candidates) > 1:
+            return self._call_hedged(fn, candidates, hedge_after, discard)
+        for i, node in enumerate(candidates):
+            try:
+                return self._attempt(fn, node)
+            except Exception as e:
+                if not is_failover_error(e) or i == len(candidates) - 1:
+                    raise
+                self.failovers += 1
+                logger.info('failing over from %s to %s', self.key(node), self.key(candidates[i + 1]))
+
+    def _call_hedged(self, fn, candidates, hedge_after, discard):
+        remaining = list(candidates)
+        running = {}
+        error = None
+
+        def discard_result(future):
+            if discard is not None and not future.cancelled() and future.exception() is None:
+                discard(future.result())
+
+        executor = ThreadPoolExecutor(max_workers=len(candidates), thread_name_prefix='hedge')
+        try:
+            while True:
+                if not running:
+                    if not remaining:
+                        raise error
+                    if error is not None:
+                        self.failovers += 1
+                    node = remaining.pop(0)
+                    running[executor.submit(self._attempt, fn, node)] = node
+                done, _ = wait(running, timeout=hedge_after if remaining else None, return_when=FIRST_COMPLETED)
+                if not done:
+                    self.hedges += 1
+                    node = remaining.pop(0)
+                    logger.debug('no answer after %.2fs, hedging to %s', hedge_after, self.key(node))
+                    running[executor.submit(self._attempt, fn, node)] = node
+                    continue
+                for future in done:
+                    del running[future]
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        if not is_failover_error(e):
+                            raise
+                        error = e
+                        continue
+                    return result
+                if running and remaining:
+                    # replace the failed request while the slow one goes on
+                    self.failovers += 1
+                    node = remaining.pop(0)
+                    running[executor.submit(self._attempt, fn, node)] = node
+        finally:
+            for future in running:
+                future.add_done_callback(discard_result)
+            executor.shutdown(wait=False)
+
+    async def acall(self, fn, hedge_after=None, discard=None):
+        '''
+        As `call()`, for a coroutine function `fn`; hedged requests that are
+        beaten are cancelled, or passed to `discard` if they had already
+        answered.
+        '''
+        remaining = self.ranked()
+        running = {}
+        error = None
+
+        def discard_result(task):
+            if not task.cancelled() and task.exception() is None:
+                discard(task.result())
+        try:
+            while True:
+                if not running:
+                    if not remaining:
+                        raise error
+                    if error is not None:
+                        self.failovers += 1
+                    node = remaining.pop(0)
+                    running[asyncio.ensure_future(self._async_attempt(fn, node))] = node
+                timeout = hedge_after if (hedge_after and remaining) else None
+                done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    self.hedges += 1
+                    node = remaining.pop(0)
+                    logger.debug('no answer after %.2fs, hedging to %s', hedge_after, self.key(node))
+                    running[asyncio.ensure_future(self._async_attempt(fn, node))] = node
+                    continue
+                for task in done:
+                    del running[task]
+                    try:
+                        result = task.result()
+                    except Exception as e:
+                        if not is_failover_error(e):
+                            raise
+                        error = e
+                        continue
+                    return result
+                if running and remaining:
+                    self.failovers += 1
+                    node = remaining.pop(0)
+                    running[asyncio.ensure_future(self._async_attempt(fn, node))] = node
+        finally:
+            for task in running:
+                task.cancel()
+                if discard is not None:
+                    task.add_done_callback(discard_result)
+
+    def stats(self):
+        return {
+            'nodes': [self.health(node).stats() for node in self.nodes],
+            'failovers': self.failovers,
+            'hedges': self.hedges,
+        }
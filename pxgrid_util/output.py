@@ -0,0 +1,147 @@
+import json
+import logging
+import sys
+import threading
+import time
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+logger = logging.getLogger(__name__)
+
+OUTPUT_FORMATS = ('json', 'ndjson', 'msgpack')
+DEFAULT_OUTPUT_FORMAT = 'json'
+DEFAULT_FLUSH_BYTES = 64 * 1024
+DEFAULT_FLUSH_INTERVAL = 1.0
+
+
+def encode_json(record):
+    return (json.dumps(record, indent=2, sort_keys=True) + '\n').encode('utf-8')
+
+
+def encode_ndjson(record):
+    return json.dumps(record, separators=(',', ':'), ensure_ascii=False).encode('utf-8') + b'\n'
+
+
+def encode_msgpack(record):
+    return msgpack.packb(record)
+
+
+ENCODERS = {
+    'json': encode_json,
+    'ndjson': encode_ndjson,
+    'msgpack': encode_msgpack,
+}
+
+
+class OutputWriter:
+    '''
+    Buffered writer of records to a binary `stream` (stdout by default) in
+    one of `OUTPUT_FORMATS`:
+
+    - `json`: pretty-printed, key-sorted JSON (the scripts' original output)
+    - `ndjson`: compact JSON, one record per line
+    - `msgpack`: concatenated MessagePack records (needs `msgpack` installed)
+
+    Encoded records are collected and written in one go once `flush_bytes`
+    are pending or `flush_interval` seconds have passed since the last
+    flush. `start_flusher()` also flushes on that interval while no records
+    arrive. Safe to use from several threads.
+    '''
+
+    def __init__(self, stream=None, format=DEFAULT_OUTPUT_FORMAT, flush_bytes=DEFAULT_FLUSH_BYTES,
+                 flush_interval=DEFAULT_FLUSH_INTERVAL, clock=time.monotonic):
+        if format not in ENCODERS:
+            raise ValueError('output format must be one of %s, not %r' % (', '.join(OUTPUT_FORMATS), format))
+        if format == 'msgpack' and msgpack is None:
+            raise ValueError('msgpack output needs the msgpack package (pip install msgpack)')
+        self.stream = stream if stream is not None else sys.stdout.buffer
+        self.format = format
+        self.encode = ENCODERS[format]
+        self.flush_bytes = flush_bytes
+        self.flush_interval = flush_interval
+        self.clock = clock
+        self._buffer = []
+        self._pending = 0
+        self._last_flush = clock()
+        self._lock = threading.Lock()
+        self._flusher = None
+        self._closed = threading.Event()
+        self.records = 0
+        self.bytes_written = 0
+
+    def write(self, record):
+        self.write_encoded(self.encode(record))
+
+    def write_json(self, data):
+        '''
+        Write a record given as JSON text or bytes. For `ndjson` compact JSON
+        without newlines is copied through without being decoded.
+        '''
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        if self.format == 'ndjson' and b'\n' not in data:
+            self.write_encoded(data + b'\n')
+        else:
+            self.write(json.loads(data))
+
+    def write_encoded(self, data):
+        '''
+        Write bytes already encoded in this writer's format.
+        '''
+        with self._lock:
+            self._buffer.append(data)
+            self._pending += len(data)
+            self.records += 1
+            if self._pending >= self.flush_bytes or self.clock() - self._last_flush >= self.flush_interval:
+                self._flush()
+
+    def _flush(self):
+        if self._buffer:
+            data = b''.join(self._buffer)
+            self._buffer.clear()
+            self._pending = 0
+            self.stream.write(data)
+            self.bytes_written += len(data)
+        self.stream.flush()
+        self._last_flush = self.clock()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def start_flusher(self):
+        '''
+        Flush pending records every `flush_interval` seconds from a daemon
+        thread, until `close()`.
+        '''
+        def run():
+            while not self._closed.wait(self.flush_interval):
+                with self._lock:
+                    if self._buffer:
+                        self._flush()
+
+        self._flusher = threading.Thread(target=run, name='output-flusher', daemon=True)
+        self._flusher.start()
+
+    def close(self):
+        self._closed.set()
+        if self._flusher is not None:
+            self._flusher.join()
+            self._flusher = None
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_output(config, stream=None):
+    '''
+    Return an `OutputWriter` for the script's `--output-format`.
+    '''
+    return OutputWriter(stream=stream, format=config.output_format)
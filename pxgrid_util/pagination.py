@@ -0,0 +1,149 @@
+import collections
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PAGE_SIZE = 1000
+DEFAULT_PREFETCH = 4
+
+
+class PageCheckpoint:
+    '''
+    Records in a small JSON file the start index of the first page not yet
+    fully consumed, so an interrupted export can resume from there.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f)['next_index']
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning('ignoring unreadable checkpoint %s: %s', self.path, e)
+            return None
+
+    def save(self, next_index):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'next_index': next_index}, f)
+        os.replace(tmp_path, self.path)
+
+    def clear(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class Paginator:
+    '''
+    Walks a `startIndex`/`count` paged query. `fetch_page(start_index,
+    count)` returns the list of items in one page; a page shorter than
+    `page_size` is the last. Up to `prefetch` pages are requested
+    concurrently from a thread pool, and pages are yielded strictly in
+    order, so memory use is bounded by `prefetch` pages however many items
+    there are.
+
+    With a `checkpoint`, iteration starts from the saved index if there is
+    one. The index is only moved past the pages yielded so far when the
+    consumer calls `commit()`, once it has safely written them, and the
+    checkpoint is removed when the last page is committed.
+    '''
+
+    def __init__(self, fetch_page, page_size=DEFAULT_PAGE_SIZE, prefetch=DEFAULT_PREFETCH,
+                 start_index=0, limit=None, checkpoint=None):
+        self.fetch_page = fetch_page
+        self.page_size = page_size
+        self.prefetch = max(1, prefetch)
+        self.start_index = start_index
+        self.limit = limit
+        self.checkpoint = checkpoint
+        self._uncommitted = None
+        self.pages_fetched = 0
+        self.items_fetched = 0
+        self.elapsed = 0.0
+
+    def pages(self):
+        '''
+        Yield `(start_index, items)` for each page in order.
+        '''
+        next_index = self.start_index
+        if self.checkpoint is not None:
+            saved = self.checkpoint.load()
+            if saved is not None:
+                logger.info('resuming from checkpoint at index %d', saved)
+                next_index = saved
+        end_index = None if self.limit is None else self.start_index + self.limit
+        start = time.monotonic()
+        inflight = collections.deque()
+
+        def submit():
+            nonlocal next_index
+            if end_index is not None and next_index >= end_index:
+                return
+            count = self.page_size
+            if end_index is not None:
+                count = min(count, end_index - next_index)
+            inflight.append((next_index, count, executor.submit(self.fetch_page, next_index, count)))
+            next_index += count
+
+        with ThreadPoolExecutor(max_workers=self.prefetch, thread_name_prefix='paginator') as executor:
+            try:
+                for _ in range(self.prefetch):
+                    submit()
+                while inflight:
+                    index, count, future = inflight.popleft()
+                    items = future.result()
+                    self.pages_fetched += 1
+                    self.items_fetched += len(items)
+                    last = len(items) < count
+                    if not last:
+                        submit()
+                    self._uncommitted = (index + count, last or not inflight)
+                    yield index, items
+                    if last:
+                        break
+            finally:
+                for _, _, future in inflight:
+                    future.cancel()
+                self.elapsed = time.monotonic() - start
+                logger.info(
+                    'fetched %d items in %d pages in %.1fs',
+                    self.items_fetched, self.pages_fetched, self.elapsed)
+
+    def commit(self):
+        '''
+        Save in the checkpoint that every page yielded so far has been
+        written out, e.g. once the output has been flushed.
+        '''
+        if self.checkpoint is None or self._uncommitted is None:
+            return
+        next_index, last = self._uncommitted
+        self._uncommitted = None
+        if last:
+            self.checkpoint.clear()
+        else:
+            self.checkpoint.save(next_index)
+
+    def __iter__(self):
+        '''
+        Yield every item; this never moves the checkpoint, see `commit()`.
+        '''
+        for index, items in self.pages():
+            yield from items
+
+    def stats(self):
+        return {
+            'pages': self.pages_fetched,
+            'items': self.items_fetched,
+            'elapsed': self.elapsed,
+            'items_per_second': self.items_fetched / self.elapsed if self.elapsed else 0.0,
+        }
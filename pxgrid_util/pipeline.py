@@ -0,0 +1,180 @@
+import asyncio
+import inspect
+import logging
+import struct
+import tempfile
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PIPELINE_SIZE = 10000
+OVERFLOW_POLICIES = ('block', 'drop-oldest', 'spill')
+
+# spilled record header: enqueue time and body length
+SPILL_RECORD = struct.Struct('>dI')
+
+
+class SpillFile:
+    '''
+    FIFO of `(enqueued_at, bytes)` records in an anonymous temporary file,
+    used to hold events the in-memory queue has no room for.
+    '''
+
+    def __init__(self, dir=None):
+        self.file = tempfile.TemporaryFile(dir=dir)
+        self.read_pos = 0
+        self.write_pos = 0
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, enqueued_at, data):
+        self.file.seek(self.write_pos)
+        self.file.write(SPILL_RECORD.pack(enqueued_at, len(data)))
+        self.file.write(data)
+        self.write_pos = self.file.tell()
+        self.count += 1
+
+    def popleft(self):
+        self.file.seek(self.read_pos)
+        enqueued_at, length = SPILL_RECORD.unpack(self.file.read(SPILL_RECORD.size))
+        data = self.file.read(length)
+        self.read_pos = self.file.tell()
+        self.count -= 1
+        if self.count == 0:
+            # everything has been read back, so start over at the beginning
+            self.file.seek(0)
+            self.file.truncate()
+            self.read_pos = self.write_pos = 0
+        return enqueued_at, data
+
+    def close(self):
+        self.file.close()
+
+
+class EventPipeline:
+    '''
+    Bounded queue between a network reader and the workers that process
+    its events, so a slow consumer (such as a blocked stdout) does not stall
+    the reads. When `maxsize` events are waiting, `put()` applies the
+    `overflow` policy:
+
+    - `block`: wait for room, pushing back on the reader
+    - `drop-oldest`: discard the oldest waiting event
+    - `spill`: append the event (which must be `bytes`) to a temporary file
+      in `spill_dir`, to be read back in order once the queue drains
+
+    Counters for depth, drops, spills and end-to-end lag (from `put()` to
+    the consumer returning) are available from `stats()`.
+    '''
+
+    def __init__(self, maxsize=DEFAULT_PIPELINE_SIZE, overflow='block', spill_dir=None, clock=time.monotonic):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError('overflow must be one of %s, not %r' % (', '.join(OVERFLOW_POLICIES), overflow))
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.clock = clock
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.spill = SpillFile(spill_dir) if overflow == 'spill' else None
+        self.enqueued = 0
+        self.processed = 0
+        self.dropped = 0
+        self.spilled = 0
+        self.errors = 0
+        self.max_depth = 0
+        self.lag_total = 0.0
+        self.lag_max = 0.0
+
+    def depth(self):
+        return self.queue.qsize() + (len(self.spill) if self.spill is not None else 0)
+
+    async def put(self, item):
+        entry = (self.clock(), item)
+        self.enqueued += 1
+        if self.overflow == 'block':
+            await self.queue.put(entry)
+        elif self.overflow == 'drop-oldest':
+            if self.queue.full():
+                self.queue.get_nowait()
+                self.queue.task_done()
+                self.dropped += 1
+            self.queue.put_nowait(entry)
+        elif len(self.spill) or self.queue.full():
+            # once anything is spilled, later events queue behind it on disk
+            self.spill.append(*entry)
+            self.spilled += 1
+        else:
+            self.queue.put_nowait(entry)
+        self.max_depth = max(self.max_depth, self.depth())
+
+    async def get(self):
+        '''
+        Return the next `(enqueued_at, item)`.
+        '''
+        entry = await self.queue.get()
+        if self.spill is not None and len(self.spill) and not self.queue.full():
+            self.queue.put_nowait(self.spill.popleft())
+        return entry
+
+    def task_done(self, enqueued_at):
+        lag = self.clock() - enqueued_at
+        self.processed += 1
+        self.lag_total += lag
+        self.lag_max = max(self.lag_max, lag)
+        self.queue.task_done()
+
+    async def worker(self, consumer, offload=False):
+        '''
+        Pass each event to `consumer` until cancelled. A coroutine result is
+        awaited; with `offload` a plain function runs in a thread, so
+        blocking I/O in it does not hold up the event loop.
+        '''
+        while True:
+            enqueued_at, item = await self.get()
+            try:
+                if offload:
+                    result = await asyncio.to_thread(consumer, item)
+                else:
+                    result = consumer(item)
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as e:
+                self.errors += 1
+                logger.warning('pipeline consumer failed: %s', e)
+            finally:
+                self.task_done(enqueued_at)
+
+    def start(self, consumer, workers=1, offload=False):
+        '''
+        Start `workers` consumer tasks and return them. Events are consumed
+        in order only with a single worker.
+        '''
+        return [asyncio.create_task(self.worker(consumer, offload=offload)) for _ in range(workers)]
+
+    async def drain(self):
+        '''
+        Wait until every event put so far has been consumed.
+        '''
+        while True:
+            await self.queue.join()
+            if self.spill is None or not len(self.spill):
+                return
+            self.queue.put_nowait(self.spill.popleft())
+
+    def close(self):
+        if self.spill is not None:
+            self.spill.close()
+
+    def stats(self):
+        return {
+            'depth': self.depth(),
+            'max_depth': self.max_depth,
+            'enqueued': self.enqueued,
+            'processed': self.processed,
+            'dropped': self.dropped,
+            'spilled': self.spilled,
+            'errors': self.errors,
+            'mean_lag': self.lag_total / self.processed if self.processed else 0.0,
+            'max_lag': self.lag_max,
+        }
@@ -0,0 +1,267 @@
+import http.client
+import io
+import logging
+import threading
+import time
+import urllib.error
+from urllib.parse import urlsplit
+
+from .compression import ACCEPT_ENCODING
+from .compression import DecodingReader
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_PER_HOST = 4
+DEFAULT_IDLE_TIMEOUT = 60.0
+
+# errors that indicate a kept-alive socket was closed by the server while idle
+STALE_CONNECTION_ERRORS = (
+    http.client.RemoteDisconnected,
+    http.client.BadStatusLine,
+    ConnectionResetError,
+    BrokenPipeError,
+)
+
+
+class PooledHTTPSConnection(http.client.HTTPSConnection):
+    '''
+    HTTPS connection that resumes a previously negotiated TLS session, so a
+    new socket to a known host skips the full handshake.
+    '''
+
+    def __init__(self, host, port, context, timeout, tls_session=None):
+        super().__init__(host, port, timeout=timeout, context=context)
+        self.tls_session = tls_session
+        self.idle_since = None
+
+    def connect(self):
+        http.client.HTTPConnection.connect(self)
+        server_hostname = self._tunnel_host or self.host
+        self.sock = self._context.wrap_socket(
+            self.sock,
+            server_hostname=server_hostname,
+            session=self.tls_session)
+        if self.sock.session_reused:
+            logger.debug('resumed TLS session to %s:%s', self.host, self.port)
+
+
+class PooledHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, host, port, context, timeout, tls_session=None):
+        super().__init__(host, port, timeout=timeout)
+        self.tls_session = None
+        self.idle_since = None
+
+
+class PooledResponse:
+    '''
+    Wraps an `http.client.HTTPResponse` and hands the connection back to the
+    pool once the body has been fully read and the response is closed. A
+    body with a Content-Encoding is decoded as it is read.
+    '''
+
+    def __init__(self, pool, key, conn, response):
+        self.pool = pool
+        self.key = key
+        self.conn = conn
+        self.response = response
+        self.status = response.status
+        self.reason = response.reason
+        self.headers = response.headers
+        encoding = (response.getheader('Content-Encoding') or '').strip().lower()
+        self.content_encoding = encoding if encoding not in ('', 'identity') else None
+        self.body = response
+        if self.content_encoding:
+            self.body = DecodingReader(response, self.content_encoding)
+
+    def read(self, amt=None):
+        return self.body.read(amt)
+
+    def readinto(self, b):
+        data = self.body.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        if self.conn is None:
+            return
+        reusable = self.response.isclosed() and not self.response.will_close
+        self.response.close()
+        self.pool.release(self.key, self.conn, reusable)
+        self.conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ConnectionPool:
+    '''
+    Thread-safe pool of keep-alive HTTP(S) connections keyed by
+    scheme/host/port. At most `max_per_host` connections are open to any one
+    host; idle connections older than `idle_timeout` seconds are closed the
+    next time the pool is used.
+
+    Requests ask for a compressed response with `accept_encoding` unless
+    they set Accept-Encoding themselves; pass None to not ask.
+    '''
+
+    def __init__(self, ssl_context, max_per_host=DEFAULT_MAX_PER_HOST, idle_timeout=DEFAULT_IDLE_TIMEOUT,
+                 accept_encoding=ACCEPT_ENCODING):
+        self.ssl_context = ssl_context
+        self.max_per_host = max_per_host
+        self.idle_timeout = idle_timeout
+        self.accept_encoding = accept_encoding
+        self._cond = threading.Condition()
+        self._idle = {}
+        self._open = {}
+        self._tls_sessions = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.retries = 0
+        self.decoded = 0
+
+    def stats(self):
+        with self._cond:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'retries': self.retries,
+                'decoded': self.decoded,
+                'open': sum(self._open.values()),
+                'idle': sum(len(c) for c in self._idle.values()),
+            }
+
+    def _evict_idle(self, now):
+        for key, conns in self._idle.items():
+            while conns and now - conns[0].idle_since > self.idle_timeout:
+                conn = conns.pop(0)
+                conn.close()
+                self._open[key] -= 1
+                self.evictions += 1
+
+    def evict_idle(self):
+        with self._cond:
+            self._evict_idle(time.monotonic())
+            self._cond.notify_all()
+
+    def acquire(self, key, timeout):
+        scheme, host, port = key
+        with self._cond:
+            while True:
+                self._evict_idle(time.monotonic())
+                conns = self._idle.get(key)
+                if conns:
+                    self.hits += 1
+                    conn = conns.pop()
+                    conn.timeout = timeout
+                    if conn.sock is not None:
+                        conn.sock.settimeout(timeout)
+                    return conn, True
+                if self._open.get(key, 0) < self.max_per_host:
+                    self.misses += 1
+                    self._open[key] = self._open.get(key, 0) + 1
+                    tls_session = self._tls_sessions.get(key)
+                    break
+                self._cond.wait()
+        if scheme == 'https':
+            conn_class = PooledHTTPSConnection
+        else:
+            conn_class = PooledHTTPConnection
+        return conn_class(host, port, self.ssl_context, timeout, tls_session), False
+
+    def release(self, key, conn, reusable):
+        with self._cond:
+            if reusable and conn.sock is not None:
+                if getattr(conn.sock, 'session', None) is not None:
+                    self._tls_sessions[key] = conn.sock.session
+                conn.idle_since = time.monotonic()
+                self._idle.setdefault(key, []).append(conn)
+            else:
+                conn.close()
+                self._open[key] -= 1
+            self._cond.notify()
+
+    def urlopen(self, method, url, body=None, headers=None, timeout=None):
+        '''
+        Issue a request and return a `PooledResponse`. Non-2xx responses are
+        raised as `urllib.error.HTTPError`, matching `urllib.request`.
+        '''
+        parts = urlsplit(url)
+        port = parts.port or (443 if parts.scheme == 'https' else 80)
+        key = (parts.scheme, parts.hostname, port)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        headers = dict(headers or {})
+        if self.accept_encoding and not any(h.lower() == 'accept-encoding' for h in headers):
+            headers['Accept-Encoding'] = self.accept_encoding
+        conn, reused = self.acquire(key, timeout)
+        try:
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+        except STALE_CONNECTION_ERRORS as e:
+            self.release(key, conn, False)
+            if not reused:
+                raise
+            logger.debug('stale pooled connection to %s:%s (%s), retrying', key[1], key[2], e)
+            with self._cond:
+                self.retries += 1
+            conn, reused = self.acquire(key, timeout)
+            try:
+                conn.request(method, path, body=body, headers=headers)
+                response = conn.getresponse()
+            except Exception:
+                self.release(key, conn, False)
+                raise
+        except Exception:
+            self.release(key, conn, False)
+            raise
+        try:
+            pooled = PooledResponse(self, key, conn, response)
+        except ValueError:
+            response.close()
+            self.release(key, conn, False)
+            raise
+        if pooled.content_encoding:
+            with self._cond:
+                self.decoded += 1
+        if response.status >= 400:
+            with pooled:
+                error_body = pooled.read()
+            raise urllib.error.HTTPError(
+                url, response.status, response.reason, response.headers,
+                io.BytesIO(error_body))
+        return pooled
+
+    def request(self, method, url, body=None, headers=None, timeout=None):
+        with self.urlopen(method, url, body=body, headers=headers, timeout=timeout) as response:
+            return response.read()
+
+    def close(self):
+        with self._cond:
+            for key, conns in self._idle.items():
+                for conn in conns:
+                    conn.close()
+                    self._open[key] -= 1
+            self._idle.clear()
+            self._cond.notify_all()
+
+
+_shared_pools = {}
+_shared_pools_lock = threading.Lock()
+
+
+def shared_pool(ssl_context):
+    '''
+    Return the process-wide pool for `ssl_context`, creating it on first use.
+    '''
+    with _shared_pools_lock:
+        entry = _shared_pools.get(id(ssl_context))
+        if entry is None or entry[0] is not ssl_context:
+            entry = (ssl_context, ConnectionPool(ssl_context))
+            _shared_pools[id(ssl_context)] = entry
+        return entry[1]
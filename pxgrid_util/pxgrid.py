@@ -1,49 +1,119 @@
+import aiohttp
 import base64
+import contextlib
 import json
-import urllib.request
 import logging
+import urllib.error
+from .cache import DiscoveryCache
+from .nodes import NodeSelector
+from .pool import DEFAULT_MAX_PER_HOST
+from .pool import shared_pool
 
 logger = logging.getLogger(__name__)
 
+# status codes that mean cached discovery data (or our credentials) are stale
+INVALIDATING_STATUS_CODES = (401, 404)
+
+# control calls that change state, and so are never sent to two
+# controllers at once
+UNHEDGED_CALLS = ('ServiceRegister', 'ServiceReregister', 'ServiceUnregister')
+
 
 class PXGridControl:
-    def __init__(self, config):
+    def __init__(self, config, pool=None, cache=None):
         self.config = config
+        self.pool = pool
+        if cache is None:
+            cache = DiscoveryCache.from_config(config)
+        self.cache = cache
+
+    def control_nodes(self):
+        '''
+        The `--hostname` controllers, healthiest first when used.
+        '''
+        return NodeSelector(self.config.hostname)
 
     def send_rest_request(self, url_suffix, payload):
+        '''
+        POST to the control API of the healthiest `--hostname` controller,
+        failing over to the others; see `NodeSelector`.
+        '''
         logger.debug('send_rest_request %s', url_suffix)
-        url = 'https://{}:{}/pxgrid/control/{}'.format(
-            self.config.hostname[0],
-            self.config.port,
-            url_suffix)
         json_string = json.dumps(payload)
-        handler = urllib.request.HTTPSHandler(context=self.config.ssl_context)
-        opener = urllib.request.build_opener(handler)
-        rest_request = urllib.request.Request(
-            url=url, data=str.encode(json_string))
-        rest_request.add_header('Content-Type', 'application/json')
-        rest_request.add_header('Accept', 'application/json')
         username_password = '%s:%s' % (self.config.node_name, self.config.password)
         b64 = base64.b64encode(username_password.encode()).decode()
-        rest_request.add_header('Authorization', 'Basic ' + b64)
-        rest_response = opener.open(rest_request, timeout=self.config.timeout)
-        response = rest_response.read().decode()
-        return json.loads(response)
+        headers = {
+            'Content-Type': 'application/json',
+            'Accept': 'application/json',
+            'Authorization': 'Basic ' + b64,
+        }
+        if self.pool is None:
+            self.pool = shared_pool(self.config.ssl_context)
+
+        def send(hostname):
+            url = 'https://{}:{}/pxgrid/control/{}'.format(
+                hostname,
+                self.config.port,
+                url_suffix)
+            try:
+                return self.pool.request(
+                    'POST', url, body=str.encode(json_string), headers=headers,
+                    timeout=self.config.timeout)
+            except urllib.error.HTTPError as e:
+                if e.code == 401 and self.cache is not None:
+                    self.cache.clear()
+                raise
+
+        hedge_after = None if url_suffix in UNHEDGED_CALLS else self.config.hedge_after
+        return json.loads(self.control_nodes().call(send, hedge_after=hedge_after))
+
+    @contextlib.contextmanager
+    def invalidate_on_error(self, service_name=None, peer_node_name=None):
+        '''
+        Wrap a provider REST call made with discovered data; if it fails with
+        401 or 404, drop the cached lookup and secret it was made with.
+        '''
+        try:
+            yield
+        except urllib.error.HTTPError as e:
+            if e.code in INVALIDATING_STATUS_CODES and self.cache is not None:
+                if service_name is not None:
+                    self.cache.invalidate_service(service_name)
+                if peer_node_name is not None:
+                    self.cache.invalidate_secret(peer_node_name)
+            raise
 
     def account_activate(self):
         logger.debug('account_activate')
+        if self.cache is not None:
+            cached = self.cache.get_account()
+            if cached is not None:
+                return cached
         payload = {}
         if self.config.description is not None:
             payload['description'] = self.config.description
-        return self.send_rest_request('AccountActivate', payload)
+        response = self.send_rest_request('AccountActivate', payload)
+        if self.cache is not None and response.get('accountState') == 'ENABLED':
+            self.cache.put_account(response)
+        return response
 
     def service_lookup(self, service_name):
         logger.debug('service_lookup %s', service_name)
+        if self.cache is not None:
+            cached = self.cache.get_service(service_name)
+            if cached is not None:
+                return cached
         payload = {'name': service_name}
-        return self.send_rest_request('ServiceLookup', payload)
+        with self.invalidate_on_error(service_name=service_name):
+            response = self.send_rest_request('ServiceLookup', payload)
+        if self.cache is not None and response.get('services'):
+            self.cache.put_service(service_name, response)
+        return response
 
     def service_register(self, service_name, properties):
         logger.debug('service_register %s', service_name)
+        if self.cache is not None:
+            self.cache.invalidate_service(service_name)
         payload = {'name': service_name, 'properties': properties}
         return self.send_rest_request('ServiceRegister', payload)
 
@@ -59,5 +129,150 @@ class PXGridControl:
 
     def get_access_secret(self, peer_node_name):
         logger.debug('get_access_secret %s', peer_node_name)
+        if self.cache is not None:
+            cached = self.cache.get_secret(peer_node_name)
+            if cached is not None:
+                return cached
+        payload = {'peerNodeName': peer_node_name}
+        with self.invalidate_on_error(peer_node_name=peer_node_name):
+            response = self.send_rest_request('AccessSecret', payload)
+        if self.cache is not None:
+            self.cache.put_secret(peer_node_name, response)
+        return response
+
+
+class AsyncPXGridControl:
+    '''
+    asyncio twin of `PXGridControl` for use inside an event loop. All calls
+    share one `aiohttp.ClientSession`, so keep-alive connections are pooled
+    across requests. Use as an async context manager, or call `close()`.
+    '''
+
+    def __init__(self, config, session=None, limit_per_host=DEFAULT_MAX_PER_HOST, cache=None):
+        self.config = config
+        self.session = session
+        self.limit_per_host = limit_per_host
+        self._owns_session = session is None
+        if cache is None:
+            cache = DiscoveryCache.from_config(config)
+        self.cache = cache
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def close(self):
+        if self._owns_session and self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def _get_session(self):
+        if self.session is None:
+            connector = aiohttp.TCPConnector(
+                ssl=self.config.ssl_context,
+                limit_per_host=self.limit_per_host)
+            self.session = aiohttp.ClientSession(connector=connector)
+        return self.session
+
+    def control_nodes(self):
+        return NodeSelector(self.config.hostname)
+
+    async def send_rest_request(self, url_suffix, payload):
+        logger.debug('send_rest_request %s', url_suffix)
+        username_password = '%s:%s' % (self.config.node_name, self.config.password)
+        b64 = base64.b64encode(username_password.encode()).decode()
+        headers = {
+            'Content-Type': 'application/json',
+            'Accept': 'application/json',
+            'Authorization': 'Basic ' + b64,
+        }
+        data = json.dumps(payload).encode()
+
+        async def send(hostname):
+            url = 'https://{}:{}/pxgrid/control/{}'.format(
+                hostname,
+                self.config.port,
+                url_suffix)
+            async with self._get_session().post(
+                    url,
+                    data=data,
+                    headers=headers,
+                    timeout=aiohttp.ClientTimeout(total=self.config.timeout)) as rest_response:
+                if rest_response.status == 401 and self.cache is not None:
+                    self.cache.clear()
+                rest_response.raise_for_status()
+                return json.loads(await rest_response.read())
+
+        hedge_after = None if url_suffix in UNHEDGED_CALLS else self.config.hedge_after
+        return await self.control_nodes().acall(send, hedge_after=hedge_after)
+
+    @contextlib.contextmanager
+    def invalidate_on_error(self, service_name=None, peer_node_name=None):
+        try:
+            yield
+        except aiohttp.ClientResponseError as e:
+            if e.status in INVALIDATING_STATUS_CODES and self.cache is not None:
+                if service_name is not None:
+                    self.cache.invalidate_service(service_name)
+                if peer_node_name is not None:
+                    self.cache.invalidate_secret(peer_node_name)
+            raise
+
+    async def account_activate(self):
+        logger.debug('account_activate')
+        if self.cache is not None:
+            cached = self.cache.get_account()
+            if cached is not None:
+                return cached
+        payload = {}
+        if self.config.description is not None:
+            payload['description'] = self.config.description
+        response = await self.send_rest_request('AccountActivate', payload)
+        if self.cache is not None and response.get('accountState') == 'ENABLED':
+            self.cache.put_account(response)
+        return response
+
+    async def service_lookup(self, service_name):
+        logger.debug('service_lookup %s', service_name)
+        if self.cache is not None:
+            cached = self.cache.get_service(service_name)
+            if cached is not None:
+                return cached
+        payload = {'name': service_name}
+        with self.invalidate_on_error(service_name=service_name):
+            response = await self.send_rest_request('ServiceLookup', payload)
+        if self.cache is not None and response.get('services'):
+            self.cache.put_service(service_name, response)
+        return response
+
+    async def service_register(self, service_name, properties):
+        logger.debug('service_register %s', service_name)
+        if self.cache is not None:
+            self.cache.invalidate_service(service_name)
+        payload = {'name': service_name, 'properties': properties}
+        return await self.send_rest_request('ServiceRegister', payload)
+
+    async def service_reregister(self, service_id):
+        logger.debug('service_reregister %s', service_id)
+        payload = {'id': service_id}
+        return await self.send_rest_request('ServiceReregister', payload)
+
+    async def service_unregister(self, service_id):
+        logger.debug('service_unregister %s', service_id)
+        payload = {'id': service_id}
+        return await self.send_rest_request('ServiceUnregister', payload)
+
+    async def get_access_secret(self, peer_node_name):
+        logger.debug('get_access_secret %s', peer_node_name)
+        if self.cache is not None:
+            cached = self.cache.get_secret(peer_node_name)
+            if cached is not None:
+                return cached
         payload = {'peerNodeName': peer_node_name}
-        return self.send_rest_request('AccessSecret', payload)
+        with self.invalidate_on_error(peer_node_name=peer_node_name):
+            response = await self.send_rest_request('AccessSecret', payload)
+        if self.cache is not None:
+            self.cache.put_secret(peer_node_name, response)
+        return response
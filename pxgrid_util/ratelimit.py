@@ -0,0 +1,35 @@
+import asyncio
+import time
+
+
+class TokenBucket:
+    '''
+    Allows `rate` acquisitions per second on average, with bursts of up to
+    `burst`. A `rate` of 0 or None means no limit.
+    '''
+
+    def __init__(self, rate, burst=None, clock=time.monotonic, sleep=asyncio.sleep):
+        self.rate = rate
+        self.burst = burst or max(1.0, rate or 1.0)
+        self.clock = clock
+        self.sleep = sleep
+        self.tokens = self.burst
+        self.updated = clock()
+
+    async def acquire(self):
+        while not self.try_acquire():
+            await self.sleep((1.0 - self.tokens) / self.rate)
+
+    def try_acquire(self):
+        '''
+        Take a token if one is available right now, without waiting.
+        '''
+        if not self.rate:
+            return True
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return True
+        return False
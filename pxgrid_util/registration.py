@@ -0,0 +1,134 @@
+import asyncio
+import logging
+import time
+
+import aiohttp
+
+from .backoff import ExponentialBackoff
+
+logger = logging.getLogger(__name__)
+
+# used when ServiceRegister does not say how often to reregister
+DEFAULT_REREGISTER_INTERVAL = 60.0
+
+# reregister once this fraction of the interval is left, leaving time for
+# retries before the registration lapses
+DEFAULT_REREGISTER_MARGIN = 0.25
+
+# ServiceReregister statuses meaning the registration id is no longer known
+ID_UNKNOWN_STATUS_CODES = (400, 404, 410)
+
+# failures worth retrying
+RETRY_ERRORS = (aiohttp.ClientError, asyncio.TimeoutError, OSError)
+
+
+def is_id_unknown(exc):
+    return isinstance(exc, aiohttp.ClientResponseError) and exc.status in ID_UNKNOWN_STATUS_CODES
+
+
+class ServiceRegistration:
+    '''
+    Keeps a custom service registered through an `AsyncPXGridControl`.
+
+    `run()` reregisters once `margin` of the server's reregisterTimeMillis
+    is left (or every `interval` seconds, if given), retrying failures with
+    jittered exponential backoff. If the server no longer knows the
+    registration id, or retries run past the end of the interval, the
+    service is registered again from scratch. When `run()` is cancelled the
+    service is unregistered. Nothing blocks the event loop.
+    '''
+
+    def __init__(self, pxgrid, service_name, properties, interval=None,
+                 margin=DEFAULT_REREGISTER_MARGIN, backoff=None,
+                 clock=time.monotonic, sleep=asyncio.sleep):
+        self.pxgrid = pxgrid
+        self.service_name = service_name
+        self.properties = properties
+        self.interval = interval
+        self.margin = margin
+        self.backoff = backoff or ExponentialBackoff(initial=1.0, maximum=30.0)
+        self.clock = clock
+        self.sleep = sleep
+        self.service_id = None
+        self.server_interval = DEFAULT_REREGISTER_INTERVAL
+        self.expires_at = None
+        self.registrations = 0
+        self.reregistrations = 0
+        self.failures = 0
+
+    def adopt(self, response):
+        '''
+        Take over a registration made elsewhere, from its ServiceRegister
+        response.
+        '''
+        self.service_id = response['id']
+        millis = response.get('reregisterTimeMillis')
+        self.server_interval = millis / 1000.0 if millis else DEFAULT_REREGISTER_INTERVAL
+        self.expires_at = self.clock() + self.server_interval
+        return response
+
+    def next_due(self):
+        '''
+        Seconds until the next reregistration is due.
+        '''
+        if self.interval is not None:
+            delay = self.interval
+        else:
+            delay = self.server_interval * (1.0 - self.margin)
+        elapsed = self.server_interval - (self.expires_at - self.clock())
+        return max(0.0, delay - elapsed)
+
+    async def register(self):
+        response = await self.pxgrid.service_register(self.service_name, self.properties)
+        self.registrations += 1
+        logger.info(
+            'registered %s as %s, reregistering within %.0fs',
+            self.service_name, response['id'], (response.get('reregisterTimeMillis') or 0) / 1000.0)
+        return self.adopt(response)
+
+    async def reregister(self):
+        await self.pxgrid.service_reregister(self.service_id)
+        self.reregistrations += 1
+        self.expires_at = self.clock() + self.server_interval
+        logger.debug('reregistered %s', self.service_id)
+
+    async def unregister(self):
+        if self.service_id is None:
+            return
+        service_id, self.service_id = self.service_id, None
+        try:
+            await self.pxgrid.service_unregister(service_id)
+            logger.info('unregistered %s', service_id)
+        except RETRY_ERRORS as e:
+            logger.warning('failed to unregister %s: %s', service_id, e)
+
+    async def run(self):
+        try:
+            while True:
+                if self.service_id is not None:
+                    await self.sleep(self.next_due())
+                try:
+                    if self.service_id is None:
+                        await self.register()
+                    else:
+                        await self.reregister()
+                except RETRY_ERRORS as e:
+                    self.failures += 1
+                    if self.service_id is not None and (is_id_unknown(e) or self.clock() >= self.expires_at):
+                        logger.warning('registration %s lapsed (%s), registering again', self.service_id, e)
+                        self.service_id = None
+                    delay = self.backoff.next_delay()
+                    logger.warning('registration of %s failed (%s), retrying in %.1fs', self.service_name, e, delay)
+                    await self.sleep(delay)
+                    continue
+                self.backoff.reset()
+        finally:
+            await self.unregister()
+
+    def stats(self):
+        return {
+            'service_id': self.service_id,
+            'registrations': self.registrations,
+            'reregistrations': self.reregistrations,
+            'failures': self.failures,
+        }
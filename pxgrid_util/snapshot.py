@@ -0,0 +1,239 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+from urllib.parse import urlparse
+
+import aiohttp
+
+from .nodes import NodeSelector
+from .output import OutputWriter
+from .pool import DEFAULT_MAX_PER_HOST
+from .pxgrid import AsyncPXGridControl
+from .streaming import JSONArrayStream
+
+logger = logging.getLogger(__name__)
+
+# name: (service, path) of the queries px-snapshot knows by name
+SNAPSHOT_QUERIES = {
+    'sgts': ('com.cisco.ise.config.trustsec', '/getSecurityGroups'),
+    'sgacls': ('com.cisco.ise.config.trustsec', '/getSecurityGroupAcls'),
+    'matrix': ('com.cisco.ise.config.trustsec', '/getEgressPolicies'),
+    'profiles': ('com.cisco.ise.config.profiler', '/getProfiles'),
+    'sxp-bindings': ('com.cisco.ise.sxp', '/getBindings'),
+    'sessions': ('com.cisco.ise.session', '/getSessions'),
+    'user-groups': ('com.cisco.ise.session', '/getUserGroups'),
+}
+
+# what the separate *-query-all scripts download between them
+DEFAULT_SNAPSHOT_QUERIES = ('sgts', 'sgacls', 'matrix', 'profiles', 'sxp-bindings', 'sessions')
+
+
+def parse_snapshot_query(spec):
+    '''
+    `(name, service, path)` for one of `SNAPSHOT_QUERIES` by name, or for
+    any other query given as NAME=SERVICE/PATH, such as
+    `healths=com.cisco.ise.system/getHealths`.
+    '''
+    if spec in SNAPSHOT_QUERIES:
+        return (spec,) + SNAPSHOT_QUERIES[spec]
+    name, sep, target = spec.partition('=')
+    service, slash, path = target.partition('/')
+    if not (sep and slash and name and service and path):
+        raise ValueError('unknown snapshot query %r, expected one of %s or NAME=SERVICE/PATH' % (
+            spec, ', '.join(SNAPSHOT_QUERIES)))
+    return name, service, '/' + path
+
+
+class ResponseReader:
+    '''
+    Blocking `read(size)` over the body of an aiohttp response, so a worker
+    thread can parse it while the event loop is still downloading it.
+    '''
+
+    def __init__(self, response, loop):
+        self.response = response
+        self.loop = loop
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        data = asyncio.run_coroutine_threadsafe(self.response.content.read(size), self.loop).result()
+        self.bytes_read += len(data)
+        return data
+
+
+def argparse_snapshot_query(spec):
+    try:
+        return parse_snapshot_query(spec)
+    except ValueError as exc:
+        raise argparse.ArgumentTypeError(str(exc))
+
+
+class Snapshot:
+    '''
+    Downloads several queries, across one or more services, in one go.
+    The account is activated once, each service looked up once and each
+    node's access secret fetched once; then all the queries run at the same
+    time over one aiohttp session, each going to the healthiest node
+    providing its service (see `NodeSelector`).
+
+    `queries` are `(name, service, path)` tuples, see `parse_snapshot_query`.
+    Each result is written as it arrives to `<directory>/<name>.<output
+    format>` (via a temporary file, so a file is never left half written).
+    A single query may instead be written to `stream`, stdout by default.
+    As with `write_query`, `ndjson` and `msgpack` output is converted one
+    element at a time while the response is read, so memory use does not
+    grow with the size of the result. One query failing does not stop the
+    others; `run()` returns the stats of each, with the error of any that
+    failed.
+    '''
+
+    def __init__(self, config, queries, directory=None, stream=None, session=None, clock=time.monotonic):
+        names = [name for name, _, _ in queries]
+        if len(set(names)) != len(names):
+            raise ValueError('snapshot query names must be unique: %s' % ', '.join(names))
+        if directory is None and len(names) > 1:
+            raise ValueError('several snapshot queries need a directory to write them to')
+        self.config = config
+        self.queries = list(queries)
+        self.directory = directory
+        self.stream = stream
+        self.session = session
+        self.clock = clock
+
+    def filename(self, name):
+        return os.path.join(self.directory, '%s.%s' % (name, self.config.output_format))
+
+    def query_nodes(self, lookup, path):
+        '''
+        `(url, node name)` for `path` on each node providing a service.
+        '''
+        from . import create_override_url
+
+        nodes = []
+        for service in lookup.get('services') or []:
+            url = service['properties']['restBaseUrl'] + path
+            if self.config.discovery_override:
+                url = create_override_url(self.config, url)
+            if all(url != other for other, _ in nodes):
+                nodes.append((url, service['nodeName']))
+        return nodes
+
+    async def fetch(self, session, pxgrid, service, nodes, secrets):
+        '''
+        Send a query to the healthiest node and return the response once its
+        headers have arrived; the caller reads and releases it.
+        '''
+        from . import query_headers
+
+        timeout = aiohttp.ClientTimeout(sock_connect=self.config.timeout, sock_read=self.config.timeout)
+
+        async def send(node):
+            url, node_name = node
+            headers = query_headers(self.config, secrets[node_name])
+            with pxgrid.invalidate_on_error(service_name=service, peer_node_name=node_name):
+                response = await session.post(url, data=b'{}', headers=headers, timeout=timeout)
+                try:
+                    response.raise_for_status()
+                except Exception:
+                    response.release()
+                    raise
+                return response
+
+        selector = NodeSelector(nodes, key=lambda node: urlparse(node[0]).netloc)
+        return await selector.acall(
+            send, hedge_after=self.config.hedge_after, discard=lambda response: response.release())
+
+    def write(self, name, body):
+        '''
+        Write a response body (anything with `read(size)`) in the output
+        format, as `write_query` does, and return the number of records
+        written.
+        '''
+        if self.directory is None:
+            return self._write(self.stream, body)
+        path = self.filename(name)
+        f = open(path + '.part', 'wb')
+        try:
+            with f:
+                records = self._write(f, body)
+        except BaseException:
+            os.remove(path + '.part')
+            raise
+        os.replace(path + '.part', path)
+        return records
+
+    def _write(self, stream, body):
+        with OutputWriter(stream, format=self.config.output_format) as output:
+            if output.format == 'json':
+                data = body.read()
+                output.write(json.loads(data) if data else {})
+            else:
+                for key, item in JSONArrayStream(body):
+                    output.write(item)
+        return output.records
+
+    async def run_query(self, session, pxgrid, query, lookup, secrets):
+        name, service, path = query
+        stats = {'name': name, 'service': service, 'path': path}
+        start = self.clock()
+        try:
+            nodes = self.query_nodes(lookup, path)
+            if not nodes:
+                raise LookupError('no nodes provide %s' % service)
+            response = await self.fetch(session, pxgrid, service, nodes, secrets)
+            stats['first_byte_seconds'] = self.clock() - start
+            try:
+                body = ResponseReader(response, asyncio.get_running_loop())
+                stats['records'] = await asyncio.to_thread(self.write, name, body)
+            finally:
+                response.release()
+            stats['bytes'] = body.bytes_read
+            logger.info('%s: %d bytes, %d records', name, stats['bytes'], stats['records'])
+        except (aiohttp.ClientError, asyncio.TimeoutError, OSError, LookupError, ValueError) as e:
+            logger.warning('%s failed: %s', name, e)
+            stats['error'] = str(e) or type(e).__name__
+        stats['seconds'] = self.clock() - start
+        return stats
+
+    async def access_secrets(self, pxgrid, node_names):
+        secrets = await asyncio.gather(*[pxgrid.get_access_secret(node_name) for node_name in node_names])
+        return {node_name: secret['secret'] for node_name, secret in zip(node_names, secrets)}
+
+    async def run(self):
+        start = self.clock()
+        session = self.session
+        if session is None:
+            connector = aiohttp.TCPConnector(ssl=self.config.ssl_context, limit_per_host=DEFAULT_MAX_PER_HOST)
+            session = aiohttp.ClientSession(connector=connector)
+        if self.directory is None and self.stream is None:
+            self.stream = sys.stdout.buffer
+        if self.directory is not None:
+            os.makedirs(self.directory, exist_ok=True)
+        try:
+            pxgrid = AsyncPXGridControl(self.config, session=session)
+            while (await pxgrid.account_activate())['accountState'] != 'ENABLED':
+                await asyncio.sleep(60)
+
+            services = list(dict.fromkeys(service for _, service, _ in self.queries))
+            lookups = dict(zip(services, await asyncio.gather(*[pxgrid.service_lookup(s) for s in services])))
+            node_names = list(dict.fromkeys(
+                node['nodeName'] for lookup in lookups.values() for node in lookup.get('services') or []))
+            secrets = await self.access_secrets(pxgrid, node_names)
+            discovery_seconds = self.clock() - start
+
+            results = await asyncio.gather(*[
+                self.run_query(session, pxgrid, query, lookups[query[1]], secrets) for query in self.queries])
+        finally:
+            if self.session is None:
+                await session.close()
+        return {
+            'queries': results,
+            'discovery_seconds': discovery_seconds,
+            'query_seconds': sum(r['seconds'] for r in results),
+            'seconds': self.clock() - start,
+            'failed': sum(1 for r in results if 'error' in r),
+        }
@@ -1,8 +1,63 @@
 import io
 import logging
+import re
 
 logger = logging.getLogger(__name__)
 
+# end of the header block: the first empty line, with optional carriage returns
+HEADER_END = re.compile(b'\r?\n\r?\n')
+NUL = re.compile(b'\0')
+EOL_BYTES = (ord('\n'), ord('\r'))
+
+# largest incomplete frame `StompFrameReader` buffers before giving up on the peer
+DEFAULT_MAX_FRAME_SIZE = 16 * 1024 * 1024
+
+# STOMP 1.2 header escapes; CONNECT and CONNECTED frames are never escaped
+UNESCAPED_COMMANDS = ('CONNECT', 'CONNECTED')
+HEADER_ESCAPE = re.compile(r'[\\\r\n:]')
+HEADER_ESCAPES = {'\\': '\\\\', '\r': '\\r', '\n': '\\n', ':': '\\c'}
+HEADER_UNESCAPE = re.compile(r'\\(.?)', re.DOTALL)
+HEADER_UNESCAPES = {'\\': '\\', 'r': '\r', 'n': '\n', 'c': ':'}
+
+
+def escape_header(text):
+    if HEADER_ESCAPE.search(text) is None:
+        return text
+    return HEADER_ESCAPE.sub(lambda m: HEADER_ESCAPES[m.group()], text)
+
+
+def _unescape(match):
+    try:
+        return HEADER_UNESCAPES[match.group(1)]
+    except KeyError:
+        raise ValueError('invalid STOMP header escape %r' % match.group())
+
+
+def unescape_header(text):
+    if '\\' not in text:
+        return text
+    return HEADER_UNESCAPE.sub(_unescape, text)
+
+
+def parse_header_lines(frame, lines):
+    '''
+    Parse STOMP header lines into `frame.headers`. Only the first colon
+    separates name and value, escapes are decoded for all frames except
+    CONNECT/CONNECTED, and when a header repeats the first value wins.
+    Malformed lines raise `ValueError`.
+    '''
+    headers = frame.headers
+    escaped = frame.command not in UNESCAPED_COMMANDS
+    for line in lines:
+        name, sep, value = line.partition(':')
+        if not sep:
+            raise ValueError('malformed STOMP header line %r' % line)
+        if escaped:
+            name = unescape_header(name)
+            value = unescape_header(value)
+        if name not in headers:
+            headers[name] = value
+
 
 class StompFrame:
     def __init__(self):
@@ -28,31 +83,182 @@ class StompFrame:
     def set_header(self, key, value):
         self.headers[key] = value
 
+    def header_items(self):
+        if self.command in UNESCAPED_COMMANDS:
+            return self.headers.items()
+        return ((escape_header(k), escape_header(v)) for k, v in self.headers.items())
+
     def write(self, out):
         logger.debug('write')
         out.write(self.command)
         out.write('\n')
-        for key in self.headers:
+        for key, value in self.header_items():
             out.write(key)
             out.write(':')
-            out.write(self.headers[key])
+            out.write(value)
             out.write('\n')
         out.write('\n')
         if self.content is not None:
             out.write(self.content)
         out.write('\0')
 
+    def encode(self):
+        '''
+        Serialize the frame to bytes with a single join. `str` content is
+        UTF-8 encoded; `bytes`-like content is copied into the frame as-is.
+        '''
+        logger.debug('encode')
+        parts = [self.command, '\n']
+        for key, value in self.header_items():
+            parts += (key, ':', value, '\n')
+        parts.append('\n')
+        content = self.content
+        if content is None:
+            content = b''
+        elif isinstance(content, str):
+            content = content.encode('utf-8')
+        return b''.join((''.join(parts).encode('utf-8'), content, b'\0'))
+
+    @staticmethod
+    def decode(data):
+        '''
+        Parse a frame from `bytes` or a `memoryview` without decoding the
+        body. The header block is located with a single scan; the body is
+        delimited by `content-length` when present, otherwise by the first
+        NUL. The content is returned as a `memoryview` into `data`.
+        '''
+        return StompFrame.decode_at(data)[0]
+
+    @staticmethod
+    def decode_at(data, start=0, partial=False):
+        '''
+        Parse the frame beginning at offset `start` of `data` and return
+        `(frame, end)`, where `end` is the offset just past the frame's NUL.
+        With `partial` set, `(None, start)` is returned when `data` does not
+        yet hold the complete frame, instead of treating whatever follows the
+        headers as the body.
+        '''
+        logger.debug('decode')
+        match = HEADER_END.search(data, start)
+        if match is None:
+            if partial:
+                return None, start
+            head_end = body_start = len(data)
+        else:
+            head_end, body_start = match.span()
+        frame = StompFrame()
+        lines = bytes(data[start:head_end]).decode('utf-8').split('\n')
+        frame.command = lines[0].rstrip('\r')
+        parse_header_lines(frame, [line.rstrip('\r') for line in lines[1:]])
+        view = memoryview(data)
+        content_length = frame.headers.get('content-length')
+        if content_length is not None:
+            if not content_length.isdigit():
+                raise ValueError('invalid STOMP content-length %r' % content_length)
+            body_end = body_start + int(content_length)
+            if body_end >= len(view):
+                if partial:
+                    return None, start
+                if body_end > len(view):
+                    raise ValueError('STOMP frame shorter than content-length')
+            elif view[body_end] != 0:
+                raise ValueError('STOMP frame body not terminated after content-length')
+        else:
+            match = NUL.search(data, body_start)
+            if match is not None:
+                body_end = match.start()
+            elif partial:
+                return None, start
+            else:
+                body_end = len(view)
+        frame.content = view[body_start:body_end]
+        return frame, body_end + 1
+
     @staticmethod
     def parse(input):
         logger.debug('parse')
         frame = StompFrame()
         frame.command = input.readline().rstrip('\r\n')
+        lines = []
         for line in input:
             line = line.rstrip('\r\n')
             if line == '':
                 break
-            (name, value) = line.split(':')
-            frame.headers[name] = value
+            lines.append(line)
+        parse_header_lines(frame, lines)
         frame.content = input.read()[:-1]
         logger.debug('parse frame content: %s', frame.content)
         return frame
+
+
+class StompProtocolError(ValueError):
+    '''
+    The peer broke the STOMP framing badly enough that the connection
+    should be dropped.
+    '''
+
+
+class StompFrameReader:
+    '''
+    Incremental STOMP frame splitter. Feed it WebSocket message payloads as
+    they arrive; partial frames are buffered across messages, heart-beat EOLs
+    between frames are skipped, and every complete frame is returned. A
+    malformed frame is logged and skipped up to its terminating NUL.
+
+    A partial frame is only parsed again once a message brings a NUL that
+    may end it, so a frame split across many messages costs time linear in
+    its size. If one grows past `max_frame_size` bytes it is dropped and
+    `StompProtocolError` raised.
+    '''
+
+    def __init__(self, max_frame_size=DEFAULT_MAX_FRAME_SIZE):
+        self.pending = bytearray()
+        self.max_frame_size = max_frame_size
+        self.errors = 0
+
+    def _check_pending(self):
+        if len(self.pending) > self.max_frame_size:
+            size = len(self.pending)
+            self.pending = bytearray()
+            raise StompProtocolError('STOMP frame exceeds %d bytes (%d buffered)' % (self.max_frame_size, size))
+
+    def feed(self, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        if self.pending:
+            self.pending += data
+            # the buffered frame can only end with a NUL from this message
+            if NUL.search(data) is None:
+                self._check_pending()
+                return []
+            data = self.pending
+        frames = []
+        pos = 0
+        end = len(data)
+        while pos < end:
+            if data[pos] in EOL_BYTES:
+                pos += 1
+                continue
+            try:
+                frame, next_pos = StompFrame.decode_at(data, pos, partial=True)
+            except ValueError as e:
+                self.errors += 1
+                logger.warning('discarding malformed STOMP frame: %s', e)
+                match = NUL.search(data, pos)
+                pos = match.end() if match is not None else end
+                continue
+            if frame is None:
+                break
+            frames.append(frame)
+            pos = next_pos
+        if data is self.pending:
+            # copy the frames out so the consumed part of the buffer can go
+            for frame in frames:
+                content = frame.content
+                frame.content = memoryview(content.tobytes())
+                content.release()
+            del self.pending[:pos]
+        else:
+            self.pending = bytearray(data[pos:])
+        self._check_pending()
+        return frames
@@ -0,0 +1,220 @@
+import datetime
+import json
+import logging
+import os
+import threading
+import time
+
+from .macs import normalize_mac
+from .sync import DEFAULT_SYNC_OVERLAP
+from .sync import format_timestamp
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_VERSION = 1
+
+# session states after which a session is dropped from the store
+ENDED_STATES = ('DISCONNECTED',)
+
+
+def session_time(session):
+    '''
+    The session's `timestamp` as an aware datetime, or None if it has none
+    that can be parsed.
+    '''
+    try:
+        when = datetime.datetime.fromisoformat(session['timestamp'])
+    except (KeyError, TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=datetime.timezone.utc)
+    return when
+
+
+def newest_session(sessions):
+    '''
+    The session with the latest `timestamp`; sessions without one count as
+    oldest.
+    '''
+    def key(session):
+        when = session_time(session)
+        return (when is not None, when or datetime.datetime.min)
+
+    return max(sessions, key=key)
+
+
+def session_ips(session):
+    ips = session.get('ipAddresses') or []
+    if isinstance(ips, str):
+        ips = [ips]
+    return ips
+
+
+class SessionStore:
+    '''
+    In-memory copy of the active ISE sessions, indexed by IP address, MAC
+    address (callingStationId), user name and NAS IP address. Intended to
+    be seeded once from getSessions and then kept current from sessionTopic
+    events with `update()`; a session that reaches an `ENDED_STATES` state
+    is removed, and an event older than the session stored for the same
+    MAC address is ignored. `save()` and `load()` write and read a JSON snapshot so a
+    restarted process can start warm. Safe to use from several threads.
+    '''
+
+    def __init__(self, path=None, clock=time.time):
+        self.path = path
+        self.clock = clock
+        self._sessions = {}
+        self._by_ip = {}
+        self._by_username = {}
+        self._by_nas_ip = {}
+        self._lock = threading.RLock()
+        self.updated_at = None
+        self.updates = 0
+        self.removals = 0
+        self.stale = 0
+
+    def __len__(self):
+        return len(self._sessions)
+
+    @staticmethod
+    def _add(index, value, key):
+        if value:
+            index.setdefault(value, set()).add(key)
+
+    @staticmethod
+    def _discard(index, value, key):
+        keys = index.get(value)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del index[value]
+
+    def _unindex(self, key, session):
+        for ip in session_ips(session):
+            self._discard(self._by_ip, ip, key)
+        self._discard(self._by_username, session.get('userName'), key)
+        self._discard(self._by_nas_ip, session.get('nasIpAddress'), key)
+
+    def _index(self, key, session):
+        for ip in session_ips(session):
+            self._add(self._by_ip, ip, key)
+        self._add(self._by_username, session.get('userName'), key)
+        self._add(self._by_nas_ip, session.get('nasIpAddress'), key)
+
+    def update(self, sessions):
+        '''
+        Insert or replace each session, keyed by its callingStationId, or
+        remove it if it has ended; events older than the stored session are
+        skipped.
+        '''
+        with self._lock:
+            for session in sessions:
+                mac = session.get('callingStationId')
+                if not mac:
+                    continue
+                key = normalize_mac(mac)
+                old = self._sessions.get(key)
+                if old is not None:
+                    old_time, new_time = session_time(old), session_time(session)
+                    if old_time is not None and new_time is not None and new_time < old_time:
+                        self.stale += 1
+                        continue
+                    del self._sessions[key]
+                    self._unindex(key, old)
+                if session.get('state') in ENDED_STATES:
+                    self.removals += 1
+                    continue
+                self._sessions[key] = session
+                self._index(key, session)
+                self.updates += 1
+            self.updated_at = self.clock()
+
+    def _lookup(self, index, value):
+        with self._lock:
+            return [self._sessions[key] for key in sorted(index.get(value, ()))]
+
+    def by_ip(self, ip):
+        return self._lookup(self._by_ip, ip)
+
+    def by_mac(self, mac):
+        with self._lock:
+            session = self._sessions.get(normalize_mac(mac))
+            return [session] if session is not None else []
+
+    def by_username(self, username):
+        return self._lookup(self._by_username, username)
+
+    def by_nas_ip(self, nas_ip):
+        return self._lookup(self._by_nas_ip, nas_ip)
+
+    def sessions(self):
+        with self._lock:
+            return list(self._sessions.values())
+
+    def clear(self):
+        with self._lock:
+            self._sessions.clear()
+            self._by_ip.clear()
+            self._by_username.clear()
+            self._by_nas_ip.clear()
+
+    def sync_from(self, overlap=DEFAULT_SYNC_OVERLAP):
+        '''
+        startTimestamp for a getSessions catching up with changes since the
+        store was last updated, or None if it never was.
+        '''
+        if self.updated_at is None:
+            return None
+        since = datetime.datetime.fromtimestamp(self.updated_at - overlap, datetime.timezone.utc)
+        return format_timestamp(since)
+
+    def save(self, path=None):
+        path = path or self.path
+        with self._lock:
+            snapshot = {
+                'version': SNAPSHOT_VERSION,
+                'updated_at': self.updated_at,
+                'sessions': list(self._sessions.values()),
+            }
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(snapshot, f, separators=(',', ':'))
+        os.replace(tmp_path, path)
+        logger.debug('saved %d sessions to %s', len(snapshot['sessions']), path)
+
+    def load(self, path=None):
+        '''
+        Replace the contents with a snapshot written by `save()`; returns
+        False if there is no usable snapshot.
+        '''
+        path = path or self.path
+        try:
+            with open(path, 'r') as f:
+                snapshot = json.load(f)
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError) as e:
+            logger.warning('ignoring unreadable session store %s: %s', path, e)
+            return False
+        if snapshot.get('version') != SNAPSHOT_VERSION:
+            logger.warning('ignoring session store %s with version %s', path, snapshot.get('version'))
+            return False
+        with self._lock:
+            self.clear()
+            self.update(snapshot['sessions'])
+            self.updated_at = snapshot['updated_at']
+        logger.debug('loaded %d sessions from %s', len(self._sessions), path)
+        return True
+
+    def stats(self):
+        with self._lock:
+            return {
+                'sessions': len(self._sessions),
+                'ips': len(self._by_ip),
+                'usernames': len(self._by_username),
+                'nas_ips': len(self._by_nas_ip),
+                'updates': self.updates,
+                'removals': self.removals,
+                'stale': self.stale,
+            }
@@ -0,0 +1,128 @@
+import codecs
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+WHITESPACE = ' \t\r\n'
+
+
+class JSONArrayStream:
+    '''
+    Incrementally parses a JSON document read from `readable` (anything
+    with a `read(size)` method returning bytes) and yields the elements of
+    its top-level arrays one at a time, so only one element has to be held
+    in memory at once. The document may be an array, yielding
+    `(None, element)`, or an object, yielding `(key, element)` for each
+    member whose value is an array, such as the `sessions` of a getSessions
+    response. Other members of a top-level object are collected in `fields`.
+    An empty body, as some queries answer with when there is nothing to
+    return, has no elements.
+    '''
+
+    def __init__(self, readable, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.readable = readable
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.utf8 = codecs.getincrementaldecoder('utf-8')()
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+        self.fields = {}
+        self.items = 0
+
+    def _fill(self):
+        if self.eof:
+            raise ValueError('truncated JSON document after %d array elements' % self.items)
+        data = self.readable.read(self.chunk_size)
+        if not data:
+            self.eof = True
+            self.buf = self.buf[self.pos:] + self.utf8.decode(b'', final=True)
+        else:
+            self.buf = self.buf[self.pos:] + self.utf8.decode(data)
+        self.pos = 0
+
+    def _peek(self):
+        '''
+        Return the next non-whitespace character without consuming it, or
+        '' at the end of the document.
+        '''
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if self.eof:
+                return ''
+            self._fill()
+
+    def _expect(self, chars):
+        c = self._peek()
+        if c == '' or c not in chars:
+            raise ValueError('expected %s at %r' % (' or '.join(repr(x) for x in chars), self.buf[self.pos:self.pos + 20]))
+        self.pos += 1
+        return c
+
+    def _value(self):
+        '''
+        Decode the value starting at the current position. A value running
+        to the end of the buffer is only accepted at the end of the
+        document, since a number such as `12` may continue as `123`.
+        '''
+        self._peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._fill()
+
+    def _array(self, key):
+        self._expect('[')
+        if self._peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            self.items += 1
+            yield key, self._value()
+            if self._expect(',]') == ']':
+                return
+
+    def __iter__(self):
+        c = self._peek()
+        if c == '':
+            return
+        if c == '[':
+            yield from self._array(None)
+        else:
+            self._expect('{')
+            if self._peek() != '}':
+                while True:
+                    key = self._value()
+                    if not isinstance(key, str):
+                        raise ValueError('expected an object key, not %r' % (key,))
+                    self._expect(':')
+                    if self._peek() == '[':
+                        yield from self._array(key)
+                    else:
+                        self.fields[key] = self._value()
+                    if self._expect(',}') == '}':
+                        break
+            else:
+                self.pos += 1
+        if self._peek() != '':
+            raise ValueError('extra data after JSON document')
+
+
+def iter_json_items(readable, chunk_size=DEFAULT_CHUNK_SIZE):
+    '''
+    Yield just the elements of the top-level arrays of the JSON document
+    read from `readable`; see `JSONArrayStream`.
+    '''
+    for key, item in JSONArrayStream(readable, chunk_size):
+        yield item
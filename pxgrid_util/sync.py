@@ -0,0 +1,141 @@
+import datetime
+import json
+import logging
+import sqlite3
+import time
+
+from .dedup import canonical_hash
+from .dedup import canonical_json
+
+logger = logging.getLogger(__name__)
+
+# the next sync asks for changes since this long before the previous one
+# started, to allow for clock skew between this host and ISE
+DEFAULT_SYNC_OVERLAP = 60.0
+
+# fields identifying a record returned by each query; records without them
+# are identified by a digest of their whole content
+KEY_FIELDS = {
+    'getSessions': ('callingStationId',),
+    'getBindings': ('ipPrefix', 'vpn'),
+    'getUserGroups': ('userName',),
+    'getHealths': ('nodeName', 'timestamp'),
+    'getPerformances': ('nodeName', 'timestamp'),
+}
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS watermarks (
+    service TEXT NOT NULL,
+    endpoint TEXT NOT NULL,
+    scope TEXT NOT NULL,
+    watermark TEXT NOT NULL,
+    synced_at REAL NOT NULL,
+    PRIMARY KEY (service, endpoint, scope)
+);
+CREATE TABLE IF NOT EXISTS records (
+    service TEXT NOT NULL,
+    endpoint TEXT NOT NULL,
+    scope TEXT NOT NULL,
+    key TEXT NOT NULL,
+    record TEXT NOT NULL,
+    PRIMARY KEY (service, endpoint, scope, key)
+);
+'''
+
+
+def format_timestamp(when):
+    '''
+    Format an aware datetime the way ISE expects startTimestamp, e.g.
+    2021-01-01T00:00:00.000+00:00.
+    '''
+    when = when.astimezone(datetime.timezone.utc)
+    return when.strftime('%Y-%m-%dT%H:%M:%S.') + '%03d+00:00' % (when.microsecond // 1000)
+
+
+def record_key(endpoint, record):
+    fields = KEY_FIELDS.get(endpoint)
+    if fields and isinstance(record, dict) and all(f in record for f in fields):
+        return '\0'.join(str(record[f]) for f in fields)
+    return canonical_hash(record if isinstance(record, dict) else {'value': record})[0].hex()
+
+
+class SyncState:
+    '''
+    SQLite file holding, per service, query endpoint and scope (such as the
+    filter in use), the startTimestamp to use for the next incremental
+    query and a snapshot of every record received so far, each replaced by
+    its most recent version.
+
+    A sync is a `begin()`, any number of `merge()` calls and a `commit()`;
+    the watermark only moves forward once the whole response has been
+    merged, so an interrupted sync is simply repeated.
+    '''
+
+    def __init__(self, path, overlap=DEFAULT_SYNC_OVERLAP, clock=time.time):
+        self.path = path
+        self.overlap = overlap
+        self.clock = clock
+        self.db = sqlite3.connect(path)
+        self.db.executescript(SCHEMA)
+        self._started = None
+        self.merged = 0
+
+    def watermark(self, service, endpoint, scope=''):
+        row = self.db.execute(
+            'SELECT watermark FROM watermarks WHERE service = ? AND endpoint = ? AND scope = ?',
+            (service, endpoint, scope)).fetchone()
+        return row[0] if row else None
+
+    def begin(self):
+        '''
+        Start a sync; returns the watermark the following sync will use.
+        '''
+        self._started = self.clock()
+        self.merged = 0
+        started = datetime.datetime.fromtimestamp(self._started - self.overlap, datetime.timezone.utc)
+        return format_timestamp(started)
+
+    def merge(self, service, endpoint, records, scope=''):
+        rows = []
+        for record in records:
+            rows.append((
+                service, endpoint, scope, record_key(endpoint, record),
+                canonical_json(record).decode('utf-8')))
+        self.db.executemany('INSERT OR REPLACE INTO records VALUES (?, ?, ?, ?, ?)', rows)
+        self.merged += len(rows)
+
+    def commit(self, service, endpoint, watermark, scope=''):
+        self.db.execute(
+            'INSERT OR REPLACE INTO watermarks VALUES (?, ?, ?, ?, ?)',
+            (service, endpoint, scope, watermark, self._started))
+        self.db.commit()
+        logger.info(
+            'synced %d records for %s/%s, next sync from %s',
+            self.merged, service, endpoint, watermark)
+
+    def rollback(self):
+        self.db.rollback()
+
+    def snapshot(self, service, endpoint, scope=''):
+        '''
+        Iterate over the merged records, in key order.
+        '''
+        cursor = self.db.execute(
+            'SELECT record FROM records WHERE service = ? AND endpoint = ? AND scope = ? ORDER BY key',
+            (service, endpoint, scope))
+        for (record,) in cursor:
+            yield json.loads(record)
+
+    def count(self, service, endpoint, scope=''):
+        return self.db.execute(
+            'SELECT COUNT(*) FROM records WHERE service = ? AND endpoint = ? AND scope = ?',
+            (service, endpoint, scope)).fetchone()[0]
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -1,11 +1,232 @@
+import asyncio
 import base64
+import collections
+import inspect
+import itertools
+import json
+import time
 import websockets
-from io import StringIO
+from websockets.exceptions import WebSocketException
+from .backoff import ExponentialBackoff
+from .ratelimit import TokenBucket
 from .stomp import StompFrame
+from .stomp import StompFrameReader
+from .stomp import StompProtocolError
+from .stomp import escape_header
 import logging
 
 logger = logging.getLogger(__name__)
 
+# publisher defaults: largest coalesced frame body, frames awaiting a
+# receipt before sending pauses, and seconds to wait for a receipt
+DEFAULT_MAX_FRAME_BYTES = 64 * 1024
+DEFAULT_RECEIPT_WINDOW = 100
+DEFAULT_RECEIPT_TIMEOUT = 30.0
+
+# marks the end of the payloads queued for a `Publisher`
+END_OF_PAYLOADS = None
+_NOTHING = object()
+
+# failures after which a supervised connection reconnects
+RECONNECT_ERRORS = (WebSocketException, OSError, asyncio.TimeoutError, StompProtocolError)
+
+# seconds a supervised connection must stay up, if the broker never sends
+# CONNECTED, before reconnect backoff starts again from its initial delay
+DEFAULT_STABLE_AFTER = 30.0
+
+
+def is_auth_failure(exc):
+    '''
+    True if a WebSocket handshake was rejected with 401 or 403.
+    '''
+    response = getattr(exc, 'response', None)
+    status = getattr(response, 'status_code', None) or getattr(exc, 'status_code', None)
+    return status in (401, 403)
+
+
+class Subscription:
+    '''
+    One STOMP subscription on a `WebSocketStomp` connection. MESSAGE bodies
+    routed to it are passed to `callback` if one was given (awaited if it is
+    a coroutine function), otherwise queued on `queue`.
+    '''
+
+    def __init__(self, id, topic, headers=None, callback=None):
+        self.id = id
+        self.topic = topic
+        self.headers = headers
+        self.callback = callback
+        self.queue = asyncio.Queue() if callback is None else None
+
+    async def deliver(self, body):
+        if self.callback is None:
+            self.queue.put_nowait(body)
+        else:
+            result = self.callback(body)
+            if inspect.isawaitable(result):
+                await result
+
+    async def messages(self):
+        '''
+        Async iterator over queued MESSAGE bodies; needs `dispatch()` running.
+        '''
+        while True:
+            yield await self.queue.get()
+
+
+class StompError(Exception):
+    '''
+    The broker sent a STOMP ERROR frame.
+    '''
+
+
+class Publisher:
+    '''
+    Publishes a stream of payloads to `topic` over a connected
+    `WebSocketStomp`. SEND frames are written back to back, paced only by
+    WebSocket flow control and, if `rate` is set, a limit of `rate`
+    payloads per second. Payloads may be `bytes`, `str` or anything
+    `json.dumps` accepts.
+
+    With `coalesce` above 1, up to that many payloads that are already
+    waiting are sent together in one frame whose body is a JSON array of
+    them, up to about `max_frame_bytes`. With `receipts`, every frame asks
+    for a STOMP receipt; at most `window` frames may be unconfirmed at once,
+    and `run()` only returns once every frame has been confirmed. A missing
+    receipt or an ERROR frame raises rather than being dropped silently.
+    '''
+
+    def __init__(self, stomp, topic, coalesce=1, max_frame_bytes=DEFAULT_MAX_FRAME_BYTES,
+                 rate=None, receipts=False, window=DEFAULT_RECEIPT_WINDOW,
+                 receipt_timeout=DEFAULT_RECEIPT_TIMEOUT, queue_size=1000, clock=time.monotonic):
+        self.stomp = stomp
+        self.topic = topic
+        self.coalesce = max(1, coalesce)
+        self.max_frame_bytes = max_frame_bytes
+        self.bucket = TokenBucket(rate, burst=max(1.0, (rate or 0) / 10.0))
+        self.receipts = receipts
+        self.window = max(1, window)
+        self.receipt_timeout = receipt_timeout
+        self.queue_size = queue_size
+        self.clock = clock
+        self.header = ('SEND\ndestination:%s\n' % escape_header(topic)).encode('utf-8')
+        self.unconfirmed = collections.deque()
+        self.source_error = None
+        self.messages = 0
+        self.frames = 0
+        self.bytes = 0
+        self.confirmed = 0
+        self.elapsed = 0.0
+
+    @staticmethod
+    def encode_payload(payload):
+        if isinstance(payload, bytes):
+            return payload
+        if isinstance(payload, str):
+            return payload.encode('utf-8')
+        return json.dumps(payload, separators=(',', ':')).encode('utf-8')
+
+    async def send_frame(self, bodies):
+        if self.coalesce > 1:
+            body = b'[' + b','.join(bodies) + b']'
+        else:
+            body = bodies[0]
+        parts = [self.header, b'content-length:%d\n' % len(body)]
+        if self.receipts:
+            while len(self.unconfirmed) >= self.window:
+                await self.confirm(*self.unconfirmed.popleft())
+            receipt = 'pub-%d' % self.frames
+            future = asyncio.get_running_loop().create_future()
+            self.stomp.receipts[receipt] = future
+            self.unconfirmed.append((receipt, future, len(bodies)))
+            parts.append(b'receipt:%s\n' % receipt.encode('ascii'))
+        parts += (b'\n', body, b'\0')
+        frame = b''.join(parts)
+        await self.stomp.ws.send(frame)
+        self.messages += len(bodies)
+        self.frames += 1
+        self.bytes += len(frame)
+
+    async def confirm(self, receipt, future, count):
+        try:
+            await asyncio.wait_for(future, self.receipt_timeout)
+        except asyncio.TimeoutError:
+            self.stomp.receipts.pop(receipt, None)
+            raise asyncio.TimeoutError('no STOMP receipt %s after %.1fs' % (receipt, self.receipt_timeout))
+        self.confirmed += count
+
+    async def feed(self, source, queue):
+        try:
+            async for payload in source:
+                await queue.put(payload)
+        except Exception as e:
+            self.source_error = e
+        await queue.put(END_OF_PAYLOADS)
+
+    async def run(self, source):
+        '''
+        Publish every payload from `source`, an async iterable or an
+        `asyncio.Queue` ended by putting `END_OF_PAYLOADS` (None) on it.
+        Returns `stats()`.
+        '''
+        if isinstance(source, asyncio.Queue):
+            queue = source
+            feeder = None
+        else:
+            queue = asyncio.Queue(maxsize=self.queue_size)
+            feeder = asyncio.create_task(self.feed(source, queue))
+        reader = None
+        if self.receipts and not self.stomp.dispatching:
+            reader = asyncio.create_task(self.stomp.dispatch())
+        start = self.clock()
+        try:
+            carry = _NOTHING
+            while True:
+                if carry is _NOTHING:
+                    payload = await queue.get()
+                    queue.task_done()
+                else:
+                    payload, carry = carry, _NOTHING
+                if payload is END_OF_PAYLOADS:
+                    break
+                await self.bucket.acquire()
+                bodies = [self.encode_payload(payload)]
+                size = len(bodies[0])
+                # coalesce only what is already waiting, never wait for more
+                while len(bodies) < self.coalesce and size < self.max_frame_bytes and not queue.empty():
+                    payload = queue.get_nowait()
+                    queue.task_done()
+                    if payload is END_OF_PAYLOADS or not self.bucket.try_acquire():
+                        carry = payload
+                        break
+                    body = self.encode_payload(payload)
+                    bodies.append(body)
+                    size += len(body)
+                await self.send_frame(bodies)
+            while self.unconfirmed:
+                await self.confirm(*self.unconfirmed.popleft())
+            if self.source_error is not None:
+                raise self.source_error
+        finally:
+            self.elapsed = self.clock() - start
+            for task in (feeder, reader):
+                if task is not None:
+                    task.cancel()
+            await asyncio.gather(*(t for t in (feeder, reader) if t is not None), return_exceptions=True)
+        return self.stats()
+
+    def stats(self):
+        return {
+            'messages': self.messages,
+            'frames': self.frames,
+            'bytes': self.bytes,
+            'confirmed': self.confirmed,
+            'elapsed': self.elapsed,
+            'messages_per_second': self.messages / self.elapsed if self.elapsed else 0.0,
+            'bytes_per_second': self.bytes / self.elapsed if self.elapsed else 0.0,
+        }
+
+
 class WebSocketStomp:
     def __init__(self, ws_url, user, password, ssl_ctx, ping_interval=20.0):
         self.ws_url = ws_url
@@ -14,6 +235,16 @@ class WebSocketStomp:
         self.ssl_ctx = ssl_ctx
         self.ping_interval = ping_interval
         self.ws = None
+        self.reader = StompFrameReader()
+        self.pending = collections.deque()
+        self.subscriptions = {}
+        self.subscription_ids = itertools.count()
+        self.receipts = {}
+        self.dispatching = False
+        self.stomp_connected = False
+        self.reconnect_count = 0
+        self.last_reconnect_latency = None
+        self.total_reconnect_latency = 0.0
 
     async def connect(self):
         logger.debug('WebSocket Connect, ws_url=%s', self.ws_url)
@@ -32,55 +263,239 @@ class WebSocketStomp:
         frame.set_command("CONNECT")
         frame.set_header('accept-version', '1.2')
         frame.set_header('host', hostname)
-        out = StringIO()
-        frame.write(out)
-        await self.ws.send(out.getvalue().encode('utf-8'))
+        await self.ws.send(frame.encode())
         logger.debug('stomp_connect completed')
 
-    async def stomp_subscribe(self, topic, headers=None):
-        logger.debug('STOMP SUBSCRIBE topic=%s', topic)
+    async def stomp_subscribe(self, topic, headers=None, callback=None):
+        '''
+        Subscribe to `topic` and return the new `Subscription`. Each call
+        gets a unique subscription id, so many topics can share one
+        connection; `dispatch()` routes MESSAGE frames by that id. Before
+        the first connect the subscription is only recorded, and is sent by
+        `run_supervised()` once connected.
+        '''
+        subscription = Subscription(
+            'sub-%d' % next(self.subscription_ids), topic, headers, callback)
+        logger.debug('STOMP SUBSCRIBE topic=%s id=%s', topic, subscription.id)
+        self.subscriptions[subscription.id] = subscription
+        if self.ws is not None:
+            await self.send_subscribe(subscription)
+        logger.debug('stomp_subscribe completed')
+        return subscription
+
+    async def send_subscribe(self, subscription):
         frame = StompFrame()
         frame.set_command("SUBSCRIBE")
-        frame.set_header('destination', topic)
-        frame.set_header('id', 'my-id')
-        if headers:
-            for key, value in headers.items():
+        frame.set_header('destination', subscription.topic)
+        frame.set_header('id', subscription.id)
+        if subscription.headers:
+            for key, value in subscription.headers.items():
                 frame.set_header(key, value)
-        out = StringIO()
-        frame.write(out)
-        await self.ws.send(out.getvalue().encode('utf-8'))
-        logger.debug('stomp_subscribe completed')
+        await self.ws.send(frame.encode())
+
+    async def stomp_unsubscribe(self, subscription):
+        logger.debug('STOMP UNSUBSCRIBE id=%s', subscription.id)
+        self.subscriptions.pop(subscription.id, None)
+        frame = StompFrame()
+        frame.set_command("UNSUBSCRIBE")
+        frame.set_header('id', subscription.id)
+        await self.ws.send(frame.encode())
 
     async def stomp_send(self, topic, message):
         logger.debug('STOMP SEND topic=' + topic)
         frame = StompFrame()
         frame.set_command("SEND")
+        if isinstance(message, str):
+            message = message.encode('utf-8')
         frame.set_header('destination', topic)
         frame.set_header('content-length', str(len(message)))
         frame.set_content(message)
-        out = StringIO()
-        frame.write(out)
-        await self.ws.send(out.getvalue().encode('utf-8'))
+        await self.ws.send(frame.encode())
         logger.debug('stomp_send completed')
 
+    async def publish(self, topic, source, **kwargs):
+        '''
+        Publish every payload from `source` (an async iterable or an
+        `asyncio.Queue`) to `topic` and return the throughput achieved;
+        keyword arguments are passed to `Publisher`.
+        '''
+        return await Publisher(self, topic, **kwargs).run(source)
+
+    async def read_frame(self):
+        '''
+        Return the next STOMP frame, reading another WebSocket message only
+        when every frame from the previous one has been consumed.
+        '''
+        while not self.pending:
+            message = await self.ws.recv()
+            self.pending.extend(self.reader.feed(message))
+        return self.pending.popleft()
+
+    async def frames(self):
+        '''
+        Async iterator over every STOMP frame received, however the broker
+        batches them into WebSocket messages.
+        '''
+        while True:
+            while self.pending:
+                yield self.pending.popleft()
+            message = await self.ws.recv()
+            self.pending.extend(self.reader.feed(message))
+
+    def handle_control_frame(self, stomp):
+        '''
+        Log a frame other than MESSAGE, completing the future waiting for a
+        RECEIPT and failing every one still waiting after an ERROR.
+        '''
+        if stomp.get_command() == 'CONNECTED':
+            self.stomp_connected = True
+            version = stomp.get_header('version')
+            logger.debug('STOMP CONNECTED version=' + version)
+        elif stomp.get_command() == 'RECEIPT':
+            receipt = stomp.get_header('receipt-id')
+            logger.debug('STOMP RECEIPT id=' + receipt)
+            future = self.receipts.pop(receipt, None)
+            if future is not None and not future.done():
+                future.set_result(None)
+        elif stomp.get_command() == 'ERROR':
+            content = bytes(stomp.get_content() or b'')
+            logger.debug('STOMP ERROR content=%s', content)
+            error = StompError(stomp.headers.get('message') or content.decode('utf-8', 'replace'))
+            for future in self.receipts.values():
+                if not future.done():
+                    future.set_exception(error)
+            self.receipts.clear()
+
+    async def messages(self):
+        '''
+        Async iterator over the bodies (as `bytes`) of MESSAGE frames.
+        '''
+        async for stomp in self.frames():
+            if stomp.get_command() == 'MESSAGE':
+                yield bytes(stomp.get_content())
+            else:
+                self.handle_control_frame(stomp)
+
+    async def dispatch(self):
+        '''
+        Read frames until the connection closes, routing each MESSAGE to the
+        subscription named by its `subscription` header.
+        '''
+        self.dispatching = True
+        try:
+            async for stomp in self.frames():
+                if stomp.get_command() != 'MESSAGE':
+                    self.handle_control_frame(stomp)
+                    continue
+                subscription = self.subscriptions.get(stomp.headers.get('subscription'))
+                if subscription is None:
+                    logger.debug(
+                        'STOMP MESSAGE for unknown subscription %s dropped',
+                        stomp.headers.get('subscription'))
+                    continue
+                await subscription.deliver(bytes(stomp.get_content()))
+        finally:
+            self.dispatching = False
+
+    async def close_ws(self):
+        '''
+        Close the current WebSocket, ignoring errors from one that has
+        already failed.
+        '''
+        if self.ws is None:
+            return
+        try:
+            await self.ws.close()
+        except RECONNECT_ERRORS as e:
+            logger.debug('closing %s failed: %s', self.ws_url, e)
+
+    async def run_supervised(self, hostname, nodes=None, secret_provider=None, backoff=None,
+                             stable_after=DEFAULT_STABLE_AFTER):
+        '''
+        Connect and `dispatch()` until cancelled, reconnecting with jittered
+        exponential backoff whenever the connection fails or drops. The
+        backoff only starts again from its initial delay once the broker has
+        sent CONNECTED or the connection has stayed up for `stable_after`
+        seconds, so a broker that drops every connection at once is not
+        hammered. Every subscription made with `stomp_subscribe()` is
+        restored on reconnect.
+
+        `nodes` is an optional list of `(ws_url, node_name)` pubsub nodes to
+        fail over to when a node cannot be reached. `secret_provider` is an
+        async callable taking a node name and returning a fresh access
+        secret; it is called when the handshake is rejected with 401/403 and
+        when failing over to another node.
+        '''
+        candidates = [(self.ws_url, hostname)]
+        candidates += [n for n in nodes or [] if n[0] != self.ws_url]
+        backoff = backoff or ExponentialBackoff()
+        index = 0
+        refresh_secret = False
+        dropped_at = None
+        while True:
+            ws_url, node_name = candidates[index]
+            try:
+                if refresh_secret and secret_provider is not None:
+                    self.password = await secret_provider(node_name)
+                self.ws_url = ws_url
+                self.stomp_connected = False
+                await self.connect()
+                await self.stomp_connect(node_name)
+                for subscription in self.subscriptions.values():
+                    await self.send_subscribe(subscription)
+            except RECONNECT_ERRORS as e:
+                await self.close_ws()
+                refresh_secret = is_auth_failure(e)
+                if not refresh_secret and len(candidates) > 1:
+                    index = (index + 1) % len(candidates)
+                    refresh_secret = True
+                delay = backoff.next_delay()
+                logger.warning(
+                    'connect to %s failed (%s), retrying %s in %.1fs',
+                    ws_url, e, candidates[index][0], delay)
+                await asyncio.sleep(delay)
+                continue
+
+            connected_at = time.monotonic()
+            refresh_secret = False
+            if dropped_at is not None:
+                self.reconnect_count += 1
+                # time from losing the connection to having it back
+                self.last_reconnect_latency = time.monotonic() - dropped_at
+                self.total_reconnect_latency += self.last_reconnect_latency
+                logger.info(
+                    'reconnected to %s after %.1fs (reconnect %d)',
+                    ws_url, self.last_reconnect_latency, self.reconnect_count)
+            try:
+                await self.dispatch()
+            except RECONNECT_ERRORS as e:
+                logger.warning('connection to %s lost (%s)', ws_url, e)
+            dropped_at = time.monotonic()
+            await self.close_ws()
+            self.reader = StompFrameReader()
+            self.pending.clear()
+            if self.stomp_connected or dropped_at - connected_at >= stable_after:
+                backoff.reset()
+            delay = backoff.next_delay()
+            logger.info('reconnecting to %s in %.1fs', ws_url, delay)
+            await asyncio.sleep(delay)
+
+    def reconnect_stats(self):
+        return {
+            'reconnects': self.reconnect_count,
+            'last_latency': self.last_reconnect_latency,
+            'mean_latency': (
+                self.total_reconnect_latency / self.reconnect_count
+                if self.reconnect_count else None),
+        }
+
     # only returns for MESSAGE
     async def stomp_read_message(self):
         while True:
-            message = await self.ws.recv()
-            s_in = StringIO(message.decode('utf-8'))
-            stomp = StompFrame.parse(s_in)
+            stomp = await self.read_frame()
             if stomp.get_command() == 'MESSAGE':
-                return stomp.get_content()
-            elif stomp.get_command() == 'CONNECTED':
-                version = stomp.get_header('version')
-                logger.debug('STOMP CONNECTED version=' + version)
-            elif stomp.get_command() == 'RECEIPT':
-                receipt = stomp.get_header('receipt-id')
-                logger.debug('STOMP RECEIPT id=' + receipt)
-            elif stomp.get_command() == 'ERROR':
-                logger.debug('STOMP ERROR content=' + stomp.get_content())
-                pass
-        logger.debug('stomp_read_message completed')
+                return bytes(stomp.get_content())
+            self.handle_control_frame(stomp)
 
     async def stomp_disconnect(self, receipt=None):
         logger.debug('STOMP DISCONNECT receipt=' + receipt)
@@ -88,9 +503,7 @@ class WebSocketStomp:
         frame.set_command("DISCONNECT")
         if receipt is not None:
             frame.set_header('receipt', receipt)
-        out = StringIO()
-        frame.write(out)
-        await self.ws.send(out.getvalue().encode('utf-8'))
+        await self.ws.send(frame.encode())
 
     async def disconnect(self):
         await self.ws.close()
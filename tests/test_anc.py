@@ -0,0 +1,272 @@
+import asyncio
+import json
+import os
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+from aiohttp import web
+
+from pxgrid_util.anc import AncBatchReader
+from pxgrid_util.anc import AncJob
+from pxgrid_util.anc import BulkAncEngine
+from pxgrid_util.ratelimit import TokenBucket
+
+
+class FakeAncServer:
+    '''
+    ANC service that throttles the first request for each MAC in
+    `throttle`, and rejects MACs in `reject`.
+    '''
+
+    def __init__(self, throttle=(), reject=()):
+        self.throttle = set(throttle)
+        self.reject = set(reject)
+        self.requests = []
+        self.active = 0
+        self.max_active = 0
+
+    async def handle(self, request):
+        payload = json.loads(await request.read())
+        self.requests.append((request.match_info['operation'], payload))
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            await asyncio.sleep(0.001)
+            mac = payload.get('macAddress')
+            if mac in self.throttle:
+                self.throttle.discard(mac)
+                return web.Response(status=429, headers={'Retry-After': '0'})
+            if mac in self.reject:
+                return web.Response(status=400)
+            return web.json_response({'status': 'SUCCESS'})
+        finally:
+            self.active -= 1
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post('/anc/{operation}', self.handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        return 'http://127.0.0.1:%d/anc' % port
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+
+def make_config():
+    return SimpleNamespace(node_name='client', ssl_context=None, timeout=5.0)
+
+
+def mac_jobs(count):
+    return [AncJob('applyEndpointByMacAddress', '00:00:00:00:%02x:%02x' % divmod(i, 256), 'Quarantine')
+            for i in range(count)]
+
+
+class TestBulkAncEngine(unittest.TestCase):
+    def test_retries_and_result_log_resume(self):
+        async def run_test(log_path):
+            jobs = mac_jobs(30)
+            server = FakeAncServer(throttle=[jobs[3].key], reject=[jobs[5].key])
+            base_url = await server.start()
+            try:
+                async with BulkAncEngine(make_config(), 'secret', base_url, concurrency=4,
+                                         result_log=log_path, backoff_initial=0.001) as engine:
+                    stats = await engine.run(jobs)
+                self.assertEqual(stats['succeeded'], 29)
+                self.assertEqual(stats['failed'], 1)
+                self.assertEqual(stats['retried'], 1)
+                self.assertEqual(stats['requests'], 31)
+                self.assertLessEqual(server.max_active, 4)
+                self.assertEqual(
+                    server.requests[0],
+                    ('applyEndpointByMacAddress', {'macAddress': jobs[0].key, 'policyName': 'Quarantine'}))
+
+                # a resumed run only repeats the failure
+                server.requests.clear()
+                async with BulkAncEngine(make_config(), 'secret', base_url, result_log=log_path,
+                                         resume=True) as engine:
+                    stats = await engine.run(iter(jobs))
+                self.assertEqual(stats['skipped'], 29)
+                self.assertEqual([p['macAddress'] for _, p in server.requests], [jobs[5].key])
+            finally:
+                await server.stop()
+
+        with tempfile.TemporaryDirectory() as d:
+            log_path = os.path.join(d, 'results.ndjson')
+            asyncio.run(run_test(log_path))
+            with open(log_path) as f:
+                results = [json.loads(line) for line in f]
+            self.assertEqual(len(results), 31)
+            self.assertEqual(sum(1 for r in results if not r['ok']), 2)
+
+    def test_connection_errors_are_retried_then_reported(self):
+        async def run_test():
+            async with BulkAncEngine(make_config(), 'secret', 'http://127.0.0.1:9/anc',
+                                     retries=2, backoff_initial=0.001) as engine:
+                result = await engine.execute(mac_jobs(1)[0])
+            self.assertFalse(result['ok'])
+            self.assertIsNone(result['status'])
+            self.assertEqual(result['attempts'], 3)
+            self.assertIn('error', result)
+
+        asyncio.run(run_test())
+
+    def test_same_endpoint_runs_in_order(self):
+        async def run_test():
+            mac = '00:00:00:00:99:99'
+            jobs = []
+            for i, job in enumerate(mac_jobs(20)):
+                jobs.append(job)
+                if i % 5 == 0:
+                    operation = 'clearEndpointByMacAddress' if i % 10 == 0 else 'applyEndpointByMacAddress'
+                    jobs.append(AncJob(operation, mac, 'Quarantine', seq=i))
+            server = FakeAncServer()
+            base_url = await server.start()
+            try:
+                async with BulkAncEngine(make_config(), 'secret', base_url, concurrency=8) as engine:
+                    stats = await engine.run(jobs)
+            finally:
+                await server.stop()
+            self.assertEqual(stats['succeeded'], 24)
+            self.assertGreater(server.max_active, 1)
+            self.assertEqual(
+                [op for op, p in server.requests if p['macAddress'] == mac],
+                [job.operation for job in jobs if job.key == mac])
+
+        asyncio.run(run_test())
+
+    def test_resume_reruns_later_jobs_for_an_endpoint(self):
+        async def run_test(log_path):
+            mac, other = '00:00:00:00:99:99', '00:00:00:00:88:88'
+            jobs = [
+                AncJob('applyEndpointByMacAddress', mac, 'Quarantine', seq=1),
+                AncJob('clearEndpointByMacAddress', mac, 'Quarantine', seq=2),
+                AncJob('applyEndpointByMacAddress', other, 'Quarantine', seq=3),
+            ]
+            with open(log_path, 'w') as f:
+                for job, ok in zip(jobs, (False, True, True)):
+                    f.write(json.dumps({'operation': job.operation, 'key': job.key, 'seq': job.seq, 'ok': ok}) + '\n')
+            server = FakeAncServer()
+            base_url = await server.start()
+            try:
+                async with BulkAncEngine(make_config(), 'secret', base_url, result_log=log_path,
+                                         resume=True) as engine:
+                    stats = await engine.run(jobs)
+            finally:
+                await server.stop()
+            # the clear that succeeded is repeated after the apply, keeping file order
+            self.assertEqual(
+                [(op, p['macAddress']) for op, p in server.requests],
+                [('applyEndpointByMacAddress', mac), ('clearEndpointByMacAddress', mac)])
+            self.assertEqual(stats['skipped'], 1)
+
+        with tempfile.TemporaryDirectory() as d:
+            asyncio.run(run_test(os.path.join(d, 'results.ndjson')))
+
+    def test_unexpected_error_does_not_stop_endpoint(self):
+        class BrokenEngine(BulkAncEngine):
+            async def execute(self, job):
+                if job.seq == 0:
+                    raise RuntimeError('boom')
+                return await super().execute(job)
+
+        async def run_test():
+            mac = '00:00:00:00:99:99'
+            jobs = [AncJob('applyEndpointByMacAddress', mac, 'Quarantine', seq=i) for i in range(3)]
+            server = FakeAncServer()
+            base_url = await server.start()
+            try:
+                async with BrokenEngine(make_config(), 'secret', base_url) as engine:
+                    stats = await asyncio.wait_for(engine.run(jobs), 5.0)
+            finally:
+                await server.stop()
+            self.assertEqual((stats['failed'], stats['succeeded']), (1, 2))
+            self.assertEqual(len(server.requests), 2)
+
+        asyncio.run(run_test())
+
+
+class TestAncBatchReader(unittest.TestCase):
+    def read(self, content, **kwargs):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, 'batch')
+            with open(path, 'w') as f:
+                f.write(content)
+            reader = AncBatchReader(path, **kwargs)
+            return [(job.operation, job.key, job.policy, job.seq) for job in reader], reader.stats()
+
+    def test_csv(self):
+        jobs, stats = self.read(
+            'operation,key,policy\n'
+            'apply,00:00:00:00:00:01,Quarantine\n'
+            'clear,10.0.0.1\n'
+            'apply,00:00:00:00:00:01,Quarantine\n'
+            'clearEndpointByMacAddress,00:00:00:00:00:01\n'
+            'apply,10.0.0.2\n'
+            'explode,10.0.0.3\n')
+        self.assertEqual(jobs, [
+            ('applyEndpointByMacAddress', '00:00:00:00:00:01', 'Quarantine', 1),
+            ('clearEndpointByIpAddress', '10.0.0.1', None, 2),
+            ('clearEndpointByMacAddress', '00:00:00:00:00:01', None, 4),
+        ])
+        self.assertEqual(stats, {'rows': 6, 'jobs': 3, 'duplicates': 1, 'invalid': 2})
+
+    def test_ndjson_with_default_policy(self):
+        jobs, stats = self.read(
+            '{"operation": "applyEndpointByIpAddress", "key": "10.0.0.1"}\n'
+            '\n'
+            '{"operation": "apply", "key": "10.0.0.1", "policy": "Other"}\n',
+            default_policy='Quarantine')
+        self.assertEqual(jobs, [
+            ('applyEndpointByIpAddress', '10.0.0.1', 'Quarantine', 1),
+            ('applyEndpointByIpAddress', '10.0.0.1', 'Other', 2),
+        ])
+        self.assertEqual(stats['duplicates'], 0)
+
+
+    def test_ndjson_bad_line_skipped(self):
+        jobs, stats = self.read(
+            '{"operation": "clear", "key": "10.0.0.1"}\n'
+            '{"operation": "clear", "key": \n'
+            '["clear", "10.0.0.2"]\n'
+            '{"operation": "clear", "key": "10.0.0.3"}\n')
+        self.assertEqual([key for _, key, _, _ in jobs], ['10.0.0.1', '10.0.0.3'])
+        self.assertEqual(stats, {'rows': 4, 'jobs': 2, 'duplicates': 0, 'invalid': 2})
+
+
+class TestAncJob(unittest.TestCase):
+    def test_payloads(self):
+        self.assertEqual(
+            AncJob('clearEndpointByIpAddress', '10.0.0.1', 'ignored').payload(),
+            {'ipAddress': '10.0.0.1'})
+        with self.assertRaises(ValueError):
+            AncJob('applyEndpointByMacAddress', '00:00:00:00:00:01')
+        with self.assertRaises(ValueError):
+            AncJob('deleteEverything', 'x')
+
+
+class TestTokenBucket(unittest.TestCase):
+    def test_rate_limited(self):
+        async def run_test():
+            now = [0.0]
+            slept = []
+
+            async def fake_sleep(delay):
+                slept.append(delay)
+                now[0] += delay
+
+            bucket = TokenBucket(10.0, burst=1, clock=lambda: now[0], sleep=fake_sleep)
+            for _ in range(3):
+                await bucket.acquire()
+            self.assertEqual(len(slept), 2)
+            self.assertAlmostEqual(now[0], 0.2)
+
+        asyncio.run(run_test())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,188 @@
+import io
+import json
+import os
+import tempfile
+import threading
+import unittest
+import urllib.error
+from types import SimpleNamespace
+
+from pxgrid_util import open_query
+from pxgrid_util import service_nodes
+from pxgrid_util.cache import DiscoveryCache
+from pxgrid_util.cache import TTLCache
+from pxgrid_util.pxgrid import PXGridControl
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class CountingPool:
+    def __init__(self, responses):
+        self.responses = responses
+        self.calls = []
+
+    def request(self, method, url, body=None, headers=None, timeout=None):
+        name = url.rsplit('/', 1)[-1]
+        self.calls.append(name)
+        response = self.responses[name]
+        if isinstance(response, int):
+            raise urllib.error.HTTPError(url, response, 'error', {}, io.BytesIO(b''))
+        return json.dumps(response).encode()
+
+
+def make_config():
+    return SimpleNamespace(
+        hostname=['ise.example'],
+        port=8910,
+        hedge_after=None,
+        node_name='client',
+        password='secret',
+        description=None,
+        timeout=5.0,
+        ssl_context=None,
+        discovery_ttl=0,
+        discovery_cache=None)
+
+
+class TestTTLCache(unittest.TestCase):
+    def test_entries_expire(self):
+        clock = FakeClock()
+        cache = TTLCache(ttl=10.0, clock=clock)
+        cache.put('a', 1)
+        self.assertEqual(cache.get('a'), 1)
+        clock.now += 11.0
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.stats()['expirations'], 1)
+
+    def test_least_recently_used_evicted(self):
+        cache = TTLCache(maxsize=2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.get('a')
+        cache.put('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+
+class TestDiscoveryCache(unittest.TestCase):
+    def test_snapshot_round_trip(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'discovery.json')
+            cache = DiscoveryCache(path=path)
+            cache.put_service('com.cisco.ise.session', {'services': [{'nodeName': 'ise-1'}]})
+            cache.put_secret('ise-1', {'secret': 'abc'})
+            self.assertEqual(os.stat(path).st_mode & 0o777, 0o600)
+
+            restored = DiscoveryCache(path=path)
+            self.assertEqual(restored.get_secret('ise-1'), {'secret': 'abc'})
+            self.assertEqual(
+                restored.get_service('com.cisco.ise.session'),
+                {'services': [{'nodeName': 'ise-1'}]})
+
+    def test_snapshot_of_another_client_ignored(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'discovery.json')
+            owner = {'node_name': 'client-a', 'hostnames': ['ise.example']}
+            cache = DiscoveryCache(path=path, owner=owner)
+            cache.put_account({'accountState': 'ENABLED'})
+            cache.put_secret('ise-1', {'secret': 'abc'})
+
+            self.assertEqual(DiscoveryCache(path=path, owner=dict(owner)).get_secret('ise-1'), {'secret': 'abc'})
+            other = DiscoveryCache(path=path, owner={'node_name': 'client-b', 'hostnames': ['ise.example']})
+            self.assertIsNone(other.get_secret('ise-1'))
+            self.assertIsNone(other.get_account())
+            elsewhere = DiscoveryCache(path=path, owner={'node_name': 'client-a', 'hostnames': ['ise-2.example']})
+            self.assertIsNone(elsewhere.get_secret('ise-1'))
+
+    def test_concurrent_saves(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'discovery.json')
+            cache = DiscoveryCache(path=path)
+
+            def put_secrets(thread):
+                for i in range(20):
+                    cache.put_secret('ise-%d-%d' % (thread, i), {'secret': 'x' * (thread * 100 + i)})
+
+            threads = [threading.Thread(target=put_secrets, args=(n,)) for n in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            restored = DiscoveryCache(path=path)
+            for n in range(8):
+                for i in range(20):
+                    self.assertEqual(restored.get_secret('ise-%d-%d' % (n, i)), {'secret': 'x' * (n * 100 + i)})
+
+    def test_control_uses_cache(self):
+        pool = CountingPool({
+            'AccountActivate': {'accountState': 'ENABLED'},
+            'ServiceLookup': {'services': [{'nodeName': 'ise-1'}]},
+            'AccessSecret': {'secret': 'abc'},
+        })
+        pxgrid = PXGridControl(make_config(), pool=pool, cache=DiscoveryCache())
+        for _ in range(2):
+            pxgrid.account_activate()
+            pxgrid.service_lookup('com.cisco.ise.session')
+            pxgrid.get_access_secret('ise-1')
+        self.assertEqual(pool.calls, ['AccountActivate', 'ServiceLookup', 'AccessSecret'])
+
+    def test_empty_lookup_not_cached(self):
+        pool = CountingPool({'ServiceLookup': {'services': []}})
+        pxgrid = PXGridControl(make_config(), pool=pool, cache=DiscoveryCache())
+        pxgrid.service_lookup('com.example.custom')
+        pxgrid.service_lookup('com.example.custom')
+        self.assertEqual(len(pool.calls), 2)
+
+    def test_invalidate_on_error(self):
+        cache = DiscoveryCache()
+        cache.put_service('com.cisco.ise.session', {'services': [{'nodeName': 'ise-1'}]})
+        cache.put_secret('ise-1', {'secret': 'abc'})
+        pxgrid = PXGridControl(make_config(), pool=CountingPool({}), cache=cache)
+        with self.assertRaises(urllib.error.HTTPError):
+            with pxgrid.invalidate_on_error(service_name='com.cisco.ise.session', peer_node_name='ise-1'):
+                raise urllib.error.HTTPError('https://x', 401, 'Unauthorized', {}, None)
+        self.assertIsNone(cache.get_service('com.cisco.ise.session'))
+        self.assertIsNone(cache.get_secret('ise-1'))
+
+    def test_control_401_clears_cache(self):
+        cache = DiscoveryCache()
+        cache.put_secret('ise-1', {'secret': 'abc'})
+        pxgrid = PXGridControl(make_config(), pool=CountingPool({'ServiceLookup': 401}), cache=cache)
+        with self.assertRaises(urllib.error.HTTPError):
+            pxgrid.service_lookup('com.cisco.ise.session')
+        self.assertIsNone(cache.get_secret('ise-1'))
+
+
+    def test_query_error_invalidates_answering_node(self):
+        class FailingPool:
+            def urlopen(self, method, url, body=None, headers=None, timeout=None):
+                code = 503 if '//cache-a.' in url else 401
+                raise urllib.error.HTTPError(url, code, 'error', {}, io.BytesIO(b''))
+
+        cache = DiscoveryCache()
+        cache.put_secret('ise-a', {'secret': 'a'})
+        cache.put_secret('ise-b', {'secret': 'b'})
+        pxgrid = PXGridControl(make_config(), pool=CountingPool({}), cache=cache)
+        lookup = {'services': [
+            {'nodeName': 'ise-a', 'properties': {'restBaseUrl': 'https://cache-a.example/session'}},
+            {'nodeName': 'ise-b', 'properties': {'restBaseUrl': 'https://cache-b.example/session'}},
+        ]}
+        config = SimpleNamespace(**vars(make_config()), discovery_override=None, compress_requests=None)
+        nodes = service_nodes(pxgrid, config, lookup, '/getSessions', secrets={'ise-a': 'a'})
+        with self.assertRaises(urllib.error.HTTPError):
+            open_query(config, 'a', nodes[0][0], '{}', pool=FailingPool(), nodes=nodes)
+        # ise-a failed over to ise-b, which rejected its secret
+        self.assertEqual(cache.get_secret('ise-a'), {'secret': 'a'})
+        self.assertIsNone(cache.get_secret('ise-b'))
+
+
+if __name__ == '__main__':
+    unittest.main()
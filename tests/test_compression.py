@@ -0,0 +1,52 @@
+import gzip
+import io
+import json
+import unittest
+import zlib
+
+from pxgrid_util.compression import DecodingReader
+from pxgrid_util.compression import compress_body
+from pxgrid_util.compression import content_decoder
+from pxgrid_util.streaming import JSONArrayStream
+
+DOCUMENT = json.dumps({'sessions': [{'mac': '00:11:22:33:44:%02X' % i, 'state': 'STARTED'} for i in range(500)]})
+
+
+def raw_deflate(data):
+    compressor = zlib.compressobj(wbits=-15)
+    return compressor.compress(data) + compressor.flush()
+
+
+class TestDecodingReader(unittest.TestCase):
+    def test_encodings(self):
+        data = DOCUMENT.encode()
+        for encoding, encoded in (
+                ('gzip', gzip.compress(data)),
+                ('deflate', zlib.compress(data)),
+                ('deflate', raw_deflate(data))):
+            reader = DecodingReader(io.BytesIO(encoded), encoding, chunk_size=100)
+            self.assertEqual(reader.read(), data, encoding)
+            self.assertEqual(reader.raw_bytes, len(encoded))
+
+    def test_small_reads_stream_into_parser(self):
+        reader = DecodingReader(io.BytesIO(gzip.compress(DOCUMENT.encode())), 'gzip', chunk_size=64)
+        items = [item for key, item in JSONArrayStream(reader, chunk_size=50)]
+        self.assertEqual(items, json.loads(DOCUMENT)['sessions'])
+
+    def test_unknown_encoding(self):
+        self.assertIsNone(content_decoder('identity'))
+        with self.assertRaises(ValueError):
+            content_decoder('compress')
+
+
+class TestCompressBody(unittest.TestCase):
+    def test_only_large_bodies_compressed(self):
+        self.assertEqual(compress_body(b'{}', min_bytes=1024), (b'{}', None))
+        body, encoding = compress_body(DOCUMENT.encode(), min_bytes=1024)
+        self.assertEqual(encoding, 'gzip')
+        self.assertLess(len(body), len(DOCUMENT) / 5)
+        self.assertEqual(gzip.decompress(body), DOCUMENT.encode())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+import asyncio
+import json
+import unittest
+
+from pxgrid_util.dedup import SessionDeduplicator
+from pxgrid_util.dedup import SessionMerger
+from pxgrid_util.dedup import canonical_hash
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_session(mac='00:50:56:94:39:9F', timestamp='2026-05-01T00:00:00.000+00:00', **extra):
+    session = {'callingStationId': mac, 'timestamp': timestamp, 'state': 'STARTED'}
+    session.update(extra)
+    return session
+
+
+class TestSessionDeduplicator(unittest.TestCase):
+    def test_duplicates_counted(self):
+        dedup = SessionDeduplicator()
+        self.assertEqual(dedup.check(make_session()), 1)
+        self.assertEqual(dedup.check(make_session()), 2)
+        self.assertEqual(dedup.stats()['hits'], 1)
+        self.assertEqual(dedup.stats()['misses'], 1)
+
+    def test_key_order_does_not_matter(self):
+        dedup = SessionDeduplicator()
+        dedup.check({'a': 1, 'b': 2, 'callingStationId': 'x', 'timestamp': 't'})
+        self.assertEqual(dedup.check({'timestamp': 't', 'callingStationId': 'x', 'b': 2, 'a': 1}), 2)
+
+    def test_same_timestamp_different_content(self):
+        dedup = SessionDeduplicator()
+        dedup.check(make_session(endpointOperatingSystem='Windows'))
+        self.assertEqual(dedup.check(make_session(endpointOperatingSystem='Linux')), 1)
+
+    def test_size_bounded(self):
+        dedup = SessionDeduplicator(max_entries=10)
+        for i in range(100):
+            dedup.check(make_session(mac='mac-%d' % i))
+        self.assertEqual(len(dedup), 10)
+        self.assertEqual(dedup.stats()['evictions'], 90)
+        self.assertEqual(dedup.check(make_session(mac='mac-99')), 2)
+        self.assertEqual(dedup.check(make_session(mac='mac-0')), 1)
+
+    def test_entries_expire(self):
+        clock = FakeClock()
+        dedup = SessionDeduplicator(ttl=60.0, clock=clock)
+        dedup.check(make_session())
+        clock.now = 30.0
+        self.assertEqual(dedup.check(make_session()), 2)
+        clock.now = 100.0
+        self.assertEqual(dedup.check(make_session()), 1)
+        self.assertEqual(dedup.stats()['expirations'], 1)
+
+
+class TestCanonicalHash(unittest.TestCase):
+    def test_payload_is_compact_sorted_json(self):
+        session = make_session(userName='é')
+        digest, payload = canonical_hash(session)
+        self.assertEqual(len(digest), 16)
+        self.assertNotIn(b'\n', payload)
+        self.assertNotIn(b': ', payload)
+        self.assertEqual(json.loads(payload), session)
+        self.assertEqual(payload, canonical_hash(dict(reversed(list(session.items()))))[1])
+
+    def test_fields_subset(self):
+        first = canonical_hash(make_session(vlan=1, nasPortId='a'), fields=['state'])[0]
+        second = canonical_hash(make_session(vlan=2, nasPortId='b'), fields=['state'])[0]
+        third = canonical_hash(make_session(state='DISCONNECTED'), fields=['state'])[0]
+        self.assertEqual(first, second)
+        self.assertNotEqual(first, third)
+
+    def test_deduplicator_with_fields(self):
+        dedup = SessionDeduplicator(fields=['state'])
+        dedup.check(make_session(vlan=1))
+        count, payload = dedup.check_event(make_session(vlan=2))
+        self.assertEqual(count, 2)
+        self.assertEqual(json.loads(payload)['vlan'], 2)
+
+
+class TestSessionMerger(unittest.TestCase):
+    def test_first_copy_passed_on_once(self):
+        async def run_test():
+            clock = FakeClock()
+            merger = SessionMerger(SessionDeduplicator(clock=clock))
+            self.assertTrue(merger.put('node-a', make_session()))
+            clock.now = 0.25
+            self.assertFalse(merger.put('node-b', make_session()))
+            self.assertTrue(merger.put('node-b', make_session(mac='other')))
+            clock.now = 0.5
+            self.assertFalse(merger.put('node-a', make_session(mac='other')))
+
+            node, payload = await merger.get()
+            self.assertEqual(node, 'node-a')
+            self.assertEqual(json.loads(payload), make_session())
+            node, payload = await merger.get()
+            self.assertEqual(node, 'node-b')
+            self.assertTrue(merger.queue.empty())
+
+            stats = merger.stats()
+            self.assertEqual(stats['received'], 4)
+            self.assertEqual(stats['unique'], 2)
+            self.assertEqual(stats['duplicate_ratio'], 0.5)
+            self.assertEqual(stats['nodes']['node-a']['first'], 1)
+            self.assertEqual(stats['nodes']['node-b']['mean_lag'], 0.25)
+            self.assertEqual(stats['nodes']['node-a']['max_lag'], 0.25)
+
+        asyncio.run(run_test())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+import os
+import tempfile
+import unittest
+
+from pxgrid_util.macs import MacFileReader
+from pxgrid_util.macs import normalize_mac
+from pxgrid_util.macs import parse_mac
+
+
+class TestParseMac(unittest.TestCase):
+    def test_notations(self):
+        for text in ('02:42:0a:14:04:23', '02-42-0A-14-04-23', '0242.0a14.0423', '02420A140423', ' 02:42:0A:14:04:23\n'):
+            self.assertEqual(normalize_mac(text), '02:42:0A:14:04:23')
+
+    def test_invalid(self):
+        for text in ('', '02:42:0A:14:04', '02:42-0A:14:04:23', '02:42:0A:14:04:2G', '0242.0a14.04230'):
+            with self.assertRaises(ValueError):
+                parse_mac(text)
+        self.assertEqual(normalize_mac('not-a-mac'), 'NOT-A-MAC')
+
+
+class TestMacFileReader(unittest.TestCase):
+    def test_dedups_and_counts(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, 'macs.txt')
+            with open(path, 'w') as f:
+                # no trailing newline on the last line
+                f.write('# quarantine list\n02:42:0a:14:04:23\n\nbogus\n02-42-0A-14-04-23\n0242.0a14.0424')
+            reader = MacFileReader(path)
+            self.assertEqual(list(reader), ['02:42:0A:14:04:23', '02:42:0A:14:04:24'])
+            self.assertEqual(reader.stats(), {'lines': 4, 'macs': 2, 'duplicates': 1, 'invalid': 1})
+
+
+    def test_without_dedup_only_consecutive_repeats_skipped(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, 'macs.txt')
+            with open(path, 'w') as f:
+                f.write('02:42:0a:14:04:23\n02-42-0A-14-04-23\n0242.0a14.0424\n02:42:0a:14:04:23\n')
+            reader = MacFileReader(path, dedup=False)
+            self.assertEqual(list(reader), ['02:42:0A:14:04:23', '02:42:0A:14:04:24', '02:42:0A:14:04:23'])
+            self.assertEqual(reader.stats(), {'lines': 4, 'macs': 3, 'duplicates': 1, 'invalid': 0})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,133 @@
+import asyncio
+import io
+import json
+import time
+import unittest
+import urllib.error
+from types import SimpleNamespace
+
+from pxgrid_util.nodes import NodeSelector
+from pxgrid_util.nodes import is_failover_error
+from pxgrid_util.pxgrid import PXGridControl
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def http_error(code):
+    return urllib.error.HTTPError('https://x', code, 'error', {}, io.BytesIO(b''))
+
+
+class TestNodeSelector(unittest.TestCase):
+    def test_ranks_by_latency_and_errors(self):
+        clock = FakeClock()
+        selector = NodeSelector(['rank-a', 'rank-b', 'rank-c'], clock=clock, cooldown=30.0)
+        self.assertEqual(selector.ranked(), ['rank-a', 'rank-b', 'rank-c'])
+        selector.record_success('rank-a', 0.35)
+        selector.record_success('rank-b', 0.1)
+        # untried rank-c ranks alongside the fastest, after it
+        self.assertEqual(selector.ranked(), ['rank-b', 'rank-c', 'rank-a'])
+        selector.record_failure('rank-b')
+        self.assertEqual(selector.ranked(), ['rank-c', 'rank-a', 'rank-b'])
+        # back after the cooldown, but penalised for its error rate
+        clock.now += 31.0
+        selector.record_success('rank-c', 0.3)
+        self.assertEqual(selector.ranked(), ['rank-c', 'rank-a', 'rank-b'])
+        self.assertAlmostEqual(selector.health('rank-b').error_rate, 0.3)
+
+    def test_fails_over_on_connection_errors_only(self):
+        calls = []
+
+        def fn(node):
+            calls.append(node)
+            if node == 'failover-a':
+                raise ConnectionRefusedError()
+            if node == 'failover-c':
+                raise http_error(404)
+            return node
+
+        selector = NodeSelector(['failover-a', 'failover-b'])
+        self.assertEqual(selector.call(fn), 'failover-b')
+        self.assertEqual(selector.failovers, 1)
+        # the failed node is now tried last
+        self.assertEqual(selector.call(fn), 'failover-b')
+        self.assertEqual(calls, ['failover-a', 'failover-b', 'failover-b'])
+
+        with self.assertRaises(urllib.error.HTTPError):
+            NodeSelector(['failover-c', 'failover-d']).call(fn)
+        self.assertEqual(calls[-1], 'failover-c')
+
+    def test_error_classification(self):
+        self.assertTrue(is_failover_error(http_error(503)))
+        self.assertTrue(is_failover_error(TimeoutError()))
+        self.assertFalse(is_failover_error(http_error(401)))
+        self.assertFalse(is_failover_error(ValueError()))
+
+    def test_hedged_call_takes_the_first_answer(self):
+        discarded = []
+
+        def fn(node):
+            if node == 'hedge-a':
+                time.sleep(0.3)
+            return node
+
+        selector = NodeSelector(['hedge-a', 'hedge-b'])
+        start = time.monotonic()
+        self.assertEqual(selector.call(fn, hedge_after=0.02, discard=discarded.append), 'hedge-b')
+        self.assertLess(time.monotonic() - start, 0.25)
+        self.assertEqual(selector.hedges, 1)
+        time.sleep(0.4)
+        self.assertEqual(discarded, ['hedge-a'])
+
+    def test_async_hedged_call(self):
+        async def fn(node):
+            if node == 'ahedge-a':
+                await asyncio.sleep(5.0)
+            if node == 'ahedge-b':
+                raise ConnectionResetError()
+            return node
+
+        async def run_test():
+            selector = NodeSelector(['ahedge-a', 'ahedge-b', 'ahedge-c'])
+            start = time.monotonic()
+            self.assertEqual(await selector.acall(fn, hedge_after=0.02), 'ahedge-c')
+            self.assertLess(time.monotonic() - start, 1.0)
+            self.assertEqual(selector.hedges, 1)
+            self.assertEqual(selector.failovers, 1)
+
+        asyncio.run(run_test())
+
+
+class DownHostPool:
+    def __init__(self, down):
+        self.down = down
+        self.hosts = []
+
+    def request(self, method, url, body=None, headers=None, timeout=None):
+        host = url.split('/')[2].split(':')[0]
+        self.hosts.append(host)
+        if host in self.down:
+            raise ConnectionRefusedError()
+        return json.dumps({'services': [{'nodeName': host}]}).encode()
+
+
+class TestControlFailover(unittest.TestCase):
+    def test_control_calls_fail_over_across_hostnames(self):
+        config = SimpleNamespace(
+            hostname=['ctl-a.example', 'ctl-b.example'], port=8910, hedge_after=None,
+            node_name='client', password='secret', description=None, timeout=5.0,
+            ssl_context=None, discovery_ttl=0, discovery_cache=None)
+        pool = DownHostPool(down={'ctl-a.example'})
+        pxgrid = PXGridControl(config, pool=pool)
+        self.assertEqual(pxgrid.service_lookup('svc')['services'][0]['nodeName'], 'ctl-b.example')
+        pxgrid.service_lookup('svc')
+        self.assertEqual(pool.hosts, ['ctl-a.example', 'ctl-b.example', 'ctl-b.example'])
+
+
+if __name__ == '__main__':
+    unittest.main()
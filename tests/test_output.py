@@ -0,0 +1,76 @@
+import io
+import json
+import unittest
+
+from pxgrid_util.output import OutputWriter
+from pxgrid_util.output import msgpack
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestOutputWriter(unittest.TestCase):
+    def test_json_matches_original_output(self):
+        stream = io.BytesIO()
+        with OutputWriter(stream=stream) as output:
+            output.write({'b': 1, 'a': [1, 2]})
+        self.assertEqual(
+            stream.getvalue().decode(),
+            json.dumps({'b': 1, 'a': [1, 2]}, indent=2, sort_keys=True) + '\n')
+
+    def test_ndjson_one_compact_record_per_line(self):
+        stream = io.BytesIO()
+        with OutputWriter(stream=stream, format='ndjson') as output:
+            output.write({'user': 'é', 'n': 1})
+            output.write_json(b'{"raw":true}')
+            output.write_json(b'{\n  "pretty": true\n}')
+        self.assertEqual(
+            stream.getvalue().decode('utf-8').splitlines(),
+            ['{"user":"é","n":1}', '{"raw":true}', '{"pretty":true}'])
+
+    def test_write_json_accepts_text(self):
+        stream = io.BytesIO()
+        with OutputWriter(stream=stream, format='ndjson') as output:
+            output.write_json('{"user":"é"}')
+            output.write_json('{\n  "pretty": true\n}')
+        self.assertEqual(stream.getvalue().decode('utf-8').splitlines(), ['{"user":"é"}', '{"pretty":true}'])
+        stream = io.BytesIO()
+        with OutputWriter(stream=stream) as output:
+            output.write_json('{"a": 1}')
+        self.assertEqual(json.loads(stream.getvalue()), {'a': 1})
+
+    def test_flushes_on_size_or_interval(self):
+        stream = io.BytesIO()
+        clock = FakeClock()
+        output = OutputWriter(stream=stream, format='ndjson', flush_bytes=20, flush_interval=5.0, clock=clock)
+        output.write({'a': 1})
+        self.assertEqual(stream.getvalue(), b'')
+        output.write({'b': 2})
+        output.write({'c': 3})
+        self.assertEqual(stream.getvalue(), b'{"a":1}\n{"b":2}\n{"c":3}\n')
+        output.write({'d': 4})
+        clock.now = 5.0
+        output.write({'e': 5})
+        self.assertEqual(output.bytes_written, 40)
+        self.assertEqual(output.records, 5)
+
+    def test_unknown_format_rejected(self):
+        with self.assertRaises(ValueError):
+            OutputWriter(stream=io.BytesIO(), format='yaml')
+
+    @unittest.skipIf(msgpack is None, 'msgpack not installed')
+    def test_msgpack_round_trip(self):
+        stream = io.BytesIO()
+        with OutputWriter(stream=stream, format='msgpack') as output:
+            output.write({'a': 1})
+            output.write({'b': 2})
+        self.assertEqual(list(msgpack.Unpacker(io.BytesIO(stream.getvalue()))), [{'a': 1}, {'b': 2}])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from pxgrid_util.pagination import PageCheckpoint
+from pxgrid_util.pagination import Paginator
+
+
+class FakeEndpoints:
+    def __init__(self, total, delay=0.0):
+        self.total = total
+        self.delay = delay
+        self.requests = []
+        self.lock = threading.Lock()
+        self.active = 0
+        self.max_active = 0
+
+    def fetch_page(self, start_index, count):
+        with self.lock:
+            self.requests.append((start_index, count))
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        # later pages answer sooner, to check ordering
+        time.sleep(self.delay / (1 + start_index))
+        with self.lock:
+            self.active -= 1
+        return list(range(start_index, min(start_index + count, self.total)))
+
+
+class TestPaginator(unittest.TestCase):
+    def test_all_pages_in_order(self):
+        endpoints = FakeEndpoints(95, delay=0.01)
+        paginator = Paginator(endpoints.fetch_page, page_size=10, prefetch=4)
+        self.assertEqual(list(paginator), list(range(95)))
+        self.assertEqual(paginator.stats()['pages'], 10)
+        self.assertGreater(endpoints.max_active, 1)
+        self.assertLessEqual(endpoints.max_active, 4)
+
+    def test_limit(self):
+        endpoints = FakeEndpoints(100)
+        paginator = Paginator(endpoints.fetch_page, page_size=10, prefetch=2, start_index=5, limit=25)
+        self.assertEqual(list(paginator), list(range(5, 30)))
+        self.assertEqual(sorted(endpoints.requests), [(5, 10), (15, 10), (25, 5)])
+
+    def test_resume_from_checkpoint(self):
+        with tempfile.TemporaryDirectory() as d:
+            checkpoint = PageCheckpoint(os.path.join(d, 'export.json'))
+            endpoints = FakeEndpoints(50)
+            paginator = Paginator(endpoints.fetch_page, page_size=10, prefetch=3, checkpoint=checkpoint)
+            pages = paginator.pages()
+            self.assertEqual(next(pages)[0], 0)
+            paginator.commit()
+            # the second page is interrupted before being written
+            self.assertEqual(next(pages)[0], 10)
+            pages.close()
+            self.assertEqual(checkpoint.load(), 10)
+
+            paginator = Paginator(FakeEndpoints(50).fetch_page, page_size=10, checkpoint=checkpoint)
+            items = []
+            for index, page in paginator.pages():
+                items.extend(page)
+                paginator.commit()
+            self.assertEqual(items, list(range(10, 50)))
+            self.assertIsNone(checkpoint.load())
+
+    def test_iterating_items_does_not_move_checkpoint(self):
+        with tempfile.TemporaryDirectory() as d:
+            checkpoint = PageCheckpoint(os.path.join(d, 'export.json'))
+            checkpoint.save(20)
+            paginator = Paginator(FakeEndpoints(50).fetch_page, page_size=10, checkpoint=checkpoint)
+            self.assertEqual(list(paginator), list(range(20, 50)))
+            self.assertEqual(checkpoint.load(), 20)
+
+    def test_page_error_propagates(self):
+        def fetch_page(start_index, count):
+            if start_index:
+                raise OSError('connection reset')
+            return list(range(count))
+
+        with self.assertRaises(OSError):
+            list(Paginator(fetch_page, page_size=10))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import asyncio
+import unittest
+
+from pxgrid_util.pipeline import EventPipeline
+
+
+class TestEventPipeline(unittest.TestCase):
+    def test_block_policy_waits_for_room(self):
+        async def run_test():
+            pipeline = EventPipeline(maxsize=1)
+            await pipeline.put(b'1')
+            blocked = asyncio.create_task(pipeline.put(b'2'))
+            await asyncio.sleep(0)
+            self.assertFalse(blocked.done())
+            received = []
+            workers = pipeline.start(received.append)
+            await blocked
+            await pipeline.drain()
+            for worker in workers:
+                worker.cancel()
+            self.assertEqual(received, [b'1', b'2'])
+            self.assertEqual(pipeline.stats()['dropped'], 0)
+
+        asyncio.run(run_test())
+
+    def test_drop_oldest_policy(self):
+        async def run_test():
+            pipeline = EventPipeline(maxsize=2, overflow='drop-oldest')
+            for i in range(5):
+                await pipeline.put(b'%d' % i)
+            received = []
+            workers = pipeline.start(received.append)
+            await pipeline.drain()
+            for worker in workers:
+                worker.cancel()
+            self.assertEqual(received, [b'3', b'4'])
+            stats = pipeline.stats()
+            self.assertEqual(stats['dropped'], 3)
+            self.assertEqual(stats['max_depth'], 2)
+
+        asyncio.run(run_test())
+
+    def test_spill_policy_keeps_order(self):
+        async def run_test():
+            pipeline = EventPipeline(maxsize=2, overflow='spill')
+            for i in range(6):
+                await pipeline.put(b'%d' % i)
+            self.assertEqual(pipeline.stats()['spilled'], 4)
+            self.assertEqual(pipeline.depth(), 6)
+            received = []
+            workers = pipeline.start(received.append, offload=True)
+            await pipeline.drain()
+            for worker in workers:
+                worker.cancel()
+            pipeline.close()
+            self.assertEqual(received, [b'%d' % i for i in range(6)])
+            self.assertEqual(pipeline.stats()['processed'], 6)
+
+        asyncio.run(run_test())
+
+    def test_consumer_errors_counted(self):
+        async def run_test():
+            pipeline = EventPipeline()
+
+            def consumer(item):
+                raise ValueError(item)
+
+            await pipeline.put(b'x')
+            workers = pipeline.start(consumer)
+            await pipeline.drain()
+            for worker in workers:
+                worker.cancel()
+            self.assertEqual(pipeline.stats()['errors'], 1)
+
+        asyncio.run(run_test())
+
+    def test_unknown_policy_rejected(self):
+        with self.assertRaises(ValueError):
+            EventPipeline(overflow='ignore')
+
+
+if __name__ == '__main__':
+    unittest.main()
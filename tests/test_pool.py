@@ -0,0 +1,107 @@
+import gzip
+import socket
+import threading
+import unittest
+import urllib.error
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+
+from pxgrid_util.pool import ConnectionPool
+
+
+class EchoHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        status = 404 if self.path == '/missing' else 200
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        if self.path == '/gzip' and 'gzip' in self.headers.get('Accept-Encoding', ''):
+            body = gzip.compress(body)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestConnectionPool(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), EchoHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.url = 'http://127.0.0.1:%d' % self.server.server_address[1]
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_connection_reused_across_requests(self):
+        pool = ConnectionPool(None)
+        for i in range(3):
+            body = pool.request('POST', self.url + '/echo', body=b'{"n": %d}' % i, timeout=5)
+            self.assertEqual(body, b'{"n": %d}' % i)
+        stats = pool.stats()
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['hits'], 2)
+        self.assertEqual(stats['idle'], 1)
+        pool.close()
+
+    def test_http_error_raised_and_connection_kept(self):
+        pool = ConnectionPool(None)
+        with self.assertRaises(urllib.error.HTTPError) as cm:
+            pool.request('POST', self.url + '/missing', body=b'{}', timeout=5)
+        self.assertEqual(cm.exception.code, 404)
+        pool.request('POST', self.url + '/echo', body=b'{}', timeout=5)
+        self.assertEqual(pool.stats()['hits'], 1)
+        pool.close()
+
+    def test_idle_connections_evicted(self):
+        pool = ConnectionPool(None, idle_timeout=0.0)
+        pool.request('POST', self.url + '/echo', body=b'{}', timeout=5)
+        pool.evict_idle()
+        stats = pool.stats()
+        self.assertEqual(stats['evictions'], 1)
+        self.assertEqual(stats['open'], 0)
+
+    def test_stale_connection_retried(self):
+        pool = ConnectionPool(None)
+        pool.request('POST', self.url + '/echo', body=b'{}', timeout=5)
+        for conns in pool._idle.values():
+            for conn in conns:
+                conn.sock.shutdown(socket.SHUT_RDWR)
+        body = pool.request('POST', self.url + '/echo', body=b'{"ok": 1}', timeout=5)
+        self.assertEqual(body, b'{"ok": 1}')
+        pool.close()
+
+    def test_compressed_response_decoded(self):
+        pool = ConnectionPool(None)
+        payload = b'{"sessions": [%s]}' % b','.join(b'{"n": %d}' % i for i in range(1000))
+        with pool.urlopen('POST', self.url + '/gzip', body=payload, timeout=5) as response:
+            self.assertEqual(response.content_encoding, 'gzip')
+            chunks = iter(lambda: response.read(100), b'')
+            self.assertEqual(b''.join(chunks), payload)
+        # compressed request bodies are decoded by the server
+        body = pool.request(
+            'POST', self.url + '/echo', body=gzip.compress(payload), headers={'Content-Encoding': 'gzip'}, timeout=5)
+        self.assertEqual(body, payload)
+        stats = pool.stats()
+        self.assertEqual(stats['decoded'], 1)
+        self.assertEqual(stats['hits'], 1)
+        pool.close()
+
+    def test_no_accept_encoding(self):
+        pool = ConnectionPool(None, accept_encoding=None)
+        with pool.urlopen('POST', self.url + '/gzip', body=b'{}', timeout=5) as response:
+            self.assertIsNone(response.content_encoding)
+            self.assertEqual(response.read(), b'{}')
+        pool.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
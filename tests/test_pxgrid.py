@@ -0,0 +1,97 @@
+import asyncio
+import json
+import unittest
+from types import SimpleNamespace
+
+from pxgrid_util.pxgrid import AsyncPXGridControl
+from pxgrid_util.pxgrid import PXGridControl
+
+
+def make_config():
+    return SimpleNamespace(
+        hostname=['ise.example'],
+        port=8910,
+        hedge_after=None,
+        node_name='client',
+        password='secret',
+        description=None,
+        timeout=5.0,
+        ssl_context=None,
+        discovery_ttl=0,
+        discovery_cache=None)
+
+
+class StubPool:
+    def __init__(self, responses):
+        self.responses = responses
+        self.requests = []
+
+    def request(self, method, url, body=None, headers=None, timeout=None):
+        self.requests.append((url, json.loads(body)))
+        return json.dumps(self.responses[url.rsplit('/', 1)[-1]]).encode()
+
+
+class StubResponse:
+    def __init__(self, body):
+        self.body = body
+        self.status = 200
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        pass
+
+    def raise_for_status(self):
+        pass
+
+    async def read(self):
+        return self.body
+
+
+class StubSession:
+    def __init__(self, responses):
+        self.responses = responses
+        self.requests = []
+
+    def post(self, url, data=None, headers=None, timeout=None):
+        self.requests.append((url, json.loads(data)))
+        return StubResponse(json.dumps(self.responses[url.rsplit('/', 1)[-1]]).encode())
+
+
+class TestPXGridControl(unittest.TestCase):
+    def test_service_lookup_uses_pool(self):
+        pool = StubPool({'ServiceLookup': {'services': []}})
+        pxgrid = PXGridControl(make_config(), pool=pool)
+        self.assertEqual(pxgrid.service_lookup('com.cisco.ise.session'), {'services': []})
+        self.assertEqual(
+            pool.requests,
+            [('https://ise.example:8910/pxgrid/control/ServiceLookup', {'name': 'com.cisco.ise.session'})])
+
+
+class TestAsyncPXGridControl(unittest.TestCase):
+    def test_get_access_secret(self):
+        async def run_test():
+            session = StubSession({'AccessSecret': {'secret': 's3cr3t'}})
+            async with AsyncPXGridControl(make_config(), session=session) as pxgrid:
+                resp = await pxgrid.get_access_secret('~ise-pubsub-ise')
+            self.assertEqual(resp, {'secret': 's3cr3t'})
+            self.assertEqual(
+                session.requests,
+                [('https://ise.example:8910/pxgrid/control/AccessSecret', {'peerNodeName': '~ise-pubsub-ise'})])
+
+        asyncio.run(run_test())
+
+    def test_concurrent_requests_share_session(self):
+        async def run_test():
+            session = StubSession({'AccessSecret': {'secret': 'x'}})
+            pxgrid = AsyncPXGridControl(make_config(), session=session)
+            await asyncio.gather(*[pxgrid.get_access_secret('node-%d' % i) for i in range(3)])
+            await pxgrid.close()
+            self.assertEqual(len(session.requests), 3)
+
+        asyncio.run(run_test())
+
+
+if __name__ == '__main__':
+    unittest.main()
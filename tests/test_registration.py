@@ -0,0 +1,116 @@
+import asyncio
+import unittest
+
+import aiohttp
+from yarl import URL
+
+from pxgrid_util.backoff import ExponentialBackoff
+from pxgrid_util.registration import ServiceRegistration
+
+
+def http_error(status):
+    url = URL('https://ise.example:8910/pxgrid/control/ServiceReregister')
+    request_info = aiohttp.RequestInfo(url, 'POST', {}, url)
+    return aiohttp.ClientResponseError(request_info, (), status=status)
+
+
+class StubControl:
+    '''
+    Records control calls; each ServiceReregister pops the next outcome
+    from `reregister_errors` (None for success).
+    '''
+
+    def __init__(self, reregister_errors=()):
+        self.calls = []
+        self.reregister_errors = list(reregister_errors)
+        self.ids = iter('bcdef')
+
+    async def service_register(self, service_name, properties):
+        self.calls.append(('register', service_name))
+        return {'id': next(self.ids), 'reregisterTimeMillis': 300000}
+
+    async def service_reregister(self, service_id):
+        self.calls.append(('reregister', service_id))
+        error = self.reregister_errors.pop(0) if self.reregister_errors else None
+        if error is not None:
+            raise error
+        return {}
+
+    async def service_unregister(self, service_id):
+        self.calls.append(('unregister', service_id))
+        return {}
+
+
+class FakeTime:
+    '''
+    Clock and sleep for `ServiceRegistration`; sleeping advances the clock,
+    and the `stop_after`-th sleep cancels the run.
+    '''
+
+    def __init__(self, stop_after):
+        self.now = 0.0
+        self.sleeps = []
+        self.stop_after = stop_after
+
+    def clock(self):
+        return self.now
+
+    async def sleep(self, delay):
+        self.sleeps.append(delay)
+        if len(self.sleeps) >= self.stop_after:
+            raise asyncio.CancelledError()
+        self.now += delay
+
+
+def run_registration(control, fake_time, **kwargs):
+    registration = ServiceRegistration(
+        control, 'com.example.service', {}, clock=fake_time.clock, sleep=fake_time.sleep,
+        backoff=ExponentialBackoff(initial=1.0, jitter=0.0), **kwargs)
+    registration.adopt({'id': 'a', 'reregisterTimeMillis': 300000})
+
+    async def run_test():
+        try:
+            await registration.run()
+        except asyncio.CancelledError:
+            pass
+
+    asyncio.run(run_test())
+    return registration
+
+
+class TestServiceRegistration(unittest.TestCase):
+    def test_reregisters_on_the_server_schedule_and_unregisters(self):
+        control = StubControl()
+        fake_time = FakeTime(stop_after=3)
+        registration = run_registration(control, fake_time)
+        self.assertEqual(fake_time.sleeps, [225.0, 225.0, 225.0])
+        self.assertEqual(control.calls, [
+            ('reregister', 'a'), ('reregister', 'a'), ('unregister', 'a')])
+        self.assertIsNone(registration.service_id)
+
+    def test_transient_failures_are_retried_with_backoff(self):
+        control = StubControl([http_error(503), None])
+        fake_time = FakeTime(stop_after=5)
+        registration = run_registration(control, fake_time)
+        # the retry is due at once; the next one is 225s after the success
+        self.assertEqual(fake_time.sleeps, [225.0, 1.0, 0.0, 225.0, 225.0])
+        self.assertEqual(registration.stats()['failures'], 1)
+        self.assertEqual(control.calls[-1], ('unregister', 'a'))
+
+    def test_unknown_id_registers_again(self):
+        control = StubControl([http_error(404)])
+        fake_time = FakeTime(stop_after=3)
+        registration = run_registration(control, fake_time)
+        self.assertEqual(control.calls, [
+            ('reregister', 'a'), ('register', 'com.example.service'), ('unregister', 'b')])
+        self.assertEqual(registration.stats()['registrations'], 1)
+
+    def test_fixed_interval(self):
+        control = StubControl()
+        fake_time = FakeTime(stop_after=3)
+        run_registration(control, fake_time, interval=10.0)
+        self.assertEqual(fake_time.sleeps, [10.0, 10.0, 10.0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,186 @@
+import asyncio
+import io
+import json
+import os
+import tempfile
+import time
+import unittest
+from types import SimpleNamespace
+
+from pxgrid_util.snapshot import Snapshot
+from pxgrid_util.snapshot import parse_snapshot_query
+
+
+def make_config(output_format='json'):
+    return SimpleNamespace(
+        hostname=['ise.example'],
+        port=8910,
+        hedge_after=None,
+        node_name='client',
+        password='secret',
+        description=None,
+        timeout=5.0,
+        ssl_context=None,
+        discovery_ttl=0,
+        discovery_cache=None,
+        discovery_override=None,
+        output_format=output_format)
+
+
+SERVICES = {
+    'com.cisco.ise.config.trustsec': 'https://ise-1.example:8910/pxgrid/ise/config/trustsec',
+    'com.cisco.ise.session': 'https://ise-1.example:8910/pxgrid/ise/session',
+}
+
+QUERY_RESPONSES = {
+    'getSecurityGroups': {'securityGroups': [{'id': 1}, {'id': 2}]},
+    'getSecurityGroupAcls': {'securityGroupAcls': [{'id': 3}]},
+    'getSessions': {'sessions': [{'mac': 'A'}, {'mac': 'B'}, {'mac': 'C'}]},
+}
+
+
+class StubContent:
+    '''
+    Serves a body at most `chunk_size` bytes per read, as a socket would.
+    '''
+
+    def __init__(self, body, chunk_size=100):
+        self.body = body
+        self.chunk_size = chunk_size
+        self.reads = 0
+
+    async def read(self, size=-1):
+        self.reads += 1
+        if size < 0:
+            size = len(self.body)
+        data, self.body = self.body[:min(size, self.chunk_size)], self.body[min(size, self.chunk_size):]
+        return data
+
+
+class StubResponse:
+    def __init__(self, body, delay=0.0, status=200):
+        self.body = body
+        self.content = StubContent(body)
+        self.delay = delay
+        self.status = status
+        self.released = False
+
+    def __await__(self):
+        return self.__aenter__().__await__()
+
+    async def __aenter__(self):
+        await asyncio.sleep(self.delay)
+        return self
+
+    async def __aexit__(self, *exc):
+        pass
+
+    def release(self):
+        self.released = True
+
+    def raise_for_status(self):
+        if self.status >= 400:
+            raise OSError('status %d' % self.status)
+
+    async def read(self):
+        return self.body
+
+
+class StubSession:
+    '''
+    Answers control calls and the queries in `QUERY_RESPONSES`, each after
+    `delay` seconds.
+    '''
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.requests = []
+        self.responses = []
+
+    def post(self, url, data=None, headers=None, timeout=None):
+        call = url.rsplit('/', 1)[-1]
+        self.requests.append(call)
+        if call == 'AccountActivate':
+            body = {'accountState': 'ENABLED'}
+        elif call == 'ServiceLookup':
+            name = json.loads(data)['name']
+            body = {'services': [{'nodeName': 'ise-1', 'properties': {'restBaseUrl': SERVICES[name]}}]}
+        elif call == 'AccessSecret':
+            body = {'secret': 's3cr3t'}
+        elif call in QUERY_RESPONSES:
+            response = StubResponse(json.dumps(QUERY_RESPONSES[call]).encode(), delay=self.delay)
+            self.responses.append(response)
+            return response
+        else:
+            return StubResponse(b'', status=500)
+        return StubResponse(json.dumps(body).encode())
+
+
+QUERIES = [parse_snapshot_query(name) for name in ('sgts', 'sgacls', 'sessions')]
+
+
+class TestSnapshot(unittest.TestCase):
+    def test_parse_snapshot_query(self):
+        self.assertEqual(parse_snapshot_query('matrix'), (
+            'matrix', 'com.cisco.ise.config.trustsec', '/getEgressPolicies'))
+        self.assertEqual(parse_snapshot_query('healths=com.cisco.ise.system/getHealths'), (
+            'healths', 'com.cisco.ise.system', '/getHealths'))
+        with self.assertRaises(ValueError):
+            parse_snapshot_query('nonsense')
+
+    def test_discovers_once_and_queries_concurrently(self):
+        session = StubSession(delay=0.2)
+        with tempfile.TemporaryDirectory() as directory:
+            snapshot = Snapshot(make_config('ndjson'), QUERIES, directory=directory, session=session)
+            start = time.monotonic()
+            stats = asyncio.run(snapshot.run())
+            self.assertLess(time.monotonic() - start, 0.5)
+
+            self.assertEqual(sorted(os.listdir(directory)), ['sessions.ndjson', 'sgacls.ndjson', 'sgts.ndjson'])
+            with open(os.path.join(directory, 'sessions.ndjson')) as f:
+                self.assertEqual([json.loads(line) for line in f], QUERY_RESPONSES['getSessions']['sessions'])
+
+        self.assertEqual(session.requests.count('AccountActivate'), 1)
+        self.assertEqual(session.requests.count('ServiceLookup'), 2)
+        self.assertEqual(session.requests.count('AccessSecret'), 1)
+        self.assertEqual(stats['failed'], 0)
+        self.assertEqual([q['records'] for q in stats['queries']], [2, 1, 3])
+        # bodies were parsed as they were read, not read whole first
+        self.assertTrue(all(r.released and r.content.reads > 1 for r in session.responses))
+
+    def test_failed_query_does_not_stop_others(self):
+        queries = QUERIES[:1] + [parse_snapshot_query('broken=com.cisco.ise.session/getBroken')]
+        with tempfile.TemporaryDirectory() as directory:
+            snapshot = Snapshot(make_config(), queries, directory=directory, session=StubSession())
+            stats = asyncio.run(snapshot.run())
+            self.assertEqual(os.listdir(directory), ['sgts.json'])
+        self.assertEqual(stats['failed'], 1)
+        self.assertIn('error', stats['queries'][1])
+
+    def test_single_query_to_stream(self):
+        stream = io.BytesIO()
+        stats = asyncio.run(Snapshot(make_config(), QUERIES[:1], stream=stream, session=StubSession()).run())
+        self.assertEqual(stats['failed'], 0)
+        self.assertEqual(json.loads(stream.getvalue()), QUERY_RESPONSES['getSecurityGroups'])
+
+    def test_unwritable_directory_error_kept(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            directory = os.path.join(tmp, 'not-a-directory')
+            open(directory, 'w').close()
+            snapshot = Snapshot(make_config(), QUERIES[:1], directory=directory)
+            with self.assertRaises(NotADirectoryError) as raised:
+                snapshot.write('sgts', io.BytesIO(b'{}'))
+            # the error from open() itself, not one from cleaning up after it
+            self.assertIsNone(raised.exception.__context__)
+
+    def test_names_must_be_unique(self):
+        with self.assertRaises(ValueError):
+            Snapshot(make_config(), QUERIES + QUERIES[:1], directory='snapshots')
+
+    def test_several_queries_need_a_directory(self):
+        with self.assertRaises(ValueError):
+            Snapshot(make_config(), QUERIES)
+
+
+if __name__ == '__main__':
+    unittest.main()
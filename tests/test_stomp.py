@@ -0,0 +1,209 @@
+import io
+import random
+import time
+import unittest
+
+from pxgrid_util.stomp import StompFrame
+from pxgrid_util.stomp import StompFrameReader
+from pxgrid_util.stomp import StompProtocolError
+
+
+def make_frame(command, headers=None, content=None):
+    frame = StompFrame()
+    frame.set_command(command)
+    for key, value in (headers or {}).items():
+        frame.set_header(key, value)
+    frame.set_content(content)
+    return frame
+
+
+class TestStompCodec(unittest.TestCase):
+    def test_encode_matches_write(self):
+        frame = make_frame('SEND', {'destination': '/topic/x'}, '{"a": 1}')
+        out = io.StringIO()
+        frame.write(out)
+        self.assertEqual(frame.encode(), out.getvalue().encode('utf-8'))
+
+    def test_encode_without_content(self):
+        frame = make_frame('DISCONNECT', {'receipt': '123'})
+        self.assertEqual(frame.encode(), b'DISCONNECT\nreceipt:123\n\n\0')
+
+    def test_decode_round_trip(self):
+        data = make_frame('MESSAGE', {'destination': '/topic/x'}, '{"a": "é"}').encode()
+        frame = StompFrame.decode(data)
+        self.assertEqual(frame.get_command(), 'MESSAGE')
+        self.assertEqual(frame.get_header('destination'), '/topic/x')
+        self.assertIsInstance(frame.get_content(), memoryview)
+        self.assertEqual(bytes(frame.get_content()), '{"a": "é"}'.encode('utf-8'))
+
+    def test_decode_honours_content_length(self):
+        body = b'abc\0def'
+        data = b'MESSAGE\ncontent-length:7\n\n' + body + b'\0'
+        frame = StompFrame.decode(data)
+        self.assertEqual(bytes(frame.get_content()), body)
+
+    def test_decode_short_content_length(self):
+        with self.assertRaises(ValueError):
+            StompFrame.decode(b'MESSAGE\ncontent-length:10\n\nabc\0')
+
+    def test_decode_crlf_and_memoryview(self):
+        data = memoryview(b'CONNECTED\r\nversion:1.2\r\n\r\n\0')
+        frame = StompFrame.decode(data)
+        self.assertEqual(frame.get_command(), 'CONNECTED')
+        self.assertEqual(frame.get_header('version'), '1.2')
+        self.assertEqual(bytes(frame.get_content()), b'')
+
+    def test_decode_matches_parse(self):
+        data = b'MESSAGE\ndestination:/topic/x\nmessage-id:7\n\n{"sessions": []}\0'
+        legacy = StompFrame.parse(io.StringIO(data.decode('utf-8')))
+        frame = StompFrame.decode(data)
+        self.assertEqual(frame.headers, legacy.headers)
+        self.assertEqual(bytes(frame.get_content()).decode('utf-8'), legacy.get_content())
+
+
+# characters that exercise the STOMP 1.2 escaping rules, plus some non-ASCII
+HEADER_ALPHABET = 'ab:\\\r\n c0-_/[]?=\'"é\u2028\x0b'
+
+
+def random_text(rng, max_length=12):
+    return ''.join(rng.choice(HEADER_ALPHABET) for _ in range(rng.randint(0, max_length)))
+
+
+class TestStompHeaders(unittest.TestCase):
+    def test_value_containing_colons(self):
+        data = b'MESSAGE\ntimestamp:2026-05-01T00:00:00.000+00:00\nip:fe80::1\n\n\0'
+        frame = StompFrame.decode(data)
+        self.assertEqual(frame.get_header('timestamp'), '2026-05-01T00:00:00.000+00:00')
+        self.assertEqual(frame.get_header('ip'), 'fe80::1')
+
+    def test_escape_sequences_decoded(self):
+        data = b'MESSAGE\nfilter:a\\cb\\nc\\\\d\\re\n\n\0'
+        frame = StompFrame.decode(data)
+        self.assertEqual(frame.get_header('filter'), 'a:b\nc\\d\re')
+
+    def test_connected_frame_not_unescaped(self):
+        frame = StompFrame.decode(b'CONNECTED\nserver:a\\cb\n\n\0')
+        self.assertEqual(frame.get_header('server'), 'a\\cb')
+
+    def test_invalid_escape_rejected(self):
+        with self.assertRaises(ValueError):
+            StompFrame.decode(b'MESSAGE\nbad:a\\tb\n\n\0')
+
+    def test_first_repeated_header_wins(self):
+        frame = StompFrame.decode(b'MESSAGE\nfoo:first\nfoo:second\n\n\0')
+        self.assertEqual(frame.get_header('foo'), 'first')
+
+    def test_text_parse_handles_colons(self):
+        frame = StompFrame.parse(io.StringIO('MESSAGE\nip:fe80::1\n\nbody\0'))
+        self.assertEqual(frame.get_header('ip'), 'fe80::1')
+        self.assertEqual(frame.get_content(), 'body')
+
+    def test_encode_escapes_filter_header(self):
+        frame = make_frame('SUBSCRIBE', {'filter': "sessions[?ts > '10:00']"})
+        self.assertIn(b"filter:sessions[?ts > '10\\c00']\n", frame.encode())
+
+    def test_random_headers_round_trip(self):
+        rng = random.Random(1234)
+        for _ in range(500):
+            headers = {}
+            for _ in range(rng.randint(0, 5)):
+                headers.setdefault(random_text(rng) or 'x', random_text(rng))
+            body = bytes(rng.randrange(256) for _ in range(rng.randint(0, 40)))
+            headers['content-length'] = str(len(body))
+            frame = StompFrame.decode(make_frame('MESSAGE', headers, body).encode())
+            self.assertEqual(frame.headers, headers)
+            self.assertEqual(bytes(frame.get_content()), body)
+
+    def test_random_garbage_only_raises_value_error(self):
+        rng = random.Random(5678)
+        pieces = [b'MESSAGE', b'\n', b'\r\n', b':', b'\\', b'\\c', b'\0',
+                  b'content-length:', b'3', b'x', b'\xff', b'\xc3\xa9']
+        for _ in range(2000):
+            data = b''.join(rng.choice(pieces) for _ in range(rng.randint(0, 20)))
+            try:
+                StompFrame.decode(data)
+            except ValueError:
+                pass
+
+
+class TestStompFrameReader(unittest.TestCase):
+    def test_multiple_frames_in_one_message(self):
+        reader = StompFrameReader()
+        data = (b'MESSAGE\nmessage-id:1\n\none\0\n'
+                b'MESSAGE\nmessage-id:2\ncontent-length:3\n\nt\0o\0'
+                b'RECEIPT\nreceipt-id:9\n\n\0')
+        frames = reader.feed(data)
+        self.assertEqual([f.get_command() for f in frames], ['MESSAGE', 'MESSAGE', 'RECEIPT'])
+        self.assertEqual(bytes(frames[0].get_content()), b'one')
+        self.assertEqual(bytes(frames[1].get_content()), b't\0o')
+        self.assertEqual(reader.pending, b'')
+
+    def test_frame_split_across_messages(self):
+        data = make_frame('MESSAGE', {'message-id': '1'}, '{"sessions": []}').encode()
+        for split in range(1, len(data)):
+            reader = StompFrameReader()
+            self.assertEqual(reader.feed(data[:split]), [])
+            frames = reader.feed(data[split:])
+            self.assertEqual(len(frames), 1)
+            self.assertEqual(bytes(frames[0].get_content()), b'{"sessions": []}')
+
+    def test_heartbeats_skipped(self):
+        reader = StompFrameReader()
+        self.assertEqual(reader.feed(b'\n'), [])
+        self.assertEqual(reader.feed(b'\r\n'), [])
+        frames = reader.feed(b'\nRECEIPT\nreceipt-id:1\n\n\0\n')
+        self.assertEqual([f.get_command() for f in frames], ['RECEIPT'])
+
+    def test_malformed_frame_skipped(self):
+        reader = StompFrameReader()
+        frames = reader.feed(b'MESSAGE\nbroken\n\nx\0RECEIPT\nreceipt-id:1\n\n\0')
+        self.assertEqual([f.get_command() for f in frames], ['RECEIPT'])
+        self.assertEqual(reader.errors, 1)
+
+    def test_random_chunking(self):
+        rng = random.Random(42)
+        frames = [make_frame('MESSAGE', {'message-id': str(i)}, 'x' * rng.randint(0, 50))
+                  for i in range(50)]
+        stream = b''.join(f.encode() + b'\n' * rng.randint(0, 2) for f in frames)
+        reader = StompFrameReader()
+        received = []
+        pos = 0
+        while pos < len(stream):
+            step = rng.randint(1, 64)
+            received.extend(reader.feed(stream[pos:pos + step]))
+            pos += step
+        self.assertEqual([f.get_header('message-id') for f in received],
+                         [str(i) for i in range(50)])
+
+
+    def test_large_frame_in_many_messages(self):
+        body = b'x' * (4 * 1024 * 1024)
+        data = b'MESSAGE\nmessage-id:1\n\n' + body + b'\0MESSAGE\nmessage-id:2\n\ntwo'
+        reader = StompFrameReader()
+        frames = []
+        start = time.monotonic()
+        for pos in range(0, len(data), 1024):
+            frames.extend(reader.feed(data[pos:pos + 1024]))
+        self.assertLess(time.monotonic() - start, 2.0)
+        self.assertEqual(len(frames), 1)
+        # the next frame reuses the buffer, the first frame keeps its content
+        frames.extend(reader.feed(b'\0'))
+        self.assertEqual(bytes(frames[0].get_content()), body)
+        self.assertEqual(bytes(frames[1].get_content()), b'two')
+        self.assertEqual(reader.pending, b'')
+
+    def test_oversized_frame_rejected(self):
+        reader = StompFrameReader(max_frame_size=100)
+        reader.feed(b'MESSAGE\n\n' + b'x' * 50)
+        with self.assertRaises(StompProtocolError):
+            reader.feed(b'x' * 60)
+        self.assertEqual(reader.pending, b'')
+        frames = reader.feed(b'RECEIPT\nreceipt-id:1\n\n\0')
+        self.assertEqual([f.get_command() for f in frames], ['RECEIPT'])
+
+        with self.assertRaises(StompProtocolError):
+            StompFrameReader(max_frame_size=100).feed(b'MESSAGE\n\n' + b'x' * 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import os
+import tempfile
+import unittest
+
+from pxgrid_util.store import SessionStore
+from pxgrid_util.store import newest_session
+
+
+def session(mac, ip, user='alice', nas='10.0.0.1', state='STARTED', timestamp=None):
+    s = {
+        'callingStationId': mac,
+        'ipAddresses': [ip],
+        'userName': user,
+        'nasIpAddress': nas,
+        'state': state,
+    }
+    if timestamp is not None:
+        s['timestamp'] = timestamp
+    return s
+
+
+class TestSessionStore(unittest.TestCase):
+    def test_indexes_follow_updates(self):
+        store = SessionStore()
+        store.update([
+            session('00:11:22:33:44:55', '10.1.1.1'),
+            session('00:11:22:33:44:66', '10.1.1.2', user='bob'),
+        ])
+        self.assertEqual(store.by_ip('10.1.1.1')[0]['callingStationId'], '00:11:22:33:44:55')
+        self.assertEqual(len(store.by_nas_ip('10.0.0.1')), 2)
+        self.assertEqual(len(store.by_mac('00-11-22-33-44-66')), 1)
+
+        # the session moves to a new address and user
+        store.update([session('00:11:22:33:44:55', '10.1.1.9', user='carol')])
+        self.assertEqual(store.by_ip('10.1.1.1'), [])
+        self.assertEqual(len(store.by_ip('10.1.1.9')), 1)
+        self.assertEqual(store.by_username('alice'), [])
+        self.assertEqual(len(store.by_username('carol')), 1)
+
+    def test_ended_sessions_removed(self):
+        store = SessionStore()
+        store.update([session('00:11:22:33:44:55', '10.1.1.1')])
+        store.update([session('00:11:22:33:44:55', '10.1.1.1', state='DISCONNECTED')])
+        self.assertEqual(len(store), 0)
+        self.assertEqual(store.by_ip('10.1.1.1'), [])
+        self.assertEqual(store.stats()['ips'], 0)
+        self.assertEqual(store.stats()['removals'], 1)
+
+    def test_older_events_ignored(self):
+        store = SessionStore()
+        store.update([session('00:11:22:33:44:55', '10.1.1.1', timestamp='2024-05-01T10:00:05.000+00:00')])
+        # a lagging copy of an earlier event does not replace the newer session
+        store.update([session('00:11:22:33:44:55', '10.1.1.7', timestamp='2024-05-01T10:00:00.000+00:00')])
+        self.assertEqual(len(store.by_ip('10.1.1.1')), 1)
+        store.update([session(
+            '00:11:22:33:44:55', '10.1.1.1', state='DISCONNECTED', timestamp='2024-05-01T09:59:00.000+00:00')])
+        self.assertEqual(len(store), 1)
+        self.assertEqual(store.stats()['stale'], 2)
+
+    def test_newest_session(self):
+        sessions = [
+            session('00:11:22:33:44:99', '10.1.1.1', timestamp='2024-05-01T10:00:00.000+00:00'),
+            session('00:11:22:33:44:11', '10.1.1.1', timestamp='2024-05-01T11:30:00.000+02:00'),
+            session('00:11:22:33:44:22', '10.1.1.1'),
+        ]
+        self.assertEqual(newest_session(sessions)['callingStationId'], '00:11:22:33:44:99')
+
+    def test_snapshot_round_trip(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, 'sessions.json')
+            store = SessionStore(path, clock=lambda: 1000.0)
+            self.assertFalse(store.load())
+            self.assertIsNone(store.sync_from())
+            store.update([session('00:11:22:33:44:55', '10.1.1.1')])
+            store.save()
+
+            restored = SessionStore(path)
+            self.assertTrue(restored.load())
+            self.assertEqual(restored.by_ip('10.1.1.1'), store.by_ip('10.1.1.1'))
+            self.assertEqual(restored.sync_from(overlap=0), '1970-01-01T00:16:40.000+00:00')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+import io
+import json
+import random
+import unittest
+from types import SimpleNamespace
+
+from pxgrid_util import write_query
+from pxgrid_util.output import OutputWriter
+from pxgrid_util.streaming import JSONArrayStream
+from pxgrid_util.streaming import iter_json_items
+
+
+class StubResponse(io.BytesIO):
+    def __exit__(self, *exc):
+        self.close()
+
+
+class StubPool:
+    def __init__(self, body):
+        self.body = body
+
+    def urlopen(self, method, url, body=None, headers=None, timeout=None):
+        return StubResponse(self.body)
+
+    def request(self, method, url, body=None, headers=None, timeout=None):
+        return self.body
+
+
+def make_document(seed, elements=50):
+    rng = random.Random(seed)
+    return {
+        'sessions': [
+            {
+                'callingStationId': '00:11:22:33:44:%02X' % i,
+                'userName': 'üser-%d' % rng.randrange(10 ** 6),
+                'ipAddresses': ['10.0.0.%d' % rng.randrange(256)],
+                'count': rng.randrange(10 ** 9),
+                'ratio': rng.random(),
+                'active': rng.random() < 0.5,
+                'vlan': None,
+            }
+            for i in range(elements)
+        ],
+        'nextToken': 'x',
+    }
+
+
+class TestJSONArrayStream(unittest.TestCase):
+    def test_matches_json_loads_for_any_chunk_size(self):
+        for seed in range(5):
+            document = make_document(seed)
+            data = json.dumps(document, indent=seed % 3 or None).encode('utf-8')
+            for chunk_size in (1, 7, 64, 1 << 16):
+                stream = JSONArrayStream(io.BytesIO(data), chunk_size=chunk_size)
+                items = list(stream)
+                self.assertEqual([k for k, _ in items], ['sessions'] * 50)
+                self.assertEqual([v for _, v in items], document['sessions'])
+                self.assertEqual(stream.fields, {'nextToken': 'x'})
+
+    def test_top_level_array_and_scalars(self):
+        data = b' [1, 23, 456, "x", [7], {}, true, null, -1.5e3] '
+        self.assertEqual(
+            list(iter_json_items(io.BytesIO(data), chunk_size=2)),
+            [1, 23, 456, 'x', [7], {}, True, None, -1500.0])
+
+    def test_empty_arrays_and_objects(self):
+        self.assertEqual(list(iter_json_items(io.BytesIO(b'{"sessions": []}'))), [])
+        self.assertEqual(list(iter_json_items(io.BytesIO(b'{}'))), [])
+        self.assertEqual(list(iter_json_items(io.BytesIO(b'[]'))), [])
+
+    def test_empty_body(self):
+        self.assertEqual(list(iter_json_items(io.BytesIO(b''))), [])
+        self.assertEqual(list(iter_json_items(io.BytesIO(b' \n'))), [])
+
+    def test_truncated_document_rejected(self):
+        with self.assertRaises(ValueError):
+            list(iter_json_items(io.BytesIO(b'{"sessions": [{"a": 1}, {"b"'), chunk_size=4))
+        with self.assertRaises(ValueError):
+            list(iter_json_items(io.BytesIO(b'[1, 2')))
+
+
+class TestWriteQuery(unittest.TestCase):
+    def test_ndjson_writes_one_record_per_element(self):
+        config = SimpleNamespace(node_name='client', ssl_context=None, timeout=5.0, hedge_after=None, compress_requests=None)
+        pool = StubPool(json.dumps({'bindings': [{'a': 1}, {'b': 2}]}).encode())
+        stream = io.BytesIO()
+        with OutputWriter(stream=stream, format='ndjson') as output:
+            write_query(output, config, 'secret', 'https://ise/getBindings', '{}', pool=pool)
+        self.assertEqual(stream.getvalue(), b'{"a":1}\n{"b":2}\n')
+
+    def test_json_writes_whole_response(self):
+        config = SimpleNamespace(node_name='client', ssl_context=None, timeout=5.0, hedge_after=None, compress_requests=None)
+        pool = StubPool(b'{"bindings": [{"a": 1}]}')
+        stream = io.BytesIO()
+        with OutputWriter(stream=stream) as output:
+            write_query(output, config, 'secret', 'https://ise/getBindings', '{}', pool=pool)
+        self.assertEqual(json.loads(stream.getvalue()), {'bindings': [{'a': 1}]})
+
+    def test_empty_response_as_json(self):
+        config = SimpleNamespace(node_name='client', ssl_context=None, timeout=5.0, hedge_after=None, compress_requests=None)
+        stream = io.BytesIO()
+        with OutputWriter(stream=stream) as output:
+            write_query(output, config, 'secret', 'https://ise/getBindings', '{}', pool=StubPool(b''))
+        self.assertEqual(json.loads(stream.getvalue()), {})
+
+    def test_empty_response_as_ndjson(self):
+        config = SimpleNamespace(node_name='client', ssl_context=None, timeout=5.0, hedge_after=None, compress_requests=None)
+        stream = io.BytesIO()
+        with OutputWriter(stream=stream, format='ndjson') as output:
+            write_query(output, config, 'secret', 'https://ise/getBindings', '{}', pool=StubPool(b''))
+        self.assertEqual(stream.getvalue(), b'')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+import datetime
+import io
+import json
+import os
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+from pxgrid_util import write_query
+from pxgrid_util.output import OutputWriter
+from pxgrid_util.sync import SyncState
+from pxgrid_util.sync import format_timestamp
+
+
+class StubResponse(io.BytesIO):
+    def __exit__(self, *exc):
+        self.close()
+
+
+class StubPool:
+    def __init__(self, *bodies):
+        self.bodies = list(bodies)
+        self.payloads = []
+
+    def urlopen(self, method, url, body=None, headers=None, timeout=None):
+        return StubResponse(self.request(method, url, body))
+
+    def request(self, method, url, body=None, headers=None, timeout=None):
+        self.payloads.append(json.loads(body))
+        return json.dumps(self.bodies.pop(0)).encode()
+
+
+class TestSyncState(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'sync.db')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def sync(self, output_format, *bodies, payload='{}'):
+        config = SimpleNamespace(
+            node_name='client', ssl_context=None, timeout=5.0, hedge_after=None, compress_requests=None,
+            sync_state=self.path)
+        pool = StubPool(*bodies)
+        stream = io.BytesIO()
+        with OutputWriter(stream=stream, format=output_format) as output:
+            write_query(
+                output, config, 'secret', 'https://ise/pxgrid/session/getSessions', payload,
+                pool=pool, sync_service='com.cisco.ise.session')
+        return pool.payloads[0], stream.getvalue()
+
+    def test_second_sync_is_incremental_and_merged(self):
+        first = {'sessions': [
+            {'callingStationId': 'A', 'state': 'STARTED'},
+            {'callingStationId': 'B', 'state': 'STARTED'}]}
+        second = {'sessions': [{'callingStationId': 'A', 'state': 'DISCONNECTED'}]}
+        payload, output = self.sync('ndjson', first)
+        self.assertNotIn('startTimestamp', payload)
+        self.assertEqual(len(output.splitlines()), 2)
+        with SyncState(self.path) as state:
+            watermark = state.watermark('com.cisco.ise.session', 'getSessions')
+
+        payload, output = self.sync('json', second)
+        self.assertEqual(payload['startTimestamp'], watermark)
+        self.assertEqual(json.loads(output), second)
+
+        with SyncState(self.path) as state:
+            self.assertEqual(
+                list(state.snapshot('com.cisco.ise.session', 'getSessions')),
+                [{'callingStationId': 'A', 'state': 'DISCONNECTED'},
+                 {'callingStationId': 'B', 'state': 'STARTED'}])
+
+    def test_explicit_start_timestamp_and_filter_scope(self):
+        body = {'sessions': [{'callingStationId': 'A'}]}
+        payload = json.dumps({'startTimestamp': '2020-01-01T00:00:00.000+00:00', 'filter': 'x'})
+        sent, _ = self.sync('ndjson', body, payload=payload)
+        self.assertEqual(sent['startTimestamp'], '2020-01-01T00:00:00.000+00:00')
+        with SyncState(self.path) as state:
+            self.assertIsNone(state.watermark('com.cisco.ise.session', 'getSessions'))
+            self.assertIsNotNone(state.watermark('com.cisco.ise.session', 'getSessions', scope='x'))
+            self.assertEqual(state.count('com.cisco.ise.session', 'getSessions', scope='x'), 1)
+
+    def test_failed_sync_keeps_watermark(self):
+        with SyncState(self.path, clock=lambda: 1000.0) as state:
+            watermark = state.begin()
+            state.merge('svc', 'getSessions', [{'callingStationId': 'A'}])
+            state.rollback()
+            self.assertIsNone(state.watermark('svc', 'getSessions'))
+            self.assertEqual(state.count('svc', 'getSessions'), 0)
+            self.assertEqual(watermark, '1970-01-01T00:15:40.000+00:00')
+
+    def test_format_timestamp(self):
+        when = datetime.datetime(2021, 1, 1, 1, 2, 3, 456789, tzinfo=datetime.timezone(datetime.timedelta(hours=1)))
+        self.assertEqual(format_timestamp(when), '2021-01-01T00:02:03.456+00:00')
+
+
+if __name__ == '__main__':
+    unittest.main()
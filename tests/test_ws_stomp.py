@@ -1,17 +1,91 @@
 import asyncio
 import io
+import json
+import time
 import unittest
 
+from websockets.exceptions import ConnectionClosedError
+
+from pxgrid_util.backoff import ExponentialBackoff
 from pxgrid_util.stomp import StompFrame
+from pxgrid_util.ws_stomp import Publisher
+from pxgrid_util.ws_stomp import StompError
 from pxgrid_util.ws_stomp import WebSocketStomp
 
 
 class StubWebSocket:
-    def __init__(self):
+    def __init__(self, incoming=None):
         self.sent = []
+        self.incoming = list(incoming or [])
+        self.closed = False
+
+    async def send(self, data):
+        self.sent.append(data)
+
+    async def close(self):
+        self.closed = True
+
+    async def recv(self):
+        if not self.incoming:
+            raise EOFError()
+        return self.incoming.pop(0)
+
+
+class ReceiptingWebSocket(StubWebSocket):
+    '''
+    Answers every frame asking for a receipt with a RECEIPT, or with an
+    ERROR once `fail_after` frames have been sent.
+    '''
+
+    def __init__(self, fail_after=None):
+        super().__init__()
+        self.replies = asyncio.Queue()
+        self.fail_after = fail_after
 
     async def send(self, data):
         self.sent.append(data)
+        frame = StompFrame.decode(data)
+        if self.fail_after is not None and len(self.sent) > self.fail_after:
+            self.replies.put_nowait(b'ERROR\nmessage:quota exceeded\n\n\0')
+        elif 'receipt' in frame.headers:
+            self.replies.put_nowait(b'RECEIPT\nreceipt-id:%s\n\n\0' % frame.headers['receipt'].encode())
+
+    async def recv(self):
+        return await self.replies.get()
+
+
+async def payloads(count):
+    for n in range(count):
+        yield {'n': n}
+
+
+class FlakyWebSocketStomp(WebSocketStomp):
+    '''
+    Fails the first `failures` connects, then serves each connection from
+    `sessions` (lists of incoming messages) and drops it when they run out.
+    '''
+
+    def __init__(self, failures, sessions):
+        super().__init__("wss://a", "user", "secret", None)
+        self.failures = failures
+        self.sessions = list(sessions)
+        self.connected = []
+
+    async def connect(self):
+        self.connected.append((self.ws_url, self.password))
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionRefusedError()
+        self.ws = StubWebSocket(self.sessions.pop(0))
+        incoming = self.ws.incoming
+
+        async def recv():
+            if incoming:
+                return incoming.pop(0)
+            if self.sessions:
+                raise ConnectionClosedError(None, None)
+            await asyncio.Event().wait()
+        self.ws.recv = recv
 
 
 class TestWebSocketStomp(unittest.TestCase):
@@ -19,10 +93,10 @@ class TestWebSocketStomp(unittest.TestCase):
         async def run_test():
             ws = WebSocketStomp("wss://example", "user", "secret", None)
             ws.ws = StubWebSocket()
-            await ws.stomp_subscribe("/topic/com.cisco.ise.session")
+            subscription = await ws.stomp_subscribe("/topic/com.cisco.ise.session")
             frame = StompFrame.parse(io.StringIO(ws.ws.sent[0].decode("utf-8")))
             self.assertEqual(frame.get_header("destination"), "/topic/com.cisco.ise.session")
-            self.assertEqual(frame.get_header("id"), "my-id")
+            self.assertEqual(frame.get_header("id"), subscription.id)
             self.assertNotIn("filter", frame.headers)
 
         asyncio.run(run_test())
@@ -40,6 +114,226 @@ class TestWebSocketStomp(unittest.TestCase):
 
         asyncio.run(run_test())
 
+    def test_frames_yields_every_frame_in_a_message(self):
+        async def run_test():
+            ws = WebSocketStomp("wss://example", "user", "secret", None)
+            ws.ws = StubWebSocket([
+                b"CONNECTED\nversion:1.2\n\n\0",
+                b"MESSAGE\nmessage-id:1\n\n{}\0MESSAGE\nmessage-id:2\n\n[]\0",
+            ])
+            commands = []
+            with self.assertRaises(EOFError):
+                async for frame in ws.frames():
+                    commands.append(frame.get_command())
+            self.assertEqual(commands, ["CONNECTED", "MESSAGE", "MESSAGE"])
+
+        asyncio.run(run_test())
+
+    def test_stomp_read_message_keeps_batched_frames(self):
+        async def run_test():
+            ws = WebSocketStomp("wss://example", "user", "secret", None)
+            ws.ws = StubWebSocket([
+                b"MESSAGE\nmessage-id:1\n\n{}\0MESSAGE\nmessage-id:2\n\n[]\0",
+            ])
+            self.assertEqual(await ws.stomp_read_message(), b"{}")
+            self.assertEqual(await ws.stomp_read_message(), b"[]")
+
+        asyncio.run(run_test())
+
+    def test_subscriptions_get_unique_ids(self):
+        async def run_test():
+            ws = WebSocketStomp("wss://example", "user", "secret", None)
+            ws.ws = StubWebSocket()
+            first = await ws.stomp_subscribe("/topic/com.cisco.ise.session")
+            second = await ws.stomp_subscribe("/topic/com.cisco.ise.config.anc")
+            self.assertNotEqual(first.id, second.id)
+            await ws.stomp_unsubscribe(first)
+            frame = StompFrame.decode(ws.ws.sent[2])
+            self.assertEqual(frame.get_command(), "UNSUBSCRIBE")
+            self.assertEqual(frame.get_header("id"), first.id)
+            self.assertEqual(list(ws.subscriptions), [second.id])
+
+        asyncio.run(run_test())
+
+    def test_dispatch_routes_by_subscription(self):
+        async def run_test():
+            ws = WebSocketStomp("wss://example", "user", "secret", None)
+            ws.ws = StubWebSocket()
+            sessions = await ws.stomp_subscribe("/topic/com.cisco.ise.session")
+            received = []
+            anc = await ws.stomp_subscribe(
+                "/topic/com.cisco.ise.config.anc", callback=received.append)
+            ws.ws.incoming = [
+                ("MESSAGE\nsubscription:%s\n\n{\"a\": 1}\0"
+                 "MESSAGE\nsubscription:%s\n\n{\"s\": 1}\0"
+                 "MESSAGE\nsubscription:unknown\n\n{}\0" % (anc.id, sessions.id)).encode(),
+            ]
+            with self.assertRaises(EOFError):
+                await ws.dispatch()
+            self.assertEqual(received, [b'{"a": 1}'])
+            self.assertEqual(sessions.queue.get_nowait(), b'{"s": 1}')
+            self.assertTrue(sessions.queue.empty())
+
+        asyncio.run(run_test())
+
+
+    def test_run_supervised_resubscribes_after_drop(self):
+        async def run_test():
+            sub_id = "sub-0"
+            message = b"MESSAGE\nsubscription:sub-0\n\n{}\0"
+            ws = FlakyWebSocketStomp(1, [[message], [message]])
+            received = []
+            subscription = await ws.stomp_subscribe("/topic/com.cisco.ise.session", callback=received.append)
+            self.assertEqual(subscription.id, sub_id)
+            task = asyncio.create_task(ws.run_supervised(
+                "ise", backoff=ExponentialBackoff(initial=0.001, jitter=0)))
+            while len(received) < 2:
+                await asyncio.sleep(0.01)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            frames = [StompFrame.decode(data) for data in ws.ws.sent]
+            self.assertEqual([f.get_command() for f in frames], ["CONNECT", "SUBSCRIBE"])
+            self.assertEqual(frames[1].get_header("id"), sub_id)
+            self.assertEqual(len(ws.connected), 3)
+            self.assertEqual(ws.reconnect_stats()["reconnects"], 1)
+
+        asyncio.run(run_test())
+
+    def test_run_supervised_fails_over_with_fresh_secret(self):
+        async def run_test():
+            ws = FlakyWebSocketStomp(1, [[]])
+
+            async def secret_provider(node_name):
+                return "fresh-" + node_name
+
+            task = asyncio.create_task(ws.run_supervised(
+                "ise-a", nodes=[("wss://a", "ise-a"), ("wss://b", "ise-b")],
+                secret_provider=secret_provider,
+                backoff=ExponentialBackoff(initial=0.001, jitter=0)))
+            while len(ws.connected) < 2:
+                await asyncio.sleep(0.01)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            self.assertEqual(ws.connected, [("wss://a", "secret"), ("wss://b", "fresh-ise-b")])
+
+        asyncio.run(run_test())
+
+    def test_run_supervised_backs_off_when_connections_drop_at_once(self):
+        class DroppingWebSocketStomp(WebSocketStomp):
+            def __init__(self):
+                super().__init__("wss://a", "user", "secret", None)
+                self.sockets = []
+
+            async def connect(self):
+                self.ws = StubWebSocket()
+                self.sockets.append(self.ws)
+
+                async def recv():
+                    raise ConnectionClosedError(None, None)
+                self.ws.recv = recv
+
+        async def run_test():
+            ws = DroppingWebSocketStomp()
+            task = asyncio.create_task(ws.run_supervised(
+                "ise", backoff=ExponentialBackoff(initial=0.05, jitter=0)))
+            await asyncio.sleep(0.3)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            # 0.05 + 0.1 + 0.2s of backoff, rather than a tight loop
+            self.assertLessEqual(len(ws.sockets), 4)
+            self.assertTrue(all(s.closed for s in ws.sockets[:-1]))
+
+        asyncio.run(run_test())
+
+    def test_run_supervised_resets_backoff_after_connected(self):
+        async def run_test():
+            connected = b"CONNECTED\nversion:1.2\n\n\0"
+            ws = FlakyWebSocketStomp(0, [[connected], [connected], [connected]])
+            backoff = ExponentialBackoff(initial=0.001, jitter=0)
+            task = asyncio.create_task(ws.run_supervised("ise", backoff=backoff))
+            while len(ws.connected) < 3:
+                await asyncio.sleep(0.01)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            self.assertEqual(backoff.attempt, 1)
+
+        asyncio.run(run_test())
+
+
+class TestPublisher(unittest.TestCase):
+    def test_publishes_every_payload(self):
+        async def run_test():
+            ws = WebSocketStomp("wss://example", "user", "secret", None)
+            ws.ws = StubWebSocket()
+            stats = await ws.publish('/topic/x', payloads(50))
+            self.assertEqual(stats['messages'], 50)
+            self.assertEqual(stats['frames'], 50)
+            self.assertEqual(stats['bytes'], sum(len(f) for f in ws.ws.sent))
+            frame = StompFrame.decode(ws.ws.sent[7])
+            self.assertEqual(frame.command, 'SEND')
+            self.assertEqual(frame.headers['destination'], '/topic/x')
+            self.assertEqual(json.loads(bytes(frame.content)), {'n': 7})
+
+        asyncio.run(run_test())
+
+    def test_coalesces_waiting_payloads_from_a_queue(self):
+        async def run_test():
+            ws = WebSocketStomp("wss://example", "user", "secret", None)
+            ws.ws = StubWebSocket()
+            queue = asyncio.Queue()
+            for n in range(25):
+                queue.put_nowait(b'{"n":%d}' % n)
+            queue.put_nowait(None)
+            stats = await Publisher(ws, '/topic/x', coalesce=10).run(queue)
+            self.assertEqual((stats['messages'], stats['frames']), (25, 3))
+            bodies = [json.loads(bytes(StompFrame.decode(f).content)) for f in ws.ws.sent]
+            self.assertEqual([len(b) for b in bodies], [10, 10, 5])
+            self.assertEqual(bodies[2][-1], {'n': 24})
+
+        asyncio.run(run_test())
+
+    def test_receipts_confirm_every_frame(self):
+        async def run_test():
+            ws = WebSocketStomp("wss://example", "user", "secret", None)
+            ws.ws = ReceiptingWebSocket()
+            stats = await ws.publish('/topic/x', payloads(30), receipts=True, window=4)
+            self.assertEqual(stats['confirmed'], 30)
+            self.assertEqual(ws.receipts, {})
+
+            ws.ws = ReceiptingWebSocket(fail_after=5)
+            with self.assertRaises(StompError):
+                await ws.publish('/topic/x', payloads(30), receipts=True, window=4)
+
+        asyncio.run(run_test())
+
+    def test_rate(self):
+        async def run_test():
+            ws = WebSocketStomp("wss://example", "user", "secret", None)
+            ws.ws = StubWebSocket()
+            start = time.monotonic()
+            stats = await ws.publish('/topic/x', payloads(30), rate=100.0)
+            self.assertEqual(stats['messages'], 30)
+            # a burst of 10, then 20 more at 100/s
+            self.assertGreaterEqual(time.monotonic() - start, 0.18)
+
+        asyncio.run(run_test())
+
+
+class TestExponentialBackoff(unittest.TestCase):
+    def test_delays_grow_to_maximum_and_reset(self):
+        backoff = ExponentialBackoff(initial=1.0, maximum=5.0, jitter=0)
+        self.assertEqual([backoff.next_delay() for _ in range(5)], [1.0, 2.0, 4.0, 5.0, 5.0])
+        backoff.reset()
+        self.assertEqual(backoff.next_delay(), 1.0)
+
+    def test_jitter_stays_within_bounds(self):
+        backoff = ExponentialBackoff(initial=8.0, jitter=0.5, rng=lambda: 1.0)
+        self.assertEqual(backoff.next_delay(), 4.0)
+
 
 if __name__ == "__main__":
     unittest.main()